@@ -1,6 +1,7 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy import event
 from cryptography.fernet import Fernet
 import os
 from dotenv import load_dotenv
@@ -19,9 +20,55 @@ def create_app():
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key-change-in-production')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///sql_visualizer.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    app.config['PROFILE_ADMIN_TOKEN'] = os.getenv('PROFILE_ADMIN_TOKEN')
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    app.config['PROFILE_INTERVAL'] = float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000
+    app.config['PROFILE_ENDPOINTS'] = ('main.execute_sql', 'main.get_query_visualization')
+    app.config['GEMINI_RATE_PER_MINUTE'] = float(os.getenv('GEMINI_RATE_PER_MINUTE', '30'))
+    app.config['GEMINI_BURST'] = int(os.getenv('GEMINI_BURST', '10'))
+    app.config['GEMINI_MAX_RETRIES'] = int(os.getenv('GEMINI_MAX_RETRIES', '3'))
+    app.config['GEMINI_BREAKER_THRESHOLD'] = int(os.getenv('GEMINI_BREAKER_THRESHOLD', '5'))
+    app.config['GEMINI_BREAKER_RESET'] = float(os.getenv('GEMINI_BREAKER_RESET', '30'))
+    app.config['GEMINI_QUEUE_TIMEOUT'] = float(os.getenv('GEMINI_QUEUE_TIMEOUT', '30'))
+    app.config['SHARED_TEMPLATES'] = os.getenv('SHARED_TEMPLATES', 'true').lower() in ('1', 'true', 'yes')
+    app.config['HISTORY_WRITE_BEHIND'] = os.getenv('HISTORY_WRITE_BEHIND', 'true').lower() in ('1', 'true', 'yes')
+    app.config['HISTORY_QUEUE_SIZE'] = int(os.getenv('HISTORY_QUEUE_SIZE', '10000'))
+    app.config['HISTORY_QUEUE_ROWS'] = int(os.getenv('HISTORY_QUEUE_ROWS', '1000000'))
+    app.config['HISTORY_BATCH_SIZE'] = int(os.getenv('HISTORY_BATCH_SIZE', '200'))
+    app.config['HISTORY_FLUSH_INTERVAL'] = float(os.getenv('HISTORY_FLUSH_INTERVAL_MS', '1000')) / 1000
+    
+    app.config['SANDBOX_QUOTA_MB'] = float(os.getenv('SANDBOX_QUOTA_MB', '200'))
+    app.config['SANDBOX_MAINTENANCE'] = os.getenv('SANDBOX_MAINTENANCE', 'true').lower() in ('1', 'true', 'yes')
+    app.config['SANDBOX_MAINTENANCE_INTERVAL'] = float(os.getenv('SANDBOX_MAINTENANCE_INTERVAL_MINUTES', '10')) * 60
+    app.config['SANDBOX_IDLE_SECONDS'] = float(os.getenv('SANDBOX_IDLE_MINUTES', '15')) * 60
+    app.config['SANDBOX_ARCHIVE_DAYS'] = float(os.getenv('SANDBOX_ARCHIVE_DAYS', '30'))
+    app.config['SANDBOX_VACUUM_RATIO'] = float(os.getenv('SANDBOX_VACUUM_RATIO', '0.2'))
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('IMPORT_MAX_MB', '512')) * 1024 * 1024
+    app.config['COMPRESSION'] = os.getenv('COMPRESSION', 'true').lower() in ('1', 'true', 'yes')
+    app.config['COMPRESSION_MIN_BYTES'] = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+    app.config['COMPRESSION_GZIP_LEVEL'] = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+    app.config['COMPRESSION_BROTLI_QUALITY'] = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5'))
+    app.config['STATIC_CACHING'] = os.getenv('STATIC_CACHING', 'true').lower() in ('1', 'true', 'yes')
+    app.config['STATIC_PRECOMPRESS'] = os.getenv('STATIC_PRECOMPRESS', 'true').lower() in ('1', 'true', 'yes')
+    app.config['WEBGL_MIN_POINTS'] = int(os.getenv('WEBGL_MIN_POINTS', '1000'))
+    app.config['CHART_PAGE_POINTS'] = max(1, int(os.getenv('CHART_PAGE_POINTS', '10000')))
+    
+    app.config['SQLITE_TUNING'] = os.getenv('SQLITE_TUNING', 'true').lower() in ('1', 'true', 'yes')
+    app.config['SQLITE_PRAGMAS'] = {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+        'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536')),  # negative = KiB
+        'temp_store': 'MEMORY'
+    }
+    configure_engine_options(app)
     
     # Initialize extensions with app
     db.init_app(app)
+    configure_sqlite_pragmas(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message_category = 'info'
@@ -41,12 +88,97 @@ def create_app():
     app.register_blueprint(main_bp)
     app.register_blueprint(api_bp)
     
+    # Response compression and content-hashed, precompressed static files.
+    # Registered first so its after_request hook runs last, once bodies are final
+    from app.services import delivery_service
+    delivery_service.init_app(app)
+    
+    # Request latency metrics and Server-Timing header
+    from app.services import metrics_service
+    metrics_service.init_app(app)
+    
+    # Opt-in per-request sampling profiler
+    from app.services import profiling_service
+    profiling_service.init_app(app)
+    
+    # Rate limiting, retries and request coalescing for Gemini calls
+    from app.services import gemini_broker_service
+    gemini_broker_service.init_app(app)
+    
+    # Shared read-only template datasets mounted into every user database
+    from app.services import template_library_service
+    template_library_service.init_app(app)
+    
+    # Batched background writes for query history
+    from app.services import history_logger_service
+    history_logger_service.init_app(app)
+    
+    # Per-fingerprint query statistics maintained as history is written
+    from app.services import query_stats_service
+    query_stats_service.init_app(app)
+    
+    # Full-text search index over query history
+    from app.services import history_search_service
+    history_search_service.init_app(app)
+    
+    # Sandbox database quotas, idle-time maintenance and archival
+    from app.services import sandbox_lifecycle_service
+    sandbox_lifecycle_service.init_app(app)
+    
+    # WebGL threshold and page size for scatter and line charts
+    from app.services import visualization_service
+    visualization_service.init_app(app)
+    
     # Create tables
     with app.app_context():
         db.create_all()
+        query_stats_service.backfill_query_stats()
+        history_search_service.ensure_search_index()
+    
+    # Pre-generate the learning topic catalogue in the background
+    warmup_api_key = os.getenv('LEARNING_WARMUP_API_KEY')
+    if warmup_api_key:
+        from app.services.learning_content_service import start_warmup
+        start_warmup(app, warmup_api_key)
     
     return app
 
+# Database engine configuration
+def configure_engine_options(app):
+    """Size the SQLAlchemy connection pool from the environment"""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        return  # in-memory SQLite uses a single shared connection
+    
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.setdefault('pool_size', int(os.getenv('DB_POOL_SIZE', '5')))
+    options.setdefault('max_overflow', int(os.getenv('DB_MAX_OVERFLOW', '10')))
+    options.setdefault('pool_timeout', float(os.getenv('DB_POOL_TIMEOUT', '30')))
+    options.setdefault('pool_recycle', int(os.getenv('DB_POOL_RECYCLE', '3600')))
+
+def configure_sqlite_pragmas(app):
+    """Apply WAL and related PRAGMAs to every new SQLite connection of the app database"""
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') or not app.config['SQLITE_TUNING']:
+        return
+    
+    pragmas = app.config['SQLITE_PRAGMAS']
+    
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # busy_timeout first so the journal mode switch itself waits for other writers
+            cursor.execute(f"PRAGMA busy_timeout = {int(pragmas['busy_timeout'])}")
+            cursor.execute(f"PRAGMA journal_mode = {pragmas['journal_mode']}")
+            cursor.execute(f"PRAGMA synchronous = {pragmas['synchronous']}")
+            cursor.execute(f"PRAGMA mmap_size = {int(pragmas['mmap_size'])}")
+            cursor.execute(f"PRAGMA cache_size = {int(pragmas['cache_size'])}")
+            cursor.execute(f"PRAGMA temp_store = {pragmas['temp_store']}")
+        finally:
+            cursor.close()
+    
+    with app.app_context():
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+
 # Encryption utilities
 def get_encryption_key():
     key = os.getenv('ENCRYPTION_KEY')
@@ -3,6 +3,19 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from app import db, encrypt_data, decrypt_data
+from app.result_set import ResultSet
+
+class ResultSetJSON(db.TypeDecorator):
+    """JSON column that stores a ResultSet column by column and loads it back as one"""
+    impl = db.JSON
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return value.to_json() if isinstance(value, ResultSet) else value
+    
+    def process_result_value(self, value, dialect):
+        # Older rows hold a list of row dicts; from_json reads both shapes
+        return ResultSet.from_json(value)
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -66,12 +79,67 @@ class SQLQuery(db.Model):
     error_message = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # JSON field to store query results for visualization
-    result_data = db.Column(db.JSON)
+    # Query results for visualization, stored columnar
+    result_data = db.Column(ResultSetJSON)
+    
+    profiles = db.relationship('QueryProfile', backref='sql_query', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<SQLQuery {self.id} by User {self.user_id}>'
 
+class QueryStats(db.Model):
+    """Running aggregates for one normalized query shape (fingerprint) per user"""
+    __table_args__ = (db.UniqueConstraint('user_id', 'fingerprint'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    fingerprint = db.Column(db.String(16), nullable=False)
+    query_type = db.Column(db.String(50))
+    normalized_query = db.Column(db.Text, nullable=False)  # literals replaced with ?
+    calls = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    total_time = db.Column(db.Float, default=0.0)  # in seconds
+    min_time = db.Column(db.Float)
+    max_time = db.Column(db.Float)
+    total_rows = db.Column(db.Integer, default=0)
+    time_buckets = db.Column(db.JSON)  # call counts per latency bucket, for percentiles
+    first_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def mean_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+    
+    @property
+    def error_rate(self):
+        return self.errors / self.calls if self.calls else 0.0
+    
+    def __repr__(self):
+        return f'<QueryStats {self.fingerprint} for User {self.user_id}>'
+
+class SavedQuery(db.Model):
+    """A named query pinned to the dashboard, optionally materialized in the user's database"""
+    __table_args__ = (db.UniqueConstraint('user_id', 'name'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    query_text = db.Column(db.Text, nullable=False)
+    chart_type = db.Column(db.String(20))  # None lets the visualizer choose
+    materialized = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SavedQuery {self.name} for User {self.user_id}>'
+
+class HistorySequence(db.Model):
+    """Next unreserved id for write-behind inserts (hi/lo id allocation)"""
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<HistorySequence {self.name} at {self.next_id}>'
+
 class GeneratedTable(db.Model):
     """Track AI-generated tables and their schemas"""
     id = db.Column(db.Integer, primary_key=True)
@@ -84,3 +152,33 @@ class GeneratedTable(db.Model):
     
     def __repr__(self):
         return f'<GeneratedTable {self.table_name} for User {self.user_id}>'
+
+class QueryProfile(db.Model):
+    """Sampled stack profile captured for a single request"""
+    id = db.Column(db.Integer, primary_key=True)
+    query_id = db.Column(db.Integer, db.ForeignKey('sql_query.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    endpoint = db.Column(db.String(100))
+    duration = db.Column(db.Float)  # in seconds
+    sample_count = db.Column(db.Integer, default=0)
+    collapsed_stacks = db.Column(db.Text)  # flamegraph collapsed-stack format
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<QueryProfile {self.id} for SQLQuery {self.query_id}>'
+
+class LearningContent(db.Model):
+    """Pre-generated learning content stored as a gzip-compressed JSON body"""
+    id = db.Column(db.Integer, primary_key=True)
+    topic_key = db.Column(db.String(100), unique=True, nullable=False)
+    title = db.Column(db.String(200))
+    content_version = db.Column(db.Integer, nullable=False)  # prompt/catalogue version
+    revision = db.Column(db.Integer, default=1)  # bumped on every regeneration
+    body_gzip = db.Column(db.LargeBinary, nullable=False)
+    body_size = db.Column(db.Integer)  # uncompressed size in bytes
+    etag = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<LearningContent {self.topic_key} r{self.revision}>'
@@ -0,0 +1,107 @@
+from array import array
+import numpy as np
+import pandas as pd
+
+# array typecode -> NumPy dtype for packed columns
+PACKED_DTYPES = {'q': np.int64, 'd': np.float64}
+
+def pack_column(values):
+    """Pack an all-integer or all-float column into a typed array; anything else stays a list"""
+    kinds = set(map(type, values))
+    try:
+        if kinds == {int}:
+            return array('q', values)
+        if kinds == {float} or kinds == {int, float}:
+            return array('d', values)
+    except OverflowError:
+        pass  # integers beyond 64 bits
+    return values
+
+class ResultSet:
+    """Query results held column by column.
+
+    Column names are stored once. Integer and float columns without NULLs are
+    packed into array('q') / array('d'), 8 bytes a value; NumPy and pandas
+    views of them share that memory. Other columns are plain lists.
+    """
+
+    __slots__ = ('columns', 'values', 'row_count')
+
+    def __init__(self, columns, values):
+        self.columns = list(columns)
+        self.values = list(values)
+        self.row_count = len(self.values[0]) if self.values else 0
+
+    @classmethod
+    def from_cursor(cls, cursor, batch_size=10000):
+        """Read a cursor in fetchmany batches, transposing each batch into the columns"""
+        columns = [d[0] for d in cursor.description]
+        values = [[] for _ in columns]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for column_values, batch_values in zip(values, zip(*rows)):
+                column_values.extend(batch_values)
+        return cls(columns, [pack_column(v) for v in values])
+
+    @classmethod
+    def from_records(cls, records):
+        """Build from a list of row dicts (history written before results were columnar)"""
+        columns = list(dict.fromkeys(key for record in records[:1] for key in record))
+        for record in records[1:]:
+            for key in record:
+                if key not in columns:
+                    columns.append(key)
+        values = [[record.get(column) for record in records] for column in columns]
+        return cls(columns, [pack_column(v) for v in values])
+
+    @classmethod
+    def from_json(cls, payload):
+        if payload is None:
+            return None
+        if isinstance(payload, list):
+            return cls.from_records(payload)
+        return cls(payload['columns'], [pack_column(v) for v in payload['values']])
+
+    def __len__(self):
+        return self.row_count
+
+    def __bool__(self):
+        return self.row_count > 0
+
+    def __repr__(self):
+        return f'<ResultSet {self.row_count} rows x {len(self.columns)} columns>'
+
+    def head(self, n):
+        """First n rows; slices of packed columns stay packed"""
+        return ResultSet(self.columns, [v[:n] for v in self.values])
+
+    def rows(self):
+        return zip(*self.values)
+
+    def records(self, limit=None):
+        """Row dicts, for callers that need them; prefer the columns"""
+        values = [v[:limit] for v in self.values] if limit is not None else self.values
+        return [dict(zip(self.columns, row)) for row in zip(*values)]
+
+    def column_array(self, index):
+        values = self.values[index]
+        if isinstance(values, array):
+            return np.frombuffer(values, dtype=PACKED_DTYPES[values.typecode])
+        return values
+
+    def to_dataframe(self):
+        """DataFrame whose numeric columns are views of the packed arrays"""
+        return pd.DataFrame(
+            {column: self.column_array(i) for i, column in enumerate(self.columns)},
+            columns=list(dict.fromkeys(self.columns)),
+            copy=False
+        )
+
+    def to_json(self):
+        """JSON-ready columnar form: {'columns': [...], 'values': [[column values], ...]}"""
+        return {
+            'columns': self.columns,
+            'values': [v.tolist() if isinstance(v, array) else v for v in self.values]
+        }
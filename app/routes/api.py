@@ -1,8 +1,25 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
-from app.models import GeneratedTable
-from app.services.gemini_service import GeminiService
+from app.models import GeneratedTable, SQLQuery, SavedQuery
+from app.services.export_service import ExportService, EXPORT_FORMATS
+from app.services.gemini_service import GeminiService, BATCH_TASK_TYPES
+from app.services.import_service import ImportService
+from app.services.index_advisor_service import IndexAdvisorService
+from app.services.learning_content_service import LearningContentStore, topic_key, is_catalogue_topic
+from app.services.query_benchmark_service import QueryBenchmarkService
+from app.services.query_stats_service import top_query_stats, summarize_user, stats_to_dict
+from app.services.sandbox_lifecycle_service import usage
+from app.services.saved_query_service import SavedQueryService, saved_query_to_dict
+from app.services.schema_catalog_service import get_catalog, shared_table_columns
+from app.services.snapshot_service import SnapshotService, SEED_SNAPSHOT
+from app.services.sql_service import SQLService
+from app.services.table_profile_service import TableProfileService
+from app.services.visualization_service import CHART_TYPES
 from app import db
+import gzip
+import json
+import sqlite3
+import tempfile
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -43,17 +60,13 @@ def generate_sample_data():
         if not api_key:
             return jsonify({'error': 'Gemini API key not configured'}), 400
         
-        # Check if table exists
-        table = GeneratedTable.query.filter_by(
-            user_id=current_user.id,
-            table_name=table_name
-        ).first()
-        
-        if not table:
+        # Check if table exists; use its live schema rather than the one recorded at creation
+        schema = SQLService(current_user.id).get_table_schema(table_name)
+        if not schema:
             return jsonify({'error': 'Table not found'}), 404
         
         gemini_service = GeminiService(api_key)
-        result = gemini_service.generate_sample_data(table.table_schema, row_count)
+        result = gemini_service.generate_sample_data(schema, row_count)
         
         return jsonify(result)
         
@@ -108,25 +121,169 @@ def suggest_improvements():
 @login_required
 def get_table_info(table_name):
     try:
+        schema = SQLService(current_user.id).get_table_schema(table_name)
+        if not schema:
+            return jsonify({'error': 'Table not found'}), 404
+        
+        # Tables created with plain SQL have no GeneratedTable record
         table = GeneratedTable.query.filter_by(
             user_id=current_user.id,
             table_name=table_name
         ).first()
         
-        if not table:
-            return jsonify({'error': 'Table not found'}), 404
+        return jsonify({
+            'table_name': table_name,
+            'schema': schema,
+            'sample_data_count': table.sample_data_count if table else None,
+            'created_at': table.created_at.isoformat() if table else None,
+            'created_by_ai': table.created_by_ai if table else False
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/schema')
+@login_required
+def get_schema():
+    """Table and column names for editor autocomplete"""
+    try:
+        sql_service = SQLService(current_user.id)
+        version, tables = get_catalog(sql_service.db_path).snapshot()
+        
+        response = jsonify({
+            'version': version,
+            'tables': tables,
+            'shared_tables': shared_table_columns()
+        })
+        response.set_etag(f"schema-{current_user.id}-{version}")
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/tables/<table_name>/profile')
+@login_required
+def get_table_profile(table_name):
+    """Per-column statistics and histograms computed inside the user's database"""
+    try:
+        bins = min(max(request.args.get('bins', 20, type=int), 1), 100)
+        result = TableProfileService(current_user.id, bins=bins).profile(table_name)
+        if 'error' in result:
+            return jsonify(result), 404
         
+        response = jsonify(result)
+        response.set_etag(f"profile-{current_user.id}-{bins}-{result['data_version']}")
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/query-stats')
+@login_required
+def get_query_stats():
+    """Per-fingerprint query statistics, slowest first by default"""
+    try:
+        sort = request.args.get('sort', 'total_time')
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        stats = top_query_stats(current_user.id, sort=sort, limit=limit)
         return jsonify({
-            'table_name': table.table_name,
-            'schema': table.table_schema,
-            'sample_data_count': table.sample_data_count,
-            'created_at': table.created_at.isoformat(),
-            'created_by_ai': table.created_by_ai
+            'summary': summarize_user(current_user.id),
+            'queries': [stats_to_dict(s) for s in stats]
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/export', methods=['GET', 'POST'])
+@login_required
+def export_results():
+    """Stream a query's results as a CSV, JSONL or Parquet download"""
+    try:
+        # JSON, form posts (playground downloads) and query-string links are all accepted
+        data = request.get_json(silent=True) or request.form or request.args
+        fmt = (data.get('format') or 'csv').lower()
+        compress = str(data.get('gzip', '')).lower() in ('1', 'true', 'yes', 'on')
+        
+        query = data.get('query')
+        query_id = data.get('query_id')
+        if not query and query_id:
+            # Re-run a query from the user's history
+            history = SQLQuery.query.filter_by(id=int(query_id), user_id=current_user.id).first()
+            if not history:
+                return jsonify({'error': 'Query not found'}), 404
+            query = history.query_text
+        
+        export_service = ExportService(current_user.id)
+        error = export_service.validate(query, fmt)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        filename = f"query_results.{extension}"
+        if compress and fmt != 'parquet':
+            mimetype, filename = 'application/gzip', f"{filename}.gz"
+        
+        try:
+            chunks = export_service.stream(query, fmt, compress=compress)
+        except (sqlite3.Error, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={
+                'Content-Disposition': f'attachment; filename={filename}',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/import', methods=['POST'])
+@login_required
+def import_file():
+    """Load an uploaded CSV or Parquet file into a table, streaming NDJSON progress events"""
+    try:
+        upload = request.files.get('file')
+        filename = upload.filename if upload else None
+        fmt = (request.form.get('format') or ImportService.detect_format(filename)).lower()
+        mode = (request.form.get('mode') or 'fail').lower()
+        
+        import_service = ImportService(current_user.id)
+        error = import_service.validate(filename, fmt, mode)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # The upload is closed with the request, so the streamed load reads its own copy
+        spool = tempfile.TemporaryFile()
+        upload.save(spool)
+        spool.seek(0)
+        try:
+            events = import_service.start_import(spool, filename, fmt=fmt,
+                                                 table_name=request.form.get('table_name'), mode=mode)
+        except (sqlite3.Error, ValueError, UnicodeDecodeError) as e:
+            spool.close()
+            return jsonify({'error': str(e)}), 400
+        
+        def generate():
+            try:
+                for event in events:
+                    yield json.dumps(event) + '\n'
+            except Exception as e:
+                # Headers are already sent; the load was rolled back and the client gets an error event
+                yield json.dumps({'event': 'error', 'error': str(e)}) + '\n'
+            finally:
+                spool.close()
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @api_bp.route('/generate-learning-content', methods=['POST'])
 @login_required
 def generate_learning_content():
@@ -134,17 +291,345 @@ def generate_learning_content():
         data = request.get_json()
         topic = data.get('topic')
         
-        if not topic:
+        if not topic or not topic_key(topic):
             return jsonify({'error': 'Topic is required'}), 400
+        
+        if not is_catalogue_topic(topic):
+            # Free-form topics are generated for this request only, never stored
+            api_key = current_user.get_gemini_api_key()
+            if not api_key:
+                return jsonify({'error': 'Gemini API key not configured'}), 400
+            return jsonify(GeminiService(api_key).generate_learning_content(topic.strip()))
             
+        return learning_content_for(topic)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/learning-content/<topic>')
+@login_required
+def get_learning_content(topic):
+    try:
+        if not is_catalogue_topic(topic):
+            return jsonify({'error': f'Unknown learning topic {topic}; '
+                                     f'use POST /api/generate-learning-content for other topics'}), 404
+        return learning_content_for(topic)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def learning_content_for(topic):
+    """Serve a catalogue topic from the store, generating it on first request"""
+    store = LearningContentStore()
+    record = store.get(topic)
+    
+    if record is None:
         api_key = current_user.get_gemini_api_key()
         if not api_key:
             return jsonify({'error': 'Gemini API key not configured'}), 400
+        
+        record, error = store.generate(topic, GeminiService(api_key))
+        if error:
+            return jsonify({'error': error})
+    
+    # The stored body is already JSON and already gzip-compressed
+    if request.accept_encodings['gzip']:
+        response = Response(record.body_gzip, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(record.body_gzip), mimetype='application/json')
+    
+    response.set_etag(record.etag)
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response.make_conditional(request)
+
+@api_bp.route('/benchmark-queries', methods=['POST'])
+@login_required
+def benchmark_queries():
+    """Time two or more read-only query variants and check they return the same rows"""
+    try:
+        data = request.get_json() or {}
+        queries = data.get('queries')
+        
+        try:
+            benchmark_service = QueryBenchmarkService(
+                current_user.id,
+                runs=data.get('runs', 5),
+                warmup=data.get('warmup', 1),
+                cold_runs=data.get('cold_runs', 3)
+            )
+        except (TypeError, ValueError):
+            return jsonify({'error': 'runs, warmup and cold_runs must be integers'}), 400
+        
+        error = benchmark_service.validate(queries)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        try:
+            return jsonify(benchmark_service.benchmark(queries))
+        except (sqlite3.Error, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/index-advisor')
+@login_required
+def index_advisor():
+    try:
+        advisor = IndexAdvisorService(current_user.id)
+        return jsonify(advisor.recommend())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/index-advisor/apply', methods=['POST'])
+@login_required
+def apply_index():
+    try:
+        data = request.get_json()
+        table_name = data.get('table')
+        columns = data.get('columns') or []
+        
+        if not table_name or not isinstance(columns, list):
+            return jsonify({'error': 'Table and a list of columns are required'}), 400
+        
+        advisor = IndexAdvisorService(current_user.id)
+        result = advisor.apply_index(table_name, columns)
+        
+        if 'error' in result:
+            return jsonify(result), 400
+        return jsonify(result)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/ai/batch', methods=['POST'])
+@login_required
+def ai_batch():
+    try:
+        data = request.get_json()
+        tasks = data.get('tasks') if data else None
+        
+        if not tasks or not isinstance(tasks, list):
+            return jsonify({'error': 'A list of tasks is required'}), 400
+        
+        if len(tasks) > 10:
+            return jsonify({'error': 'At most 10 tasks can be batched'}), 400
+        
+        normalized = []
+        for index, task in enumerate(tasks):
+            task_type = task.get('type') if isinstance(task, dict) else None
+            if task_type not in BATCH_TASK_TYPES:
+                return jsonify({'error': f'Unknown task type: {task_type}'}), 400
             
+            input_field = BATCH_TASK_TYPES[task_type][0]
+            if not task.get(input_field):
+                return jsonify({'error': f'Task {index} requires a {input_field}'}), 400
+            
+            normalized.append({
+                'id': str(task.get('id', index)),
+                'type': task_type,
+                input_field: task[input_field]
+            })
+        
+        api_key = current_user.get_gemini_api_key()
+        if not api_key:
+            return jsonify({'error': 'Gemini API key not configured'}), 400
+        
         gemini_service = GeminiService(api_key)
-        result = gemini_service.generate_learning_content(topic)
+        return jsonify(gemini_service.run_batch(normalized))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/snapshots')
+@login_required
+def list_snapshots():
+    try:
+        return jsonify({'snapshots': SnapshotService(current_user.id).list_snapshots()})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/snapshots', methods=['POST'])
+@login_required
+def create_snapshot():
+    try:
+        data = request.get_json()
+        name = data.get('name')
+        
+        if not name:
+            return jsonify({'error': 'Snapshot name is required'}), 400
+        
+        return jsonify(SnapshotService(current_user.id).create_snapshot(name))
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/snapshots/<name>/restore', methods=['POST'])
+@login_required
+def restore_snapshot(name):
+    try:
+        result = SnapshotService(current_user.id).restore_snapshot(name)
+        if 'error' in result:
+            return jsonify(result), 404
+        SQLService(current_user.id).reconcile_generated_tables()
+        return jsonify(result)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/snapshots/<name>', methods=['DELETE'])
+@login_required
+def delete_snapshot(name):
+    try:
+        result = SnapshotService(current_user.id).delete_snapshot(name)
+        if 'error' in result:
+            return jsonify(result), 404
         return jsonify(result)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/reset-dataset', methods=['POST'])
+@login_required
+def reset_dataset():
+    try:
+        result = SnapshotService(current_user.id).restore_snapshot(SEED_SNAPSHOT)
+        if 'error' in result:
+            return jsonify({'error': 'No seeded dataset to reset to yet'}), 404
+        SQLService(current_user.id).reconcile_generated_tables()
+        return jsonify(result)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/sandbox-usage')
+@login_required
+def sandbox_usage():
+    """Size of the user's sandbox database against its quota"""
+    try:
+        sql_service = SQLService(current_user.id)
+        return jsonify(usage(sql_service.db_path))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/saved-queries')
+@login_required
+def list_saved_queries():
+    try:
+        saved_query_service = SavedQueryService(current_user.id)
+        states = saved_query_service.states()
+        saved_queries = SavedQuery.query.filter_by(user_id=current_user.id)\
+                                        .order_by(SavedQuery.created_at.desc()).all()
+        return jsonify({'saved_queries': [saved_query_to_dict(q, states.get(q.id)) for q in saved_queries]})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/saved-queries', methods=['POST'])
+@login_required
+def create_saved_query():
+    """Save a query for the dashboard; materialized ones are computed right away"""
+    try:
+        data = request.get_json() or {}
+        chart_type = data.get('chart_type') or None
+        if chart_type and chart_type not in CHART_TYPES:
+            return jsonify({'error': f'Unknown chart type {chart_type}'}), 400
+        
+        saved_query_service = SavedQueryService(current_user.id)
+        try:
+            saved_query = saved_query_service.save(
+                (data.get('name') or '').strip(),
+                data.get('query'),
+                chart_type=chart_type,
+                materialized=bool(data.get('materialized'))
+            )
+        except (sqlite3.Error, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        states = saved_query_service.states()
+        return jsonify(saved_query_to_dict(saved_query, states.get(saved_query.id))), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/saved-queries/<int:saved_query_id>', methods=['DELETE'])
+@login_required
+def delete_saved_query(saved_query_id):
+    try:
+        saved_query = SavedQuery.query.filter_by(id=saved_query_id, user_id=current_user.id).first()
+        if not saved_query:
+            return jsonify({'error': 'Saved query not found'}), 404
+        
+        SavedQueryService(current_user.id).delete(saved_query)
+        return jsonify({'success': True})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/saved-queries/<int:saved_query_id>/refresh', methods=['POST'])
+@login_required
+def refresh_saved_query(saved_query_id):
+    try:
+        saved_query = SavedQuery.query.filter_by(id=saved_query_id, user_id=current_user.id).first()
+        if not saved_query:
+            return jsonify({'error': 'Saved query not found'}), 404
+        if not saved_query.materialized:
+            return jsonify({'error': 'Only materialized queries can be refreshed'}), 400
+        
+        saved_query_service = SavedQueryService(current_user.id)
+        status = saved_query_service.ensure_fresh(saved_query, force=request.args.get('force') == '1')
+        result = saved_query_to_dict(saved_query, saved_query_service.states().get(saved_query.id))
+        result['status'] = status
+        return jsonify(result)
+        
+    except sqlite3.Error as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/saved-queries/<int:saved_query_id>/results')
+@login_required
+def saved_query_results(saved_query_id):
+    try:
+        saved_query = SavedQuery.query.filter_by(id=saved_query_id, user_id=current_user.id).first()
+        if not saved_query:
+            return jsonify({'error': 'Saved query not found'}), 404
+        
+        limit = min(request.args.get('limit', 1000, type=int), 10000)
+        return jsonify(SavedQueryService(current_user.id).results(saved_query, limit=limit))
+        
+    except (sqlite3.Error, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/saved-queries/<int:saved_query_id>/visualization')
+@login_required
+def saved_query_visualization(saved_query_id):
+    """Chart for a saved query, read from its materialization without re-running it"""
+    try:
+        saved_query = SavedQuery.query.filter_by(id=saved_query_id, user_id=current_user.id).first()
+        if not saved_query:
+            return jsonify({'error': 'Saved query not found'}), 404
+        
+        chart_type = request.args.get('type')
+        if chart_type and chart_type not in CHART_TYPES:
+            return jsonify({'error': f'Unknown chart type {chart_type}'}), 400
+        
+        return jsonify(SavedQueryService(current_user.id).visualization(saved_query, chart_type=chart_type))
+        
+    except (sqlite3.Error, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, current_app, Response, g
 from flask_login import login_required, current_user
-from app.models import SQLQuery, GeneratedTable
+from app.models import SQLQuery, GeneratedTable, QueryProfile, SavedQuery
 from app.services.gemini_service import GeminiService
 from app.services.sql_service import SQLService
-from app import db
+from app.services.metrics_service import metrics, span
+from app.services.template_library_service import template_tables
+from app.services.history_logger_service import history_logger
+from app.services.history_search_service import search_history, SearchResultsPage
+from app.services.query_stats_service import summarize_user, top_query_stats, stats_to_dict
 import json
 
 main_bp = Blueprint('main', __name__)
@@ -20,16 +24,29 @@ def dashboard():
                                  .order_by(SQLQuery.created_at.desc())\
                                  .limit(10).all()
     
-    # Get user's generated tables
+    # Summaries come from the per-fingerprint aggregates, not the raw history
+    query_summary = summarize_user(current_user.id)
+    slow_queries = top_query_stats(current_user.id, sort='mean_time', limit=5)
+    
+    # Get user's generated tables, skipping any the user has since dropped
+    live_tables = set(SQLService(current_user.id).get_table_list())
     generated_tables = GeneratedTable.query.filter_by(user_id=current_user.id)\
                                           .order_by(GeneratedTable.created_at.desc())\
                                           .all()
+    generated_tables = [t for t in generated_tables if t.table_name in live_tables]
+    
+    # Saved query charts load asynchronously from their materializations
+    saved_queries = SavedQuery.query.filter_by(user_id=current_user.id)\
+                                    .order_by(SavedQuery.created_at.desc()).all()
     
     # Check if user has API key
     has_api_key = current_user.get_gemini_api_key() is not None
     
     return render_template('dashboard.html', 
                          recent_queries=recent_queries,
+                         saved_queries=saved_queries,
+                         query_summary=query_summary,
+                         slow_queries=slow_queries,
                          generated_tables=generated_tables,
                          has_api_key=has_api_key)
 
@@ -40,10 +57,16 @@ def sql_playground():
     if not current_user.get_gemini_api_key():
         return render_template('no_api_key.html')
     
-    # Get user's tables
+    # Get user's tables as they exist in the database right now
+    live_tables = SQLService(current_user.id).get_table_list()
     generated_tables = GeneratedTable.query.filter_by(user_id=current_user.id).all()
+    generated_tables = [t for t in generated_tables if t.table_name in live_tables]
+    
+    # Shared template tables the user has not copied into their own database yet
+    own_tables = {name.lower() for name in live_tables}
+    shared_tables = sorted(name for _, name in template_tables().values() if name.lower() not in own_tables)
     
-    return render_template('sql_playground.html', tables=generated_tables)
+    return render_template('sql_playground.html', tables=generated_tables, shared_tables=shared_tables)
 
 @main_bp.route('/execute-sql', methods=['POST'])
 @login_required
@@ -66,19 +89,26 @@ def execute_sql():
         # Check if query requires table creation
         result = sql_service.execute_query_with_ai_assistance(query, gemini_service)
         
-        # Log the query
-        sql_query = SQLQuery(
-            user_id=current_user.id,
-            query_text=query,
-            query_type=result.get('query_type', 'UNKNOWN'),
-            execution_time=result.get('execution_time', 0),
-            result_count=result.get('result_count', 0),
-            result_data=result.get('data', []),
-            error_message=result.get('error')
-        )
+        # Log the query; the write itself happens in the background
+        with span('history_enqueue'):
+            query_id = history_logger.log(
+                user_id=current_user.id,
+                query_text=query,
+                query_type=result.get('query_type', 'UNKNOWN'),
+                execution_time=result.get('execution_time', 0),
+                result_count=result.get('result_count', 0),
+                result_data=result.get('result_set'),
+                error_message=result.get('error')
+            )
+        
+        # Used by the profiler to attach samples and by the playground for charts
+        g.profile_query_id = query_id
+        result['query_id'] = query_id
         
-        db.session.add(sql_query)
-        db.session.commit()
+        # Column names once plus one array per column, instead of an object per row
+        result_set = result.pop('result_set', None)
+        if result_set is not None:
+            result.update(result_set.to_json())
         
         return jsonify(result)
         
@@ -90,17 +120,35 @@ def execute_sql():
 def get_query_visualization(query_id):
     try:
         query = SQLQuery.query.filter_by(id=query_id, user_id=current_user.id).first()
+        if not query:
+            # Not flushed yet: read it from the write-behind queue
+            pending = history_logger.get_pending(query_id)
+            if pending and pending['user_id'] == current_user.id:
+                query = SQLQuery(**pending)
         if not query:
             return jsonify({'error': 'Query not found'}), 404
         
-        # Generate visualization based on query type and results
-        from app.services.visualization_service import VisualizationService
-        viz_service = VisualizationService()
+        # An explicit chart type can be requested with ?type=; scatter and
+        # line charts fetch their later pages with ?offset=
+        from app.services.visualization_service import VisualizationService, CHART_TYPES
+        chart_type = request.args.get('type')
+        if chart_type and chart_type not in CHART_TYPES:
+            return jsonify({'error': f'Unknown chart type {chart_type}'}), 400
+        offset = request.args.get('offset', 0, type=int)
+        if offset < 0:
+            return jsonify({'error': 'Offset must not be negative'}), 400
+        
+        # Generate visualization based on query type and results; binned
+        # charts can aggregate inside the user's database
+        viz_service = VisualizationService(SQLService(current_user.id))
         
         visualization = viz_service.create_visualization(
             query.result_data,
             query.query_type,
-            query.query_text
+            query.query_text,
+            chart_type=chart_type,
+            total_rows=query.result_count,
+            offset=offset
         )
         
         return jsonify(visualization)
@@ -117,8 +165,90 @@ def learning_materials():
 @login_required
 def query_history():
     page = request.args.get('page', 1, type=int)
-    queries = SQLQuery.query.filter_by(user_id=current_user.id)\
-                           .order_by(SQLQuery.created_at.desc())\
-                           .paginate(page=page, per_page=20, error_out=False)
+    search = request.args.get('search', '').strip()
+    query_type = request.args.get('type') or None
+    status = request.args.get('status') or None
+    filters = {k: v for k, v in (('search', search), ('type', query_type), ('status', status)) if v}
+    
+    if search:
+        # Ranked full-text matches instead of date order
+        results, has_next = search_history(current_user.id, search, page=page, query_type=query_type, status=status)
+        queries = SearchResultsPage(results, page, has_next)
+    else:
+        history = SQLQuery.query.filter_by(user_id=current_user.id)
+        if query_type:
+            history = history.filter_by(query_type=query_type)
+        if status == 'error':
+            history = history.filter(SQLQuery.error_message.isnot(None))
+        elif status == 'success':
+            history = history.filter(SQLQuery.error_message.is_(None))
+        queries = history.order_by(SQLQuery.created_at.desc())\
+                         .paginate(page=page, per_page=20, error_out=False)
+    
+    # Slowest query shapes by total time spent
+    query_stats = [stats_to_dict(s) for s in top_query_stats(current_user.id, sort='total_time', limit=10)]
+    
+    return render_template('query_history.html', queries=queries, query_stats=query_stats, filters=filters)
+
+@main_bp.route('/query-history/search')
+@login_required
+def search_query_history():
+    """Full-text search over the user's history, best matches first"""
+    try:
+        search = request.args.get('q', '').strip()
+        if not search:
+            return jsonify({'error': 'Search text is required'}), 400
+        
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(request.args.get('per_page', 20, type=int), 100)
+        results, has_next = search_history(current_user.id, search, page=page, per_page=per_page,
+                                           query_type=request.args.get('type'),
+                                           status=request.args.get('status'))
+        
+        return jsonify({
+            'page': page,
+            'has_next': has_next,
+            'results': [{
+                'id': r['query'].id,
+                'query_text': r['query'].query_text,
+                'query_type': r['query'].query_type,
+                'error_message': r['query'].error_message,
+                'created_at': r['query'].created_at.isoformat() if r['query'].created_at else None,
+                'highlight': r['query_html'],
+                'error_highlight': r['error_html'],
+                'rank': r['rank']
+            } for r in results]
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@main_bp.route('/metrics')
+def metrics_endpoint():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@main_bp.route('/query-profile/<int:query_id>')
+def download_query_profile(query_id):
+    # Owners can download their own profiles; operators use the admin token
+    token = current_app.config.get('PROFILE_ADMIN_TOKEN')
+    is_admin = bool(token) and request.headers.get('X-Profile-Token') == token
+    if not is_admin and not current_user.is_authenticated:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    profiles = QueryProfile.query.filter_by(query_id=query_id)
+    if not is_admin:
+        profiles = profiles.filter_by(user_id=current_user.id)
+    profile = profiles.order_by(QueryProfile.created_at.desc()).first()
+    
+    if not profile:
+        return jsonify({'error': 'Profile not found'}), 404
     
-    return render_template('query_history.html', queries=queries)
+    return Response(
+        profile.collapsed_stacks or '',
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename=query_{query_id}_profile_{profile.id}.folded'}
+    )
@@ -0,0 +1,185 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import Response, request, send_from_directory
+from app.services.metrics_service import metrics
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+# Text formats worth compressing; images, archives and Parquet are compressed already
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml'
+}
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+metrics.describe('sqlviz_compression_bytes_total',
+                 'Response bytes before (in) and after (out) compression, by encoding')
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def negotiate_encoding(encodings=None):
+    """The client's preferred encoding among those we produce, or None for identity"""
+    return request.accept_encodings.best_match(encodings or supported_encodings())
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+class StaticAsset:
+    """One static file: its content hash and the encodings it was precompressed into"""
+
+    __slots__ = ('path', 'mtime_ns', 'mimetype', 'digest', 'bodies')
+
+    def __init__(self, path, mtime_ns, mimetype, digest, bodies):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.mimetype = mimetype
+        self.digest = digest
+        self.bodies = bodies  # encoding ('identity', 'gzip', 'br') -> bytes
+
+class StaticManifest:
+    """Content hashes and precompressed copies of the app's static files.
+
+    Everything is built once at startup; a file whose mtime changes (editing
+    assets under the dev server) is rebuilt the next time it is asked for.
+    """
+
+    def __init__(self, static_folder, precompress=True):
+        self.static_folder = static_folder
+        self.precompress = precompress
+        self.assets = {}
+        self.lock = threading.Lock()
+
+    def build(self):
+        if not self.static_folder or not os.path.isdir(self.static_folder):
+            return
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                filename = os.path.relpath(os.path.join(root, name), self.static_folder).replace(os.sep, '/')
+                self.get(filename)
+
+    def get(self, filename):
+        """The asset for a static filename, or None if it is not a regular file in the folder"""
+        path = os.path.realpath(os.path.join(self.static_folder, filename))
+        if not path.startswith(os.path.realpath(self.static_folder) + os.sep):
+            return None
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        asset = self.assets.get(filename)
+        if asset is not None and asset.mtime_ns == mtime_ns:
+            return asset
+        with self.lock:
+            asset = self.assets.get(filename)
+            if asset is None or asset.mtime_ns != mtime_ns:
+                asset = self.load(path, mtime_ns)
+                self.assets[filename] = asset
+        return asset
+
+    def load(self, path, mtime_ns):
+        with open(path, 'rb') as f:
+            data = f.read()
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        bodies = {'identity': data}
+        if self.precompress and mimetype in COMPRESSIBLE_TYPES:
+            # Built once, so spend the CPU on the best ratio
+            for encoding, level in (('gzip', 9), ('br', 11)):
+                if encoding in supported_encodings():
+                    compressed = compress(data, encoding, level)
+                    if len(compressed) < len(data):
+                        bodies[encoding] = compressed
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        return StaticAsset(path, mtime_ns, mimetype, digest, bodies)
+
+def static_response(asset, version):
+    """Serve a static asset in the best precompressed encoding the client accepts"""
+    encoding = negotiate_encoding([e for e in ('br', 'gzip') if e in asset.bodies])
+    body = asset.bodies[encoding or 'identity']
+
+    response = Response(body, mimetype=asset.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if len(asset.bodies) > 1:
+        response.vary.add('Accept-Encoding')
+    # Each encoding is a different byte sequence, so it gets its own strong ETag
+    response.set_etag(f"{asset.digest}-{encoding or 'identity'}")
+    if version == asset.digest:
+        # The URL changes whenever the content does, so this copy never goes stale
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE
+    else:
+        response.headers['Cache-Control'] = 'public, no-cache'
+    return response.make_conditional(request)
+
+def compress_response(response, min_bytes, gzip_level, brotli_quality):
+    """Compress a buffered text response in place if the client accepts it and it is big enough"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        # Streams (exports, imports, NDJSON progress) flush as they go and are left alone
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < min_bytes:
+        return response
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+
+    compressed = compress(data, encoding, brotli_quality if encoding == 'br' else gzip_level)
+    if len(compressed) >= len(data):
+        return response
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+
+    # A compressed body is not byte-identical to the uncompressed one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    metrics.inc('sqlviz_compression_bytes_total', {'encoding': encoding, 'direction': 'in'}, amount=len(data))
+    metrics.inc('sqlviz_compression_bytes_total', {'encoding': encoding, 'direction': 'out'}, amount=len(compressed))
+    return response
+
+def init_app(app):
+    """Compress responses, and serve static files content-hashed and precompressed"""
+    if app.config['STATIC_CACHING']:
+        manifest = StaticManifest(app.static_folder, precompress=app.config['STATIC_PRECOMPRESS'])
+        manifest.build()
+
+        @app.url_defaults
+        def add_static_version(endpoint, values):
+            # url_for('static', filename=...) gains ?v=<content hash>
+            if endpoint == 'static' and 'filename' in values and 'v' not in values:
+                asset = manifest.get(values['filename'])
+                if asset is not None:
+                    values['v'] = asset.digest
+
+        def serve_static(filename):
+            asset = manifest.get(filename)
+            if asset is None:
+                return send_from_directory(app.static_folder, filename)
+            return static_response(asset, request.args.get('v'))
+
+        app.view_functions['static'] = serve_static
+
+    if app.config['COMPRESSION']:
+        min_bytes = app.config['COMPRESSION_MIN_BYTES']
+        gzip_level = app.config['COMPRESSION_GZIP_LEVEL']
+        brotli_quality = app.config['COMPRESSION_BROTLI_QUALITY']
+
+        @app.after_request
+        def compress_after_request(response):
+            return compress_response(response, min_bytes, gzip_level, brotli_quality)
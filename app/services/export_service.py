@@ -0,0 +1,219 @@
+import csv
+import io
+import json
+import sqlite3
+import zlib
+from app.services.metrics_service import metrics
+from app.services.sql_service import SQLService
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+metrics.describe('sqlviz_export_rows_total', 'Rows streamed by result exports, by format')
+
+class _ChunkSink:
+    """Write-only file object that hands Parquet bytes back to the generator as they are produced"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+class ExportService:
+    """Stream a query's results as CSV, JSONL or Parquet without holding them in memory"""
+
+    def __init__(self, user_id, batch_size=5000):
+        self.user_id = user_id
+        self.batch_size = batch_size
+
+    def validate(self, query, fmt):
+        if not query:
+            return 'Query is required'
+        if fmt not in EXPORT_FORMATS:
+            return f"Unsupported format {fmt}; use one of {', '.join(EXPORT_FORMATS)}"
+        if fmt == 'parquet' and pa is None:
+            return 'Parquet export requires the optional pyarrow package'
+        return None
+
+    def stream(self, query, fmt, compress=False):
+        """Return a generator of encoded export chunks; gzip applies to CSV and JSONL only.
+
+        The query is prepared before streaming starts so SQL errors can still
+        be reported as a normal error response.
+        """
+        conn, cursor = self.open_cursor(query)
+        batches = self.batches(conn, cursor, fmt)
+        if fmt == 'parquet':
+            try:
+                schema = self.parquet_schema(conn, query, [d[0] for d in cursor.description])
+            except Exception:
+                conn.close()
+                raise
+            chunks = self.encode_parquet(batches, schema)
+        else:
+            chunks = {'csv': self.encode_csv, 'jsonl': self.encode_jsonl}[fmt](batches)
+        if compress and fmt != 'parquet':
+            chunks = self.gzip_chunks(chunks)
+        return (chunk for chunk in chunks if chunk)
+
+    def open_cursor(self, query):
+        conn = SQLService(self.user_id).get_connection()
+        try:
+            # Exports only read; anything else fails instead of modifying the sandbox
+            conn.execute("PRAGMA query_only = ON")
+            cursor = conn.execute(query.strip().rstrip(';'))
+            if cursor.description is None:
+                raise ValueError('Query does not return rows')
+            return conn, cursor
+        except Exception:
+            conn.close()
+            raise
+
+    def batches(self, conn, cursor, fmt):
+        """Yield the column names, then lists of rows, from a fetchmany cursor"""
+        try:
+            yield [d[0] for d in cursor.description]
+
+            total = 0
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                total += len(rows)
+                yield rows
+            metrics.inc('sqlviz_export_rows_total', {'format': fmt}, amount=total)
+        finally:
+            conn.close()
+
+    def encode_csv(self, batches):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(next(batches))
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+
+    def encode_jsonl(self, batches):
+        columns = next(batches)
+        for rows in batches:
+            lines = [json.dumps(dict(zip(columns, row)), default=self.json_default) for row in rows]
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def encode_parquet(self, batches, schema):
+        """One Parquet row group per fetched batch"""
+        next(batches)
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        try:
+            for rows in batches:
+                values = list(zip(*rows))
+                arrays = [self.arrow_array(column_values, field.type) for column_values, field in zip(values, schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    def parquet_schema(self, conn, query, columns):
+        """Arrow schema from the storage classes each column holds across the whole result.
+
+        SQLite columns can mix types from row to row, so the first batch is not
+        enough to type them. One extra pass collects typeof() per column; if
+        the statement cannot be wrapped (PRAGMA, ...), its rows are scanned here.
+        """
+        query = query.strip().rstrip(';')
+        names = [f'c{i}' for i in range(len(columns))]
+        kinds = [set() for _ in columns]
+        try:
+            # The CTE column list renames by position, so duplicate column names are fine
+            row = conn.execute(
+                f"WITH _export({', '.join(names)}) AS ({query}) SELECT "
+                + ', '.join(f"group_concat(DISTINCT typeof({name}))" for name in names)
+                + " FROM _export"
+            ).fetchone()
+            for column_kinds, found in zip(kinds, row):
+                column_kinds.update((found or '').split(','))
+        except sqlite3.Error:
+            cursor = conn.execute(query)
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                for column_kinds, column_values in zip(kinds, zip(*rows)):
+                    column_kinds.update(self.storage_class(v) for v in column_values)
+        return pa.schema([pa.field(name, self.arrow_type(column_kinds)) for name, column_kinds in zip(columns, kinds)])
+
+    @staticmethod
+    def storage_class(value):
+        if value is None:
+            return 'null'
+        return {int: 'integer', float: 'real', bytes: 'blob'}.get(type(value), 'text')
+
+    @staticmethod
+    def arrow_type(kinds):
+        """Arrow type for a column's SQLite storage classes; int/float mixes widen to float, other mixes to text"""
+        kinds = kinds - {'null', ''}
+        if not kinds:
+            return pa.string()
+        if kinds == {'integer'}:
+            return pa.int64()
+        if kinds <= {'integer', 'real'}:
+            return pa.float64()
+        if kinds == {'blob'}:
+            return pa.binary()
+        return pa.string()
+
+    @staticmethod
+    def arrow_array(values, arrow_type):
+        """Convert one column of a batch; the schema already fits every value, so nothing is lost"""
+        if pa.types.is_floating(arrow_type):
+            values = [None if v is None else float(v) for v in values]
+        elif pa.types.is_string(arrow_type):
+            values = [v if v is None or isinstance(v, str) else
+                      v.hex() if isinstance(v, bytes) else str(v) for v in values]
+        return pa.array(values, type=arrow_type)
+
+    @staticmethod
+    def json_default(value):
+        if isinstance(value, bytes):
+            return value.hex()
+        return str(value)
+
+    @staticmethod
+    def gzip_chunks(chunks):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.flush()
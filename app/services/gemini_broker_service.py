@@ -0,0 +1,284 @@
+import hashlib
+import random
+import threading
+import time
+from app.services.metrics_service import metrics
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ('RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'DEADLINE_EXCEEDED', 'INTERNAL', 'timed out')
+
+class GeminiBrokerError(Exception):
+    """Raised when the broker refuses to send a call to Gemini"""
+
+class RateLimitExceeded(GeminiBrokerError):
+    pass
+
+class CircuitOpenError(GeminiBrokerError):
+    pass
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Take one token, waiting up to `timeout` seconds; return False on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """Stops calling a failing upstream until a cool-down period has passed"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Closed: always. Half-open: only the first caller, as a single probe"""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.probing:
+                self.probing = threading.get_ident()
+                return True
+            return False
+
+    def release(self):
+        """End this thread's probe if it finished without a success or retryable failure"""
+        with self.lock:
+            if self.probing == threading.get_ident():
+                self.probing = False
+
+    def retry_in(self):
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            # A failed probe in half-open state re-opens the circuit immediately
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+class _InFlightCall:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class GeminiBroker:
+    """Shared gateway for Gemini calls.
+
+    Applies a per-key token bucket, jittered exponential retry on retryable
+    errors, a per-key circuit breaker, and single-flight coalescing so
+    concurrent identical requests with the same API key share one upstream call.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.breakers = {}
+        self.in_flight = {}
+        self.waiting = 0
+        self.configure()
+
+    def configure(self, rate_per_minute=30, burst=10, max_retries=3, base_delay=0.5, max_delay=8.0,
+                  failure_threshold=5, reset_timeout=30.0, queue_timeout=30.0):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.queue_timeout = queue_timeout
+        with self.lock:
+            self.buckets.clear()
+            self.breakers.clear()
+
+    def call(self, api_key, func, request_key=None):
+        """Run `func` through the broker, coalescing on `request_key` if given.
+
+        Only calls made with the same API key are coalesced: rate limits,
+        breakers and key errors are per key, and so is who pays for the call.
+        """
+        if request_key is None:
+            return self._execute(api_key, func)
+
+        flight_key = (self.key_id(api_key), request_key)
+        with self.lock:
+            call = self.in_flight.get(flight_key)
+            leader = call is None
+            if leader:
+                call = self.in_flight[flight_key] = _InFlightCall()
+
+        if not leader:
+            metrics.inc('sqlviz_gemini_coalesced_total')
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._execute(api_key, func)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(flight_key, None)
+            call.event.set()
+
+    def _execute(self, api_key, func):
+        key_id = self.key_id(api_key)
+        bucket, breaker = self._limits_for(key_id)
+
+        if not breaker.allow():
+            metrics.inc('sqlviz_gemini_rejected_total', {'reason': 'circuit_open'})
+            raise CircuitOpenError(
+                f'Gemini is temporarily unavailable after repeated failures; retry in {breaker.retry_in():.0f}s'
+            )
+
+        try:
+            attempt = 0
+            while True:
+                with self.lock:
+                    self.waiting += 1
+                try:
+                    acquired = bucket.acquire(self.queue_timeout)
+                finally:
+                    with self.lock:
+                        self.waiting -= 1
+                if not acquired:
+                    metrics.inc('sqlviz_gemini_rejected_total', {'reason': 'rate_limited'})
+                    raise RateLimitExceeded('Too many Gemini requests for this API key; please try again shortly')
+
+                try:
+                    metrics.inc('sqlviz_gemini_calls_total')
+                    result = func()
+                    breaker.record_success()
+                    return result
+                except Exception as e:
+                    retryable = self.is_retryable(e)
+                    if retryable and attempt < self.max_retries:
+                        attempt += 1
+                        metrics.inc('sqlviz_gemini_retries_total')
+                        time.sleep(self.backoff(attempt))
+                        continue
+                    if retryable:
+                        breaker.record_failure()
+                    metrics.inc('sqlviz_gemini_failures_total')
+                    raise
+        finally:
+            # A half-open probe refused by the rate limiter or failing non-retryably
+            breaker.release()
+
+    def _limits_for(self, key_id):
+        with self.lock:
+            bucket = self.buckets.get(key_id)
+            if bucket is None:
+                bucket = self.buckets[key_id] = TokenBucket(self.rate_per_minute / 60.0, self.burst)
+            breaker = self.breakers.get(key_id)
+            if breaker is None:
+                breaker = self.breakers[key_id] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return bucket, breaker
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff delay for the given retry attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    @staticmethod
+    def is_retryable(error):
+        code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+        if code in RETRYABLE_STATUS_CODES:
+            return True
+        message = str(error)
+        return any(marker in message for marker in RETRYABLE_MARKERS)
+
+    @staticmethod
+    def key_id(api_key):
+        """Stable identifier for an API key that never exposes the key itself"""
+        return hashlib.sha256((api_key or '').encode()).hexdigest()[:12]
+
+    @staticmethod
+    def request_key(**kwargs):
+        """Fingerprint a generate_content request for coalescing"""
+        parts = []
+        for name in sorted(kwargs):
+            value = kwargs[name]
+            if hasattr(value, 'model_dump_json'):
+                value = value.model_dump_json(exclude_none=True)
+            parts.append(f'{name}={value}')
+        return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queue_depth': self.waiting,
+                'in_flight': len(self.in_flight),
+                'open_circuits': sum(1 for b in self.breakers.values() if b.state == 'open'),
+                'coalesced_hits': metrics.get_counter('sqlviz_gemini_coalesced_total')
+            }
+
+broker = GeminiBroker()
+
+metrics.describe('sqlviz_gemini_calls_total', 'Gemini API calls sent upstream, including retries')
+metrics.describe('sqlviz_gemini_coalesced_total', 'Gemini requests served by joining an identical in-flight call')
+metrics.describe('sqlviz_gemini_retries_total', 'Gemini calls retried after a retryable error')
+metrics.describe('sqlviz_gemini_failures_total', 'Gemini calls that failed after retries')
+metrics.describe('sqlviz_gemini_rejected_total', 'Gemini calls refused by the rate limiter or circuit breaker')
+metrics.register_gauge('sqlviz_gemini_queue_depth', 'Gemini calls waiting for a rate-limit token',
+                       lambda: broker.stats()['queue_depth'])
+metrics.register_gauge('sqlviz_gemini_in_flight', 'Distinct Gemini calls currently in flight',
+                       lambda: broker.stats()['in_flight'])
+metrics.register_gauge('sqlviz_gemini_open_circuits', 'API keys whose circuit breaker is open',
+                       lambda: broker.stats()['open_circuits'])
+
+def init_app(app):
+    """Apply broker limits from the app configuration"""
+    broker.configure(
+        rate_per_minute=app.config['GEMINI_RATE_PER_MINUTE'],
+        burst=app.config['GEMINI_BURST'],
+        max_retries=app.config['GEMINI_MAX_RETRIES'],
+        failure_threshold=app.config['GEMINI_BREAKER_THRESHOLD'],
+        reset_timeout=app.config['GEMINI_BREAKER_RESET'],
+        queue_timeout=app.config['GEMINI_QUEUE_TIMEOUT']
+    )
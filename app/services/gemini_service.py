@@ -1,17 +1,233 @@
 from google import genai
 from google.genai import types
+from app.services.metrics_service import span
+from app.services.gemini_broker_service import broker
 import json
-import re
+
+TABLE_ANALYSIS_INSTRUCTION = """
+You are a SQL expert and database assistant. Analyze the provided SQL query and:
+
+1. Identify all table names referenced in the query
+2. For each table, generate a realistic schema with appropriate column names and data types
+3. Provide CREATE TABLE statements
+4. Generate INSERT statements with realistic sample data (at least 10 rows per table)
+5. Ensure the data is diverse and realistic for the context
+
+Return a JSON object with a "tables" array and an "explanation" string. Each table has
+"name", "create_statement", "schema" (column, type and constraints per column) and
+"insert_statements". Create referenced tables before the tables that depend on them.
+
+Make the data contextually appropriate. For example:
+- If querying employees, create realistic employee data
+- If querying products, create realistic product data
+- Use appropriate constraints and relationships
+"""
+
+# Tables come before the explanation so a streaming parser can act on each table early
+TABLE_ANALYSIS_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        'tables': types.Schema(
+            type=types.Type.ARRAY,
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    'name': types.Schema(type=types.Type.STRING),
+                    'create_statement': types.Schema(type=types.Type.STRING),
+                    'schema': types.Schema(
+                        type=types.Type.ARRAY,
+                        items=types.Schema(
+                            type=types.Type.OBJECT,
+                            properties={
+                                'column': types.Schema(type=types.Type.STRING),
+                                'type': types.Schema(type=types.Type.STRING),
+                                'constraints': types.Schema(type=types.Type.STRING)
+                            },
+                            required=['column', 'type'],
+                            property_ordering=['column', 'type', 'constraints']
+                        )
+                    ),
+                    'insert_statements': types.Schema(
+                        type=types.Type.ARRAY,
+                        items=types.Schema(type=types.Type.STRING)
+                    )
+                },
+                required=['name', 'create_statement', 'schema', 'insert_statements'],
+                property_ordering=['name', 'create_statement', 'schema', 'insert_statements']
+            )
+        ),
+        'explanation': types.Schema(type=types.Type.STRING)
+    },
+    required=['tables', 'explanation'],
+    property_ordering=['tables', 'explanation']
+)
+
+BATCH_INSTRUCTION = """
+You are a SQL tutor and database optimization expert. You receive a JSON document with
+shared "queries" and a list of "tasks". Complete every task and return one result per
+task with the task's id and its content written in Markdown (## for sections, backticks
+for SQL keywords, code blocks for example queries, bullet points for lists).
+
+Task types:
+- explain: explain the referenced query for a beginner: its purpose, a step-by-step
+  breakdown of each clause, key concepts, the expected output and best practices.
+- suggest: suggest improvements to the referenced query covering performance, best
+  practices, readability, security and alternative approaches, with explanations.
+- learning: write comprehensive learning content for the topic starting with a # title:
+  explanation, syntax and examples, use cases, best practices, common mistakes and
+  practice exercises.
+"""
+
+BATCH_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        'results': types.Schema(
+            type=types.Type.ARRAY,
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    'id': types.Schema(type=types.Type.STRING),
+                    'content': types.Schema(type=types.Type.STRING)
+                },
+                required=['id', 'content'],
+                property_ordering=['id', 'content']
+            )
+        )
+    },
+    required=['results']
+)
+
+# Batch task type -> (input field, output field, single-call fallback method)
+BATCH_TASK_TYPES = {
+    'explain': ('query', 'explanation', 'explain_sql_query'),
+    'suggest': ('query', 'suggestions', 'suggest_query_improvements'),
+    'learning': ('topic', 'content', 'generate_learning_content')
+}
+
+def parse_json_response(text):
+    """Decode the first JSON object in a response, ignoring any surrounding prose"""
+    start = text.find('{')
+    if start == -1:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+        return value if isinstance(value, dict) else None
+    except ValueError:
+        return None
+
+class TableStreamParser:
+    """Incremental JSON scanner for the table analysis response.
+    
+    Text is fed chunk by chunk; every element of the top-level "tables"
+    array is decoded and returned as soon as its closing brace arrives.
+    The scan keeps its state between chunks, so each character is read once.
+    """
+    
+    def __init__(self):
+        self.text = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None
+        self.current_key = None
+        self.tables_depth = None
+        self.table_start = None
+        self.tables_seen = 0
+    
+    def feed(self, chunk):
+        """Consume a chunk of text and return any tables completed by it"""
+        self.text += chunk
+        completed = []
+        text = self.text
+        
+        for i in range(self.pos, len(text)):
+            char = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = text[self.string_start + 1:i]
+            elif char == '"':
+                self.in_string = True
+                self.string_start = i
+            elif char == ':' and self.depth == 1:
+                self.current_key = self.last_string
+            elif char in '{[':
+                self.depth += 1
+                if char == '[' and self.depth == 2 and self.current_key == 'tables':
+                    self.tables_depth = 2
+                elif char == '{' and self.tables_depth is not None and self.depth == 3:
+                    self.table_start = i
+            elif char in '}]':
+                if char == '}' and self.table_start is not None and self.depth == 3:
+                    try:
+                        completed.append(json.loads(text[self.table_start:i + 1]))
+                        self.tables_seen += 1
+                    except ValueError:
+                        pass
+                    self.table_start = None
+                elif char == ']' and self.depth == 2:
+                    self.tables_depth = None
+                self.depth -= 1
+        
+        self.pos = len(text)
+        return completed
+    
+    def result(self):
+        """Decode the complete response once the stream has finished"""
+        return parse_json_response(self.text)
 
 class GeminiService:
     def __init__(self, api_key):
         self.api_key = api_key
         self.client = genai.Client(api_key=api_key)
     
+    def _generate(self, coalesce=True, **kwargs):
+        """Call the Gemini API through the shared broker.
+        
+        Identical concurrent requests are coalesced into one upstream call
+        unless `coalesce` is False.
+        """
+        request_key = broker.request_key(**kwargs) if coalesce else None
+        with span('gemini_call'):
+            return broker.call(
+                self.api_key,
+                lambda: self.client.models.generate_content(**kwargs),
+                request_key=request_key
+            )
+    
+    def _generate_stream(self, **kwargs):
+        """Stream text chunks from the Gemini API.
+        
+        The broker applies rate limiting and retries up to the first chunk;
+        once output is flowing the stream is consumed directly.
+        """
+        def start_stream():
+            stream = iter(self.client.models.generate_content_stream(**kwargs))
+            return next(stream, None), stream
+        
+        with span('gemini_call'):
+            first, stream = broker.call(self.api_key, start_stream)
+        
+        if first is None:
+            return
+        if first.text:
+            yield first.text
+        for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+    
     def test_connection(self):
         """Test if the API key is valid"""
         try:
-            response = self.client.models.generate_content(
+            response = self._generate(
+                coalesce=False,
                 model="gemini-2.5-flash",
                 contents="Hello, this is a test."
             )
@@ -22,56 +238,54 @@ class GeminiService:
     def analyze_query_and_create_tables(self, query):
         """Analyze SQL query and create necessary tables with sample data"""
         try:
-            system_instruction = """
-            You are a SQL expert and database assistant. Analyze the provided SQL query and:
-            
-            1. Identify all table names referenced in the query
-            2. For each table, generate a realistic schema with appropriate column names and data types
-            3. Provide CREATE TABLE statements
-            4. Generate INSERT statements with realistic sample data (at least 10 rows per table)
-            5. Ensure the data is diverse and realistic for the context
-            
-            Return your response as a JSON object with this structure:
-            {
-                "tables": [
-                    {
-                        "name": "table_name",
-                        "create_statement": "CREATE TABLE ...",
-                        "schema": [
-                            {"column": "id", "type": "INTEGER", "constraints": "PRIMARY KEY"},
-                            {"column": "name", "type": "VARCHAR(100)", "constraints": "NOT NULL"}
-                        ],
-                        "insert_statements": ["INSERT INTO table_name ...", ...]
-                    }
-                ],
-                "explanation": "Brief explanation of the tables created and their purpose"
-            }
-            
-            Make the data contextually appropriate. For example:
-            - If querying employees, create realistic employee data
-            - If querying products, create realistic product data
-            - Use appropriate constraints and relationships
-            """
-            
-            response = self.client.models.generate_content(
+            response = self._generate(
                 model="gemini-2.5-flash",
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction
-                ),
+                config=self._table_analysis_config(),
                 contents=f"Analyze this SQL query and create necessary tables: {query}"
             )
             
-            # Extract JSON from response
-            response_text = response.text
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-            else:
+            analysis = parse_json_response(response.text)
+            if analysis is None:
                 return {'error': 'Could not parse response from AI'}
+            return analysis
                 
         except Exception as e:
             return {'error': f'Error analyzing query: {str(e)}'}
     
+    def analyze_query_and_create_tables_stream(self, query):
+        """Stream the table analysis, yielding each table as soon as it is complete.
+        
+        Yields ('table', table_info) events followed by a final
+        ('done', {'explanation': ...}) or ('error', message) event.
+        """
+        parser = TableStreamParser()
+        try:
+            for chunk in self._generate_stream(
+                model="gemini-2.5-flash",
+                config=self._table_analysis_config(),
+                contents=f"Analyze this SQL query and create necessary tables: {query}"
+            ):
+                for table_info in parser.feed(chunk):
+                    yield 'table', table_info
+            
+            analysis = parser.result()
+            if analysis is None:
+                if not parser.tables_seen:
+                    yield 'error', 'Could not parse response from AI'
+                    return
+                analysis = {}
+            yield 'done', {'explanation': analysis.get('explanation', '')}
+            
+        except Exception as e:
+            yield 'error', f'Error analyzing query: {str(e)}'
+    
+    def _table_analysis_config(self):
+        return types.GenerateContentConfig(
+            system_instruction=TABLE_ANALYSIS_INSTRUCTION,
+            response_mime_type='application/json',
+            response_schema=TABLE_ANALYSIS_SCHEMA
+        )
+    
     def explain_sql_query(self, query):
         """Provide detailed explanation of SQL query"""
         try:
@@ -94,7 +308,7 @@ class GeminiService:
             Make it beginner-friendly but comprehensive.
             """
             
-            response = self.client.models.generate_content(
+            response = self._generate(
                 model="gemini-2.5-flash",
                 config=types.GenerateContentConfig(
                     system_instruction=system_instruction
@@ -130,7 +344,7 @@ class GeminiService:
             Provide specific suggestions with explanations.
             """
             
-            response = self.client.models.generate_content(
+            response = self._generate(
                 model="gemini-2.5-flash",
                 config=types.GenerateContentConfig(
                     system_instruction=system_instruction
@@ -154,7 +368,7 @@ class GeminiService:
             Ensure data consistency and relationships where applicable.
             """
             
-            response = self.client.models.generate_content(
+            response = self._generate(
                 model="gemini-2.5-flash",
                 config=types.GenerateContentConfig(
                     system_instruction=system_instruction
@@ -194,7 +408,7 @@ class GeminiService:
             Make it structured and easy to follow.
             """
             
-            response = self.client.models.generate_content(
+            response = self._generate(
                 model="gemini-2.5-flash",
                 config=types.GenerateContentConfig(
                     system_instruction=system_instruction
@@ -206,3 +420,63 @@ class GeminiService:
             
         except Exception as e:
             return {'error': f'Error generating learning content: {str(e)}'}
+    
+    def run_batch(self, tasks):
+        """Run several explain/suggest/learning tasks in one structured Gemini call.
+        
+        Queries shared by several tasks are sent once. A task missing from a
+        successful batched response falls back to its individual method; if
+        the batch call itself fails every task reports that error instead.
+        """
+        queries = {}
+        payload_tasks = []
+        for task in tasks:
+            input_field = BATCH_TASK_TYPES[task['type']][0]
+            entry = {'id': task['id'], 'type': task['type']}
+            if input_field == 'query':
+                entry['query'] = queries.setdefault(task['query'], f'q{len(queries) + 1}')
+            else:
+                entry['topic'] = task['topic']
+            payload_tasks.append(entry)
+        
+        batched = {}
+        batch_error = None
+        try:
+            response = self._generate(
+                model="gemini-2.5-flash",
+                config=types.GenerateContentConfig(
+                    system_instruction=BATCH_INSTRUCTION,
+                    response_mime_type='application/json',
+                    response_schema=BATCH_SCHEMA
+                ),
+                contents=json.dumps({
+                    'queries': {key: query for query, key in queries.items()},
+                    'tasks': payload_tasks
+                })
+            )
+        except Exception as e:
+            # Refused by the broker or failed after retries: one call per task
+            # would hit the same rate limit, breaker or outage once per task
+            batch_error = str(e)
+        else:
+            # Unparseable or missing items fall back to individual calls below
+            parsed = parse_json_response(response.text or '') or {}
+            items = parsed.get('results')
+            for item in items if isinstance(items, list) else []:
+                if isinstance(item, dict) and str(item.get('content', '')).strip():
+                    batched[str(item.get('id'))] = item['content']
+        
+        results = []
+        for task in tasks:
+            input_field, output_field, fallback = BATCH_TASK_TYPES[task['type']]
+            if batch_error is not None:
+                result = {'error': f'Error running batch: {batch_error}', 'batched': True}
+            elif task['id'] in batched:
+                result = {output_field: batched[task['id']], 'format': 'markdown', 'batched': True}
+            else:
+                result = getattr(self, fallback)(task[input_field])
+                result['batched'] = False
+            result.update({'id': task['id'], 'type': task['type']})
+            results.append(result)
+        
+        return {'results': results}
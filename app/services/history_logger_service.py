@@ -0,0 +1,266 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import insert, select, update, func
+from sqlalchemy.exc import IntegrityError
+from app.models import SQLQuery, HistorySequence
+from app.services.metrics_service import metrics
+from app import db
+
+SEQUENCE_NAME = 'sql_query'
+PENDING_RESULT_ROWS = 5000  # rows kept for charting a query before it is written
+
+class HistoryLogger:
+    """Write-behind logger for SQLQuery history.
+
+    Records are queued on the request path and written by a background
+    thread in multi-row INSERTs, flushed when a batch fills up or the
+    flush interval passes. Ids are handed out up front from blocks
+    reserved in HistorySequence (hi/lo allocation), so callers get the
+    query id immediately and several worker processes never collide.
+
+    Queued records keep their full results until written, so the queue is
+    also bounded by total result rows; a record that would go over is
+    written inline instead.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.queue = None
+        self.pending = {}
+        self.queued_rows = 0
+        self.max_queued_rows = 0
+        self.lock = threading.Lock()
+        self.id_lock = threading.Lock()
+        self.next_id = 0
+        self.block_end = 0
+        self.thread = None
+        self.pid = None
+        self.stopping = threading.Event()
+        self.flushing = threading.Event()
+        self.insert_hooks = []
+
+    def configure(self, app, enabled=True, max_queue=10000, batch_size=200, flush_interval=1.0,
+                  enqueue_timeout=0.05, id_block_size=100, max_queued_rows=1000000):
+        self.app = app
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.id_block_size = id_block_size
+        self.max_queued_rows = max_queued_rows
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.queued_rows = 0
+        with self.id_lock:
+            self.next_id = self.block_end = 0
+
+    def log(self, **record):
+        """Record a query execution and return its SQLQuery id (None if dropped)"""
+        record['id'] = self.reserve_id()
+        record.setdefault('created_at', datetime.utcnow())
+
+        rows = self.result_rows(record)
+        if not self.enabled or not self._claim_rows(rows):
+            self._insert([record])
+            db.session.commit()
+            return record['id']
+
+        self._ensure_started()
+        with self.lock:
+            self.pending[record['id']] = self.pending_copy(record)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc('sqlviz_history_backpressured_total')
+            try:
+                self.queue.put(record, timeout=self.enqueue_timeout)
+            except queue.Full:
+                metrics.inc('sqlviz_history_dropped_total')
+                with self.lock:
+                    self.pending.pop(record['id'], None)
+                    self.queued_rows -= rows
+                return None
+        return record['id']
+
+    def _claim_rows(self, rows):
+        """Reserve room for a record's result rows in the queue; False if it is full of results"""
+        with self.lock:
+            # An empty queue always takes one record, however large
+            if self.queued_rows and self.queued_rows + rows > self.max_queued_rows:
+                metrics.inc('sqlviz_history_inline_total')
+                return False
+            self.queued_rows += rows
+            return True
+
+    @staticmethod
+    def result_rows(record):
+        result_data = record.get('result_data')
+        return len(result_data) if result_data is not None else 0
+
+    @staticmethod
+    def pending_copy(record):
+        """The record as kept for lookups, with its result cut to PENDING_RESULT_ROWS"""
+        result_data = record.get('result_data')
+        if result_data is None or len(result_data) <= PENDING_RESULT_ROWS:
+            return record
+        return dict(record, result_data=result_data.head(PENDING_RESULT_ROWS))
+
+    def register_insert_hook(self, hook):
+        """Call hook(records) inside the transaction that writes each batch"""
+        self.insert_hooks.append(hook)
+
+    def _insert(self, records):
+        db.session.execute(insert(SQLQuery.__table__).values(records))
+        # Hooks run after the INSERT has taken SQLite's write lock, so their
+        # read-modify-write updates cannot interleave with another writer
+        for hook in self.insert_hooks:
+            hook(records)
+
+    def get_pending(self, query_id):
+        """Return a queued record that has not been written yet"""
+        with self.lock:
+            return self.pending.get(query_id)
+
+    def reserve_id(self):
+        with self.id_lock:
+            if self.next_id >= self.block_end:
+                self.next_id, self.block_end = self._reserve_block()
+            query_id = self.next_id
+            self.next_id += 1
+            return query_id
+
+    def _reserve_block(self):
+        """Atomically claim the next block of SQLQuery ids"""
+        sequence = HistorySequence.__table__
+        with db.engine.begin() as conn:
+            row = conn.execute(
+                update(sequence)
+                .where(sequence.c.name == SEQUENCE_NAME)
+                .values(next_id=sequence.c.next_id + self.id_block_size)
+                .returning(sequence.c.next_id)
+            ).first()
+            if row is not None:
+                return row[0] - self.id_block_size, row[0]
+
+        # First use: start after any ids written before the sequence existed
+        try:
+            with db.engine.begin() as conn:
+                max_id = conn.execute(select(func.max(SQLQuery.__table__.c.id))).scalar() or 0
+                conn.execute(insert(sequence).values(name=SEQUENCE_NAME, next_id=max_id + 1))
+        except IntegrityError:
+            pass  # another worker initialized it first
+        return self._reserve_block()
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been written"""
+        if not self.enabled or self.queue is None:
+            return
+        self._ensure_started()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Have the writer send what it has instead of waiting for a full batch
+        self.flushing.set()
+        try:
+            while self.queue.unfinished_tasks:
+                if deadline is not None and time.monotonic() > deadline:
+                    return
+                time.sleep(0.01)
+        finally:
+            self.flushing.clear()
+
+    def stop(self):
+        """Flush outstanding records and stop the writer thread"""
+        if self.thread is None or self.pid != os.getpid():
+            return
+        self.flush(timeout=10)
+        self.stopping.set()
+        self.thread.join(timeout=5)
+
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so pre-forking servers start one per worker
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, name='history-logger', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    if self.flushing.is_set():
+                        batch.append(self.queue.get_nowait())
+                    else:
+                        batch.append(self.queue.get(timeout=min(remaining, 0.05)))
+                except queue.Empty:
+                    if self.flushing.is_set() or time.monotonic() >= deadline:
+                        break
+
+            self._write_batch(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write_batch(self, batch):
+        with self.app.app_context():
+            for attempt in range(2):
+                try:
+                    start = time.perf_counter()
+                    self._insert(batch)
+                    db.session.commit()
+                    metrics.observe('sqlviz_history_flush_seconds', time.perf_counter() - start)
+                    metrics.inc('sqlviz_history_written_total', amount=len(batch))
+                    break
+                except Exception as e:
+                    db.session.rollback()
+                    if attempt == 1:
+                        print(f"Error writing query history batch: {str(e)}")
+                        metrics.inc('sqlviz_history_dropped_total', amount=len(batch))
+                    else:
+                        time.sleep(0.1)
+            db.session.remove()
+
+        with self.lock:
+            for record in batch:
+                self.pending.pop(record['id'], None)
+                self.queued_rows -= self.result_rows(record)
+
+history_logger = HistoryLogger()
+
+metrics.describe('sqlviz_history_written_total', 'Query history records written to the database')
+metrics.describe('sqlviz_history_dropped_total', 'Query history records dropped because the queue was full or writes failed')
+metrics.describe('sqlviz_history_backpressured_total', 'Query history records that had to wait for queue space')
+metrics.describe('sqlviz_history_inline_total', 'Query history records written inline because queued results hit the row limit')
+metrics.describe('sqlviz_history_flush_seconds', 'Time spent writing one batch of query history')
+metrics.register_gauge('sqlviz_history_queue_depth', 'Query history records waiting to be written',
+                       history_logger.queue_depth)
+
+def init_app(app):
+    history_logger.configure(
+        app,
+        enabled=app.config['HISTORY_WRITE_BEHIND'],
+        max_queue=app.config['HISTORY_QUEUE_SIZE'],
+        batch_size=app.config['HISTORY_BATCH_SIZE'],
+        flush_interval=app.config['HISTORY_FLUSH_INTERVAL'],
+        max_queued_rows=app.config['HISTORY_QUEUE_ROWS']
+    )
+    atexit.register(history_logger.stop)
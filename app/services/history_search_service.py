@@ -0,0 +1,161 @@
+import re
+from markupsafe import escape
+from sqlalchemy import text
+from app.models import SQLQuery
+from app import db
+
+FTS_TABLE = 'sql_query_fts'
+
+# Private-use markers survive HTML escaping and are swapped for <mark> afterwards
+MARK_START, MARK_END = '\ue000', '\ue001'
+
+TABLE_REFERENCE_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN|INTO|UPDATE|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?)\s+["`\[]?(\w+)', re.IGNORECASE)
+SEARCH_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+_enabled = False
+
+def referenced_tables(query):
+    """Table names a statement reads or writes, for the search index"""
+    return ' '.join(sorted({name.lower() for name in TABLE_REFERENCE_PATTERN.findall(query or '')}))
+
+def owner_token(user_id):
+    return f"u{user_id}"
+
+def ensure_search_index(batch_size=5000):
+    """Create the FTS5 index and its delete trigger, backfilling existing history once.
+
+    Only SQLite builds with FTS5 get the index; other setups fall back to LIKE.
+    """
+    global _enabled
+    if db.engine.dialect.name != 'sqlite':
+        return False
+
+    with db.engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': FTS_TABLE}).first()
+        try:
+            # owner holds a per-user token so the user filter is part of the MATCH
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"owner, query_text, error_message, table_names, tokenize = \"unicode61 tokenchars '_'\")"
+            ))
+        except Exception as e:
+            print(f"Full-text history search disabled: {str(e)}")
+            return False
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON sql_query BEGIN "
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END"
+        ))
+
+    if not exists:
+        last_id = 0
+        while True:
+            rows = SQLQuery.query.with_entities(SQLQuery.id, SQLQuery.user_id, SQLQuery.query_text,
+                                                SQLQuery.error_message)\
+                                 .filter(SQLQuery.id > last_id).order_by(SQLQuery.id).limit(batch_size).all()
+            if not rows:
+                break
+            index_records([{'id': r[0], 'user_id': r[1], 'query_text': r[2], 'error_message': r[3]} for r in rows])
+            db.session.commit()
+            last_id = rows[-1][0]
+
+    _enabled = True
+    return True
+
+def index_records(records):
+    """History logger insert hook: add new SQLQuery records to the FTS index"""
+    if not records:
+        return
+    db.session.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, owner, query_text, error_message, table_names) "
+             f"VALUES (:id, :owner, :query_text, :error_message, :table_names)"),
+        [{
+            'id': r['id'],
+            'owner': owner_token(r['user_id']),
+            'query_text': r['query_text'],
+            'error_message': r.get('error_message') or '',
+            'table_names': referenced_tables(r['query_text'])
+        } for r in records]
+    )
+
+def match_expression(user_id, search):
+    """Turn free text into a safe FTS5 query: every word as a prefix, all required"""
+    terms = SEARCH_TERM_PATTERN.findall(search)
+    if not terms:
+        return None
+    phrases = ' AND '.join(f'"{term}"*' for term in terms[:20])
+    return f'owner : "{owner_token(user_id)}" AND - owner : ({phrases})'
+
+def highlight(value):
+    return str(escape(value or '')).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+def search_history(user_id, search, page=1, per_page=20, query_type=None, status=None):
+    """Ranked, highlighted history matches for one page; returns (results, has_next)"""
+    offset = (page - 1) * per_page
+    filters, params = [], {'limit': per_page + 1, 'offset': offset}
+    if query_type:
+        filters.append("q.query_type = :query_type")
+        params['query_type'] = query_type
+    if status == 'error':
+        filters.append("q.error_message IS NOT NULL")
+    elif status == 'success':
+        filters.append("q.error_message IS NULL")
+
+    if _enabled:
+        match = match_expression(user_id, search)
+        if match is None:
+            return [], False
+        params.update({'match': match, 'start': MARK_START, 'end': MARK_END})
+        where = ' AND '.join([f"{FTS_TABLE} MATCH :match"] + filters)
+        # Weights per column: owner, query_text, error_message, table_names
+        rows = db.session.execute(text(
+            f"SELECT f.rowid, snippet({FTS_TABLE}, 1, :start, :end, '…', 24), "
+            f"snippet({FTS_TABLE}, 2, :start, :end, '…', 12), bm25({FTS_TABLE}, 0.0, 10.0, 4.0, 6.0) "
+            f"FROM {FTS_TABLE} f JOIN sql_query q ON q.id = f.rowid WHERE {where} "
+            f"ORDER BY bm25({FTS_TABLE}, 0.0, 10.0, 4.0, 6.0) LIMIT :limit OFFSET :offset"
+        ), params).fetchall()
+    else:
+        params.update({'user_id': user_id, 'pattern': f"%{search}%"})
+        where = ' AND '.join(["q.user_id = :user_id", "q.query_text LIKE :pattern"] + filters)
+        rows = db.session.execute(text(
+            f"SELECT q.id, q.query_text, q.error_message, 0 FROM sql_query q WHERE {where} "
+            f"ORDER BY q.created_at DESC LIMIT :limit OFFSET :offset"
+        ), params).fetchall()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    queries = {q.id: q for q in SQLQuery.query.filter(SQLQuery.id.in_([r[0] for r in rows])).all()}
+    results = []
+    for query_id, query_snippet, error_snippet, rank in rows:
+        if query_id in queries:
+            results.append({
+                'query': queries[query_id],
+                'query_html': highlight(query_snippet),
+                'error_html': highlight(error_snippet),
+                'rank': rank
+            })
+    return results, has_next
+
+class SearchResultsPage:
+    """Just enough of Flask-SQLAlchemy's Pagination for the history template"""
+
+    def __init__(self, results, page, has_next):
+        self.items = []
+        for result in results:
+            query = result['query']
+            query.highlight_html = result['query_html']
+            query.error_highlight_html = result['error_html']
+            self.items.append(query)
+        self.page = page
+        self.has_prev = page > 1
+        self.has_next = has_next
+        self.prev_num = page - 1
+        self.next_num = page + 1
+        self.pages = page + 1 if has_next else page
+
+    def iter_pages(self):
+        return range(1, self.pages + 1)
+
+def init_app(app):
+    from app.services.history_logger_service import history_logger
+    history_logger.register_insert_hook(lambda records: index_records(records) if _enabled else None)
@@ -0,0 +1,295 @@
+import csv
+import io
+import itertools
+import json
+import os
+import re
+import time
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from app.models import GeneratedTable
+from app.services.metrics_service import metrics
+from app.services.sql_service import SQLService
+from app.services.table_profile_service import quote_identifier
+from app import db
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet import is optional
+    pa = pq = None
+
+IMPORT_FORMATS = ('csv', 'parquet')
+IMPORT_MODES = ('fail', 'replace', 'append')
+
+INTEGER_PATTERN = re.compile(r'^[-+]?\d{1,18}$')
+REAL_PATTERN = re.compile(r'^[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?$')
+# Zero-padded codes (ZIP codes, account numbers): "0", "0.5" and "-0.25" are still numbers
+LEADING_ZERO_PATTERN = re.compile(r'^[-+]?0\d')
+NAME_PATTERN = re.compile(r'\W+')
+
+metrics.describe('sqlviz_import_rows_total', 'Rows loaded into user databases by file imports, by format')
+metrics.describe('sqlviz_import_seconds', 'Time to load an imported file, by format')
+
+def clean_name(name, fallback):
+    """Lower-case identifier made of word characters, never starting with a digit"""
+    name = NAME_PATTERN.sub('_', str(name or '')).strip('_').lower()
+    if not name:
+        return fallback
+    return f"_{name}" if name[0].isdigit() else name
+
+def clean_column_names(names):
+    columns, seen = [], set()
+    for i, name in enumerate(names):
+        column = clean_name(name, f"column_{i + 1}")
+        candidate, suffix = column, 2
+        while candidate in seen:
+            candidate = f"{column}_{suffix}"
+            suffix += 1
+        seen.add(candidate)
+        columns.append(candidate)
+    return columns
+
+def infer_csv_type(values):
+    """INTEGER, REAL or TEXT for a column from its non-empty sample values"""
+    values = [v.strip() for v in values if v is not None and v.strip() != '']
+    if not values or any(LEADING_ZERO_PATTERN.match(v) for v in values):
+        return 'TEXT'
+    if all(INTEGER_PATTERN.match(v) for v in values):
+        return 'INTEGER'
+    if all(REAL_PATTERN.match(v) for v in values):
+        return 'REAL'
+    return 'TEXT'
+
+def csv_converter(column_type):
+    """Convert a CSV field for its column; values that do not fit are kept as text"""
+    def convert(value):
+        if value is None or value == '':
+            return None
+        if column_type == 'TEXT' or LEADING_ZERO_PATTERN.match(value.strip()):
+            return value
+        try:
+            return int(value) if column_type == 'INTEGER' else float(value)
+        except ValueError:
+            return value
+    return convert
+
+def arrow_to_sqlite_type(arrow_type):
+    if pa.types.is_boolean(arrow_type) or pa.types.is_integer(arrow_type):
+        return 'INTEGER'
+    if pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type):
+        return 'REAL'
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return 'BLOB'
+    return 'TEXT'
+
+def sqlite_value(value):
+    """Map Parquet values onto what sqlite3 stores natively"""
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+class ImportService:
+    """Load CSV or Parquet files into a user database in chunked executemany transactions"""
+
+    def __init__(self, user_id, chunk_size=10000, sample_rows=1000):
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.sample_rows = sample_rows
+        self.sql_service = SQLService(user_id)
+
+    def validate(self, filename, fmt, mode):
+        if not filename:
+            return 'A file is required'
+        if fmt not in IMPORT_FORMATS:
+            return f"Unsupported format {fmt}; use one of {', '.join(IMPORT_FORMATS)}"
+        if fmt == 'parquet' and pa is None:
+            return 'Parquet import requires the optional pyarrow package'
+        if mode not in IMPORT_MODES:
+            return f"Unsupported mode {mode}; use one of {', '.join(IMPORT_MODES)}"
+        return None
+
+    @staticmethod
+    def detect_format(filename):
+        extension = os.path.splitext(filename or '')[1].lower()
+        return 'parquet' if extension in ('.parquet', '.pq') else 'csv'
+
+    def start_import(self, fileobj, filename, fmt=None, table_name=None, mode='fail'):
+        """Infer the schema and create the table, then return a generator of progress events.
+
+        Everything up to CREATE TABLE happens before the first event so bad files
+        and name clashes can be reported as a normal error response.
+        """
+        fmt = fmt or self.detect_format(filename)
+        table = clean_name(table_name or os.path.splitext(os.path.basename(filename))[0], 'imported_data')
+
+        total_bytes = self.file_size(fileobj)
+        if fmt == 'parquet':
+            columns, types, total_rows, chunks = self.read_parquet(fileobj)
+        else:
+            columns, types, total_rows, chunks = self.read_csv(fileobj)
+
+        conn = self.sql_service.get_connection()
+        conn.isolation_level = None  # explicit BEGIN/COMMIT around the whole load
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            exists = conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                                  (table,)).fetchone()
+            if exists and mode == 'fail':
+                raise ValueError(f"Table {table} already exists; choose another name or replace it")
+            if exists and mode == 'replace':
+                conn.execute(f"DROP TABLE main.{quote_identifier(table)}")
+            if not exists or mode == 'replace':
+                definitions = ', '.join(f"{quote_identifier(c)} {t}" for c, t in zip(columns, types))
+                conn.execute(f"CREATE TABLE main.{quote_identifier(table)} ({definitions})")
+            else:
+                existing = [row[1] for row in conn.execute(f"PRAGMA main.table_info({quote_identifier(table)})")]
+                if existing != columns:
+                    raise ValueError(f"Columns do not match the existing table {table}: {', '.join(existing)}")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+            raise
+
+        return self.load(conn, table, fmt, columns, types, chunks, fileobj, total_rows, total_bytes, mode)
+
+    def load(self, conn, table, fmt, columns, types, chunks, fileobj, total_rows, total_bytes, mode):
+        start_time = time.time()
+        placeholders = ', '.join('?' for _ in columns)
+        insert = f"INSERT INTO main.{quote_identifier(table)} VALUES ({placeholders})"
+        rows_loaded = 0
+        committed = False
+        try:
+            yield {'event': 'schema', 'table': table,
+                   'columns': [{'column': c, 'type': t} for c, t in zip(columns, types)]}
+
+            for rows in chunks:
+                conn.executemany(insert, rows)
+                rows_loaded += len(rows)
+                yield {
+                    'event': 'progress',
+                    'rows': rows_loaded,
+                    'total_rows': total_rows,
+                    'bytes': self.file_position(fileobj),
+                    'total_bytes': total_bytes
+                }
+
+            conn.execute("COMMIT")
+            committed = True
+        finally:
+            if not committed:
+                # Error or client disconnect: the table and every loaded chunk go away together
+                conn.execute("ROLLBACK")
+            conn.close()
+
+        elapsed = time.time() - start_time
+        metrics.inc('sqlviz_import_rows_total', {'format': fmt}, amount=rows_loaded)
+        metrics.observe('sqlviz_import_seconds', elapsed, {'format': fmt})
+        self.record_table(table, columns, types, rows_loaded, mode)
+        yield {'event': 'done', 'table': table, 'rows': rows_loaded, 'execution_time': elapsed}
+
+    def read_csv(self, fileobj):
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', errors='replace', newline='')
+        sample_text = text.read(64 * 1024)
+        try:
+            dialect = csv.Sniffer().sniff(sample_text, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        text.seek(0)
+
+        reader = csv.reader(text, dialect)
+        header = next(reader, None)
+        if not header:
+            raise ValueError('The CSV file is empty')
+        columns = clean_column_names(header)
+        width = len(columns)
+
+        sample = list(itertools.islice(reader, self.sample_rows))
+        types = [infer_csv_type([row[i] if i < len(row) else None for row in sample]) for i in range(width)]
+        converters = [csv_converter(t) for t in types]
+
+        def chunks():
+            rows = []
+            for row in itertools.chain(sample, reader):
+                if not row:
+                    continue
+                if len(row) != width:
+                    row = (row + [None] * width)[:width]
+                rows.append([convert(value) for convert, value in zip(converters, row)])
+                if len(rows) >= self.chunk_size:
+                    yield rows
+                    rows = []
+            if rows:
+                yield rows
+
+        return columns, types, None, chunks()
+
+    def read_parquet(self, fileobj):
+        parquet_file = pq.ParquetFile(fileobj)
+        schema = parquet_file.schema_arrow
+        columns = clean_column_names(schema.names)
+        types = [arrow_to_sqlite_type(field.type) for field in schema]
+
+        # Only dates, decimals, nested values and the like need converting row by row
+        native = [
+            pa.types.is_boolean(f.type) or pa.types.is_integer(f.type) or pa.types.is_floating(f.type)
+            or pa.types.is_string(f.type) or pa.types.is_large_string(f.type) or pa.types.is_binary(f.type)
+            for f in schema
+        ]
+
+        def chunks():
+            for batch in parquet_file.iter_batches(batch_size=self.chunk_size):
+                values = [
+                    column.to_pylist() if is_native else [sqlite_value(v) for v in column.to_pylist()]
+                    for column, is_native in zip(batch.columns, native)
+                ]
+                yield list(zip(*values))
+
+        return columns, types, parquet_file.metadata.num_rows, chunks()
+
+    @staticmethod
+    def file_size(fileobj):
+        try:
+            position = fileobj.tell()
+            fileobj.seek(0, os.SEEK_END)
+            size = fileobj.tell()
+            fileobj.seek(position)
+            return size
+        except (AttributeError, OSError):
+            return None
+
+    @staticmethod
+    def file_position(fileobj):
+        try:
+            return fileobj.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def record_table(self, table, columns, types, rows_loaded, mode):
+        try:
+            schema = [{'column': c, 'type': t, 'constraints': ''} for c, t in zip(columns, types)]
+            record = GeneratedTable.query.filter_by(user_id=self.user_id, table_name=table).first()
+            if record is None:
+                db.session.add(GeneratedTable(
+                    user_id=self.user_id,
+                    table_name=table,
+                    table_schema=schema,
+                    sample_data_count=rows_loaded,
+                    created_by_ai=False
+                ))
+            else:
+                record.table_schema = schema
+                previous = record.sample_data_count or 0 if mode == 'append' else 0
+                record.sample_data_count = previous + rows_loaded
+                record.created_by_ai = False
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error recording imported table {table}: {str(e)}")
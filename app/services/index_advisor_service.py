@@ -0,0 +1,280 @@
+import sqlite3
+import re
+import os
+import time
+import tempfile
+import statistics
+from collections import Counter
+from app.models import SQLQuery
+from app.services.sandbox_lifecycle_service import connect_existing
+
+class IndexAdvisorService:
+    """Recommend secondary indexes for a user's sandbox database"""
+
+    # Identifier that may be qualified by a table alias: alias.column or column
+    COLUMN_PATTERN = r'(?:(\w+)\.)?(\w+)'
+
+    def __init__(self, user_id, history_limit=200, benchmark_runs=5):
+        self.user_id = user_id
+        self.db_path = f"user_dbs/user_{user_id}.db"
+        self.history_limit = history_limit
+        self.benchmark_runs = benchmark_runs
+
+    def recommend(self):
+        """Mine query history, propose candidate indexes and benchmark them"""
+        if not os.path.exists(self.db_path):
+            return {'recommendations': [], 'analyzed_queries': 0}
+
+        workload = self.collect_workload()
+        conn = connect_existing(self.db_path)
+        try:
+            candidates = {}
+            for query, frequency in workload.items():
+                for candidate in self.find_candidates(conn, query):
+                    key = (candidate['table'], tuple(candidate['columns']))
+                    entry = candidates.setdefault(key, {
+                        'table': candidate['table'],
+                        'columns': candidate['columns'],
+                        'reasons': set(),
+                        'queries': [],
+                        'frequency': 0
+                    })
+                    entry['reasons'].update(candidate['reasons'])
+                    entry['queries'].append(query)
+                    entry['frequency'] += frequency
+        finally:
+            conn.close()
+
+        recommendations = self.benchmark_candidates(list(candidates.values()))
+        recommendations.sort(key=lambda r: r['weighted_savings'], reverse=True)
+
+        return {
+            'recommendations': recommendations,
+            'analyzed_queries': len(workload)
+        }
+
+    def collect_workload(self):
+        """Return successful SELECT queries from history with their run counts"""
+        queries = SQLQuery.query.filter_by(user_id=self.user_id, query_type='SELECT', error_message=None)\
+                                .order_by(SQLQuery.created_at.desc())\
+                                .limit(self.history_limit).all()
+        return Counter(q.query_text.strip().rstrip(';') for q in queries if q.query_text)
+
+    def get_query_plan(self, conn, query):
+        """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+        try:
+            return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()]
+        except sqlite3.Error:
+            return []
+
+    def find_candidates(self, conn, query):
+        """Find index candidates for tables the query plan scans in full"""
+        plan = self.get_query_plan(conn, query)
+        aliases = self.parse_table_aliases(query)
+        scanned = []
+        for detail in plan:
+            # SQLite >= 3.36 prints "SCAN t", older versions "SCAN TABLE t".
+            # A transient AUTOMATIC index means SQLite had to build one per query.
+            # Plans name tables by their alias when the query uses one.
+            match = re.match(r'(?:SCAN|SEARCH) (?:TABLE )?(\w+)', detail)
+            if not match:
+                continue
+            table = aliases.get(match.group(1).lower(), match.group(1))
+            full_scan = detail.startswith('SCAN') and 'USING' not in detail
+            if (full_scan or 'AUTOMATIC' in detail) and table not in scanned:
+                scanned.append(table)
+        sorts_in_temp_btree = any('USE TEMP B-TREE FOR ORDER BY' in d for d in plan)
+
+        if not scanned:
+            return []
+
+        clauses = self.parse_clause_columns(query)
+        candidates = []
+
+        for table in scanned:
+            table_columns = self.get_table_columns(conn, table)
+            if not table_columns:
+                continue
+
+            def belongs(qualifier, column):
+                if column not in table_columns:
+                    return False
+                if not qualifier:
+                    return True
+                return aliases.get(qualifier.lower(), qualifier.lower()) == table.lower()
+
+            equality = [c for q, c in clauses['equality'] if belongs(q, c)]
+            joins = [c for q, c in clauses['join'] if belongs(q, c)]
+            ranges = [c for q, c in clauses['range'] if belongs(q, c)]
+            order_by = [c for q, c in clauses['order_by'] if belongs(q, c)] if sorts_in_temp_btree else []
+
+            reasons = set()
+            if equality or ranges:
+                reasons.add('WHERE')
+            if joins:
+                reasons.add('JOIN')
+            if order_by:
+                reasons.add('ORDER BY')
+
+            # Equality columns lead, then at most one range column, then sort columns
+            columns = self._unique(joins + equality)
+            if ranges:
+                columns = self._unique(columns + ranges[:1])
+            elif order_by:
+                columns = self._unique(columns + order_by)
+            columns = columns[:3]
+
+            if columns and not self.is_indexed(conn, table, columns):
+                candidates.append({'table': table, 'columns': columns, 'reasons': reasons})
+
+        return candidates
+
+    def parse_table_aliases(self, query):
+        """Map aliases (and bare table names) to table names from FROM/JOIN clauses"""
+        aliases = {}
+        keywords = {'where', 'join', 'inner', 'left', 'right', 'outer', 'cross', 'on',
+                    'group', 'order', 'limit', 'having', 'union', 'natural', 'using'}
+        for match in re.finditer(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', query, re.IGNORECASE):
+            table = match.group(1).lower()
+            aliases[table] = table
+            alias = match.group(2)
+            if alias and alias.lower() not in keywords:
+                aliases[alias.lower()] = table
+        return aliases
+
+    def parse_clause_columns(self, query):
+        """Extract columns used in WHERE, JOIN ... ON and ORDER BY clauses"""
+        col = self.COLUMN_PATTERN
+        text = re.sub(r"'(?:[^']|'')*'", "''", query)
+        result = {'equality': [], 'range': [], 'join': [], 'order_by': []}
+
+        where = re.search(r'\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|\bHAVING\b|$)',
+                          text, re.IGNORECASE | re.DOTALL)
+        if where:
+            clause = where.group(1)
+            result['equality'] += re.findall(rf'{col}\s*(?:=|\bIN\b|\bIS\b)', clause, re.IGNORECASE)
+            result['range'] += re.findall(rf'{col}\s*(?:<=|>=|<|>|\bBETWEEN\b|\bLIKE\b)', clause, re.IGNORECASE)
+
+        for on in re.finditer(r'\bON\b(.*?)(?:\bJOIN\b|\bWHERE\b|\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)',
+                              text, re.IGNORECASE | re.DOTALL):
+            for match in re.finditer(rf'{col}\s*=\s*{col}', on.group(1)):
+                result['join'].append((match.group(1), match.group(2)))
+                result['join'].append((match.group(3), match.group(4)))
+
+        order = re.search(r'\bORDER\s+BY\b(.*?)(?:\bLIMIT\b|$)', text, re.IGNORECASE | re.DOTALL)
+        if order:
+            for term in order.group(1).split(','):
+                match = re.match(rf'\s*{col}', term)
+                if match:
+                    result['order_by'].append((match.group(1), match.group(2)))
+
+        return result
+
+    def get_table_columns(self, conn, table):
+        """Return column names of a table in the user's database"""
+        try:
+            return {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")').fetchall()}
+        except sqlite3.Error:
+            return set()
+
+    def is_indexed(self, conn, table, columns):
+        """Check whether an existing index already starts with the given columns"""
+        for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+            indexed = [row[2] for row in conn.execute(f'PRAGMA index_info("{index[1]}")').fetchall()]
+            if indexed[:len(columns)] == columns:
+                return True
+        return False
+
+    def index_name(self, table, columns):
+        """Build a deterministic name for a recommended index"""
+        return f"idx_{table}_{'_'.join(columns)}"
+
+    def benchmark_candidates(self, candidates):
+        """Time the affected queries on a shadow copy before and after each index"""
+        if not candidates:
+            return []
+
+        results = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shadow_path = os.path.join(tmp_dir, 'shadow.db')
+            source = connect_existing(self.db_path)
+            shadow = sqlite3.connect(shadow_path)
+            try:
+                source.backup(shadow)
+            finally:
+                source.close()
+
+            try:
+                for candidate in candidates:
+                    name = self.index_name(candidate['table'], candidate['columns'])
+                    queries = list(dict.fromkeys(candidate['queries']))
+
+                    before = {q: self.time_query(shadow, q) for q in queries}
+                    column_list = ', '.join(f'"{c}"' for c in candidate['columns'])
+                    shadow.execute(f'CREATE INDEX "{name}" ON "{candidate["table"]}" ({column_list})')
+                    after = {q: self.time_query(shadow, q) for q in queries}
+                    plans = {q: self.get_query_plan(shadow, q) for q in queries}
+                    shadow.execute(f'DROP INDEX "{name}"')
+
+                    total_before = sum(before.values())
+                    total_after = sum(after.values())
+                    per_run_savings = total_before - total_after
+                    results.append({
+                        'index_name': name,
+                        'table': candidate['table'],
+                        'columns': candidate['columns'],
+                        'reasons': sorted(candidate['reasons']),
+                        'create_statement': f'CREATE INDEX "{name}" ON "{candidate["table"]}" ({column_list})',
+                        'frequency': candidate['frequency'],
+                        'before_time': total_before,
+                        'after_time': total_after,
+                        'speedup': (total_before / total_after) if total_after > 0 else None,
+                        'weighted_savings': per_run_savings * candidate['frequency'],
+                        'queries': [{
+                            'query': q,
+                            'before_time': before[q],
+                            'after_time': after[q],
+                            'plan_after': plans[q]
+                        } for q in queries]
+                    })
+            finally:
+                shadow.close()
+
+        return results
+
+    def time_query(self, conn, query):
+        """Median wall-clock time to fully execute a query"""
+        timings = []
+        for _ in range(self.benchmark_runs):
+            start = time.perf_counter()
+            try:
+                conn.execute(query).fetchall()
+            except sqlite3.Error:
+                return 0.0
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    def apply_index(self, table, columns):
+        """Create a recommended index on the user's real database"""
+        conn = connect_existing(self.db_path)
+        try:
+            table_columns = self.get_table_columns(conn, table)
+            if not table_columns:
+                return {'error': f'Table {table} not found'}
+            unknown = [c for c in columns if c not in table_columns]
+            if not columns or unknown:
+                return {'error': f'Unknown columns for {table}: {", ".join(unknown) or "none given"}'}
+
+            name = self.index_name(table, columns)
+            column_list = ', '.join(f'"{c}"' for c in columns)
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_list})')
+            conn.commit()
+            return {'success': True, 'index_name': name}
+        except sqlite3.Error as e:
+            return {'error': str(e)}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _unique(items):
+        return list(dict.fromkeys(items))
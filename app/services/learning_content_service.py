@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+from datetime import datetime
+from app.models import LearningContent
+from app import db
+
+# Bump when the learning prompt changes so stored content is regenerated
+CONTENT_VERSION = 1
+
+# Topic catalogue shown on the learning materials page
+LEARNING_TOPICS = {
+    'basic-select': 'Basic SELECT',
+    'where-clause': 'WHERE Clause',
+    'sorting': 'ORDER BY',
+    'aggregate-functions': 'Aggregate Functions',
+    'joins': 'JOINs',
+    'group-by': 'GROUP BY',
+    'having': 'HAVING Clause',
+    'subqueries': 'Subqueries',
+    'cte': 'Common Table Expressions',
+    'window-functions': 'Window Functions',
+    'advanced-joins': 'Advanced JOINs',
+    'performance': 'Performance Optimization'
+}
+
+WARMUP_BATCH_SIZE = 3
+
+_warmup_lock = threading.Lock()
+_warmup_running = False
+
+def topic_key(topic):
+    """Normalize a topic name or slug into a store key"""
+    key = re.sub(r'[^a-z0-9]+', '-', topic.strip().lower()).strip('-')
+    for slug, title in LEARNING_TOPICS.items():
+        if key == re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-'):
+            return slug
+    return key[:100]
+
+def is_catalogue_topic(topic):
+    """Only catalogue topics are stored; anything else would grow the shared store without bound"""
+    return topic_key(topic) in LEARNING_TOPICS
+
+def topic_title(topic):
+    return LEARNING_TOPICS.get(topic_key(topic), topic.strip())
+
+class LearningContentStore:
+    """Versioned, pre-compressed learning content kept in the app database"""
+
+    def get(self, topic):
+        """Return the current stored record for a topic, or None"""
+        record = LearningContent.query.filter_by(topic_key=topic_key(topic)).first()
+        if record and record.content_version == CONTENT_VERSION:
+            return record
+        return None
+
+    def put(self, topic, markdown):
+        """Store generated markdown as a compressed, ready-to-send JSON body"""
+        key = topic_key(topic)
+        body = json.dumps({
+            'topic': key,
+            'title': topic_title(topic),
+            'content': markdown,
+            'format': 'markdown'
+        }).encode()
+
+        record = LearningContent.query.filter_by(topic_key=key).first()
+        if record is None:
+            record = LearningContent(topic_key=key, revision=0)
+            db.session.add(record)
+
+        record.title = topic_title(topic)
+        record.content_version = CONTENT_VERSION
+        record.revision = (record.revision or 0) + 1
+        record.body_gzip = gzip.compress(body, compresslevel=9)
+        record.body_size = len(body)
+        record.etag = hashlib.sha256(body).hexdigest()[:32]
+        record.updated_at = datetime.utcnow()
+        db.session.commit()
+        return record
+
+    def generate(self, topic, gemini_service):
+        """Generate content for a topic through Gemini and add it to the store"""
+        result = gemini_service.generate_learning_content(topic_title(topic))
+        if 'error' in result:
+            return None, result['error']
+        return self.put(topic, result['content']), None
+
+    def missing_topics(self):
+        """Catalogue topics that have no content for the current version"""
+        stored = {r.topic_key for r in LearningContent.query.filter_by(content_version=CONTENT_VERSION).all()}
+        return [key for key in LEARNING_TOPICS if key not in stored]
+
+    def warm_up(self, gemini_service):
+        """Pre-generate every missing catalogue topic, a few topics per Gemini call"""
+        missing = self.missing_topics()
+        for i in range(0, len(missing), WARMUP_BATCH_SIZE):
+            batch = missing[i:i + WARMUP_BATCH_SIZE]
+            tasks = [{'id': key, 'type': 'learning', 'topic': LEARNING_TOPICS[key]} for key in batch]
+            for result in gemini_service.run_batch(tasks)['results']:
+                if 'content' in result:
+                    self.put(result['id'], result['content'])
+                else:
+                    print(f"Learning content warm-up failed for {result['id']}: {result.get('error')}")
+
+def start_warmup(app, api_key):
+    """Warm the learning content store in a background thread"""
+    global _warmup_running
+    with _warmup_lock:
+        if _warmup_running:
+            return False
+        _warmup_running = True
+
+    def run():
+        global _warmup_running
+        try:
+            from app.services.gemini_service import GeminiService
+            with app.app_context():
+                LearningContentStore().warm_up(GeminiService(api_key))
+        except Exception as e:
+            print(f"Learning content warm-up failed: {str(e)}")
+        finally:
+            with _warmup_lock:
+                _warmup_running = False
+
+    threading.Thread(target=run, name='learning-warmup', daemon=True).start()
+    return True
@@ -0,0 +1,165 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+
+# Latency buckets in seconds, from sub-millisecond SQLite calls up to slow Gemini round trips
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class MetricsRegistry:
+    """In-process counters, gauges and histograms rendered in Prometheus text format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauge_callbacks = {}
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, self._label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = (name, self._label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def register_gauge(self, name, help_text, callback):
+        """Register a gauge whose value is read at scrape time.
+
+        The callback returns either a number or a dict mapping label tuples
+        such as (('key', 'value'),) to numbers.
+        """
+        self.help[name] = help_text
+        self.gauge_callbacks[name] = callback
+
+    def get_counter(self, name, labels=None):
+        return self.counters.get((name, self._label_key(labels)), 0)
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']}
+                          for k, v in self.histograms.items()}
+
+        for name in sorted({k[0] for k in counters}):
+            self._header(lines, name, 'counter')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{self._format_labels(labels)} {value}')
+
+        for name in sorted({k[0] for k in histograms}):
+            self._header(lines, name, 'histogram')
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    bucket_labels = labels + (('le', repr(float(bound))),)
+                    lines.append(f'{name}_bucket{self._format_labels(bucket_labels)} {count}')
+                lines.append(f'{name}_bucket{self._format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+                lines.append(f'{name}_sum{self._format_labels(labels)} {histogram["sum"]}')
+                lines.append(f'{name}_count{self._format_labels(labels)} {histogram["count"]}')
+
+        for name, callback in sorted(self.gauge_callbacks.items()):
+            try:
+                value = callback()
+            except Exception:
+                continue
+            self._header(lines, name, 'gauge')
+            if isinstance(value, dict):
+                for labels, sample in sorted(value.items()):
+                    lines.append(f'{name}{self._format_labels(labels)} {sample}')
+            else:
+                lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines, name, metric_type):
+        if name in self.help:
+            lines.append(f'# HELP {name} {self.help[name]}')
+        lines.append(f'# TYPE {name} {metric_type}')
+
+    @staticmethod
+    def _label_key(labels):
+        return tuple(sorted((labels or {}).items()))
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        pairs = []
+        for key, value in labels:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{key}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+metrics = MetricsRegistry()
+metrics.describe('sqlviz_stage_duration_seconds', 'Time spent in each hot-path stage')
+metrics.describe('sqlviz_stage_total', 'Number of times each hot-path stage ran')
+metrics.describe('sqlviz_stage_errors_total', 'Number of hot-path stages that raised')
+metrics.describe('sqlviz_request_duration_seconds', 'End-to-end request latency')
+metrics.describe('sqlviz_requests_total', 'Requests served by endpoint and status')
+
+@contextmanager
+def span(stage):
+    """Time a hot-path stage and attribute it to the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.inc('sqlviz_stage_errors_total', {'stage': stage})
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe('sqlviz_stage_duration_seconds', duration, {'stage': stage})
+        metrics.inc('sqlviz_stage_total', {'stage': stage})
+        if has_request_context():
+            spans = g.setdefault('spans', {})
+            spans[stage] = spans.get(stage, 0.0) + duration
+
+def init_app(app):
+    """Record request latency and optionally emit a Server-Timing header"""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+
+        duration = time.perf_counter() - start
+        endpoint = request.endpoint or 'unknown'
+        if endpoint != 'main.metrics_endpoint':
+            metrics.observe('sqlviz_request_duration_seconds', duration,
+                            {'endpoint': endpoint, 'method': request.method})
+            metrics.inc('sqlviz_requests_total',
+                        {'endpoint': endpoint, 'method': request.method, 'status': response.status_code})
+
+        if app.config.get('SERVER_TIMING'):
+            entries = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in g.get('spans', {}).items()]
+            entries.append(f'total;dur={duration * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(entries)
+
+        return response
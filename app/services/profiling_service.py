@@ -0,0 +1,102 @@
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+class StackSampler:
+    """Statistical profiler that samples one thread's Python stack on an interval"""
+
+    def __init__(self, thread_id, interval=0.005, max_depth=128):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                module = frame.f_globals.get('__name__', '?')
+                stack.append(f'{module}:{frame.f_code.co_name}')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def collapsed(self):
+        """Return samples in the collapsed-stack format used by flamegraph tools"""
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common())
+
+def should_profile(app):
+    """Decide whether the current request is profiled"""
+    if request.endpoint not in app.config.get('PROFILE_ENDPOINTS', ()):
+        return False
+
+    token = app.config.get('PROFILE_ADMIN_TOKEN')
+    if token and request.headers.get(PROFILE_HEADER) == token:
+        return True
+
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+    return sample_rate > 0 and random.random() < sample_rate
+
+def init_app(app):
+    """Attach the opt-in per-request profiler to the app"""
+
+    @app.before_request
+    def start_request_profiler():
+        if not should_profile(app):
+            return
+        sampler = StackSampler(threading.get_ident(), interval=app.config.get('PROFILE_INTERVAL', 0.005))
+        sampler.start()
+        g.profiler = sampler
+
+    @app.after_request
+    def store_request_profile(response):
+        sampler = g.pop('profiler', None)
+        if sampler is None:
+            return response
+
+        sampler.stop()
+        try:
+            from flask_login import current_user
+            from app.models import QueryProfile
+            from app import db
+
+            query_id = g.get('profile_query_id') or (request.view_args or {}).get('query_id')
+            profile = QueryProfile(
+                query_id=query_id,
+                user_id=current_user.id if current_user.is_authenticated else None,
+                endpoint=request.endpoint,
+                duration=sampler.duration,
+                sample_count=sampler.sample_count,
+                collapsed_stacks=sampler.collapsed()
+            )
+            db.session.add(profile)
+            db.session.commit()
+            response.headers['X-Profile-Id'] = str(profile.id)
+        except Exception as e:
+            print(f"Error storing request profile: {str(e)}")
+
+        return response
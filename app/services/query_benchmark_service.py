@@ -0,0 +1,234 @@
+import hashlib
+import re
+import sqlite3
+import statistics
+import time
+from app.services.metrics_service import metrics
+from app.services.sql_service import SQLService
+
+MAX_VARIANTS = 5
+MAX_RUNS = 50
+
+# Strings, quoted identifiers, comments, parentheses and words, enough to find top-level keywords
+TOKEN_PATTERN = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?(?:\*/|$)|[()]|\w+",
+    re.DOTALL
+)
+
+metrics.describe('sqlviz_query_benchmarks_total', 'Query A/B benchmarks run, by whether every variant matched the baseline')
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))  # ceil without floats
+    return ordered[int(rank) - 1]
+
+def has_top_level_order_by(query):
+    """True if the statement itself sorts its rows.
+
+    ORDER BY inside parentheses (subqueries, CTE bodies, window definitions)
+    does not fix the order of the final result.
+    """
+    depth = 0
+    previous = None
+    for token in TOKEN_PATTERN.findall(query):
+        if token.startswith(('--', '/*')):
+            continue
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(0, depth - 1)
+        elif depth == 0 and previous == 'ORDER' and token.upper() == 'BY':
+            return True
+        previous = token.upper() if depth == 0 else None
+    return False
+
+def timing_summary(timings):
+    if not timings:
+        return None
+    return {
+        'runs': len(timings),
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'p95': percentile(timings, 95),
+        'max': max(timings)
+    }
+
+def row_digest(row):
+    # repr keeps 1 and 1.0 and '1' apart, which is what "same answer" means in SQLite
+    return hashlib.blake2b(repr(row).encode('utf-8'), digest_size=16).digest()
+
+class QueryBenchmarkService:
+    """Time read-only query variants against a user's database and check they return the same rows.
+
+    Each variant gets warm-up runs, then timed warm runs on one connection, then
+    cold runs that each open a fresh connection so SQLite's page cache starts
+    empty. The OS file cache cannot be dropped from here, so "cold" measures
+    SQLite's cache and connection setup, not disk reads.
+
+    time_budget bounds the whole request: each variant gets an equal share for
+    its repeated runs, and SQLite is interrupted once the budget is spent.
+    """
+
+    def __init__(self, user_id, runs=5, warmup=1, cold_runs=3, time_budget=20.0):
+        self.user_id = user_id
+        self.runs = max(1, min(int(runs), MAX_RUNS))
+        self.warmup = max(0, min(int(warmup), MAX_RUNS))
+        self.cold_runs = max(0, min(int(cold_runs), MAX_RUNS))
+        # Seconds for the whole benchmark; every variant still gets one warm and one cold run
+        self.time_budget = time_budget
+        self.deadline = None
+        self.sql_service = SQLService(user_id)
+
+    def validate(self, queries):
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            return 'Queries must be a list of SQL strings'
+        queries = [q for q in queries if q.strip()]
+        if len(queries) < 2:
+            return 'At least two query variants are required'
+        if len(queries) > MAX_VARIANTS:
+            return f'At most {MAX_VARIANTS} query variants can be compared'
+        return None
+
+    def open_connection(self):
+        conn = self.sql_service.get_connection()
+        # Benchmarks run queries repeatedly; none of them may change the sandbox
+        conn.execute("PRAGMA query_only = ON")
+        conn.set_progress_handler(self.past_deadline, 1000)
+        return conn
+
+    def past_deadline(self):
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+    def benchmark(self, queries):
+        """Benchmark each variant; the first one is the baseline the others are compared with"""
+        queries = [q.strip().rstrip(';').strip() for q in queries if q.strip()]
+        start = time.perf_counter()
+        self.deadline = start + self.time_budget
+        share = self.time_budget / len(queries)
+        try:
+            results = [self.benchmark_variant(query, start + share * (i + 1)) for i, query in enumerate(queries)]
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                raise ValueError(f'The benchmark did not finish within {self.time_budget:g} seconds; '
+                                 f'try fewer variants or a faster query')
+            raise
+
+        baseline = results[0]
+        for result in results:
+            result['matches_baseline'] = self.same_result(baseline, result)
+            result['plan_changes'] = self.plan_changes(baseline['plan'], result['plan'])
+            baseline_median = baseline['warm']['median']
+            result['speedup'] = (baseline_median / result['warm']['median']) if result['warm']['median'] > 0 else None
+
+        equivalent = all(r['matches_baseline'] for r in results)
+        metrics.inc('sqlviz_query_benchmarks_total', {'equivalent': str(equivalent).lower()})
+
+        valid = [r for r in results if r['matches_baseline']]
+        fastest = min(valid, key=lambda r: r['warm']['median'])
+        return {
+            'variants': results,
+            'equivalent': equivalent,
+            'fastest': results.index(fastest),
+            'settings': {'runs': self.runs, 'warmup': self.warmup, 'cold_runs': self.cold_runs}
+        }
+
+    def benchmark_variant(self, query, variant_deadline):
+        """Warm-up and warm runs use the first half of the variant's time, cold runs the rest"""
+        warm_deadline = (time.perf_counter() + variant_deadline) / 2
+        conn = self.open_connection()
+        try:
+            try:
+                cursor = conn.execute(query)
+            except sqlite3.OperationalError as e:
+                if 'readonly' in str(e):
+                    raise ValueError('Only read-only queries can be benchmarked')
+                raise
+            if cursor.description is None:
+                raise ValueError('Only queries that return rows can be benchmarked')
+            columns = [d[0] for d in cursor.description]
+            row_count, ordered_hash, unordered_hash = self.fingerprint(cursor)
+            plan = self.query_plan(conn, query)
+
+            for _ in range(self.warmup):
+                if time.perf_counter() >= warm_deadline:
+                    break
+                self.run(conn, query)
+
+            warm = []
+            while len(warm) < self.runs and (not warm or time.perf_counter() < warm_deadline):
+                warm.append(self.run(conn, query))
+        finally:
+            conn.close()
+
+        cold = []
+        while len(cold) < self.cold_runs and (not cold or time.perf_counter() < variant_deadline):
+            conn = self.open_connection()
+            try:
+                conn.execute("PRAGMA mmap_size = 0")
+                cold.append(self.run(conn, query))
+            finally:
+                conn.close()
+
+        ordered = has_top_level_order_by(query)
+        return {
+            'query': query,
+            'columns': columns,
+            'row_count': row_count,
+            'ordered': ordered,
+            'result_hash': ordered_hash if ordered else unordered_hash,
+            'ordered_hash': ordered_hash,
+            'unordered_hash': unordered_hash,
+            'plan': plan,
+            'warm': timing_summary(warm),
+            'cold': timing_summary(cold)
+        }
+
+    @staticmethod
+    def run(conn, query, batch_size=5000):
+        """Wall-clock time to step a query through every row"""
+        start = time.perf_counter()
+        cursor = conn.execute(query)
+        while cursor.fetchmany(batch_size):
+            pass
+        return time.perf_counter() - start
+
+    @staticmethod
+    def fingerprint(cursor, batch_size=5000):
+        """Row count plus order-sensitive and order-insensitive hashes of every row.
+
+        The order-insensitive hash adds up per-row digests, so it treats the
+        result as a multiset: duplicates count, row order does not.
+        """
+        ordered = hashlib.blake2b(digest_size=16)
+        total = 0
+        row_count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                digest = row_digest(row)
+                ordered.update(digest)
+                total += int.from_bytes(digest, 'big')
+            row_count += len(rows)
+        unordered = (total % (1 << 128)).to_bytes(16, 'big').hex()
+        return row_count, ordered.hexdigest(), unordered
+
+    @staticmethod
+    def query_plan(conn, query):
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()]
+
+    @staticmethod
+    def same_result(baseline, result):
+        """Row order only counts when both variants ask for one"""
+        if baseline['ordered'] and result['ordered']:
+            return baseline['ordered_hash'] == result['ordered_hash']
+        return baseline['unordered_hash'] == result['unordered_hash']
+
+    @staticmethod
+    def plan_changes(baseline_plan, plan):
+        return {
+            'added': [line for line in plan if line not in baseline_plan],
+            'removed': [line for line in baseline_plan if line not in plan]
+        }
@@ -0,0 +1,172 @@
+import hashlib
+import re
+from datetime import datetime
+from sqlalchemy import tuple_
+from app.models import QueryStats, SQLQuery
+from app.services.metrics_service import DEFAULT_BUCKETS
+from app import db
+
+# Upper bounds (seconds) of the per-fingerprint latency buckets; the last bucket is open
+TIME_BUCKETS = DEFAULT_BUCKETS
+
+NORMALIZE_PATTERNS = [
+    (re.compile(r'--[^\n]*'), ' '),
+    (re.compile(r'/\*.*?\*/', re.DOTALL), ' '),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '?'),
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b'), '?'),
+    (re.compile(r'\b(TRUE|FALSE|NULL)\b', re.IGNORECASE), '?'),
+    # IN lists and multi-row VALUES differ only in length
+    (re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE), 'IN (?)'),
+    (re.compile(r'\bVALUES\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+', re.IGNORECASE), r'VALUES \1'),
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r' ?, ?'), ', '),
+    (re.compile(r'\( '), '('),
+    (re.compile(r' \)'), ')')
+]
+
+def normalize_query(query):
+    """Replace literals with ? and collapse whitespace, pg_stat_statements style"""
+    normalized = query
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized.strip().rstrip(';').strip()
+
+def fingerprint(query):
+    """Stable id for every query that differs only in literals, case or spacing"""
+    return hashlib.sha1(normalize_query(query).lower().encode()).hexdigest()[:16]
+
+def bucket_index(seconds):
+    for i, bound in enumerate(TIME_BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(TIME_BUCKETS)
+
+def percentile(stats, fraction):
+    """Estimate a latency percentile from the bucket counts (bucket upper bound)"""
+    buckets = stats.time_buckets or []
+    total = sum(buckets)
+    if not total:
+        return None
+    threshold = fraction * total
+    cumulative = 0
+    for i, count in enumerate(buckets):
+        cumulative += count
+        if cumulative >= threshold:
+            return TIME_BUCKETS[i] if i < len(TIME_BUCKETS) else stats.max_time
+    return stats.max_time
+
+def update_query_stats(records):
+    """Fold newly written SQLQuery records into their fingerprint aggregates.
+
+    Runs inside the history write transaction and does not commit.
+    """
+    groups = {}
+    for record in records:
+        key = (record['user_id'], fingerprint(record['query_text']))
+        groups.setdefault(key, []).append(record)
+
+    existing = {
+        (s.user_id, s.fingerprint): s
+        for s in QueryStats.query.filter(tuple_(QueryStats.user_id, QueryStats.fingerprint).in_(list(groups))).all()
+    }
+
+    for key, group in groups.items():
+        stats = existing.get(key)
+        if stats is None:
+            stats = QueryStats(
+                user_id=key[0],
+                fingerprint=key[1],
+                query_type=group[0].get('query_type'),
+                normalized_query=normalize_query(group[0]['query_text']),
+                calls=0, errors=0, total_time=0.0, total_rows=0,
+                first_seen=group[0].get('created_at') or datetime.utcnow()
+            )
+            db.session.add(stats)
+
+        buckets = list(stats.time_buckets or [0] * (len(TIME_BUCKETS) + 1))
+        for record in group:
+            elapsed = record.get('execution_time') or 0.0
+            stats.calls += 1
+            stats.errors += 1 if record.get('error_message') else 0
+            stats.total_time += elapsed
+            stats.total_rows += record.get('result_count') or 0
+            stats.min_time = elapsed if stats.min_time is None else min(stats.min_time, elapsed)
+            stats.max_time = elapsed if stats.max_time is None else max(stats.max_time, elapsed)
+            buckets[bucket_index(elapsed)] += 1
+        stats.time_buckets = buckets
+        stats.last_seen = max(r.get('created_at') or datetime.utcnow() for r in group)
+
+    db.session.flush()
+
+def top_query_stats(user_id, sort='total_time', limit=10):
+    """Fingerprints for a user ordered by total time, mean time, calls or errors"""
+    order = {
+        'total_time': QueryStats.total_time.desc(),
+        'mean_time': (QueryStats.total_time / QueryStats.calls).desc(),
+        'calls': QueryStats.calls.desc(),
+        'errors': QueryStats.errors.desc(),
+        'last_seen': QueryStats.last_seen.desc()
+    }.get(sort, QueryStats.total_time.desc())
+    return QueryStats.query.filter_by(user_id=user_id).order_by(order).limit(limit).all()
+
+def summarize_user(user_id):
+    """Totals across all fingerprints, aggregated over the small stats table"""
+    calls, errors, total_time, shapes = db.session.query(
+        db.func.coalesce(db.func.sum(QueryStats.calls), 0),
+        db.func.coalesce(db.func.sum(QueryStats.errors), 0),
+        db.func.coalesce(db.func.sum(QueryStats.total_time), 0.0),
+        db.func.count(QueryStats.id)
+    ).filter(QueryStats.user_id == user_id).one()
+    return {
+        'calls': calls,
+        'errors': errors,
+        'total_time': total_time,
+        'distinct_queries': shapes,
+        'mean_time': total_time / calls if calls else 0.0
+    }
+
+def stats_to_dict(stats):
+    return {
+        'fingerprint': stats.fingerprint,
+        'query_type': stats.query_type,
+        'normalized_query': stats.normalized_query,
+        'calls': stats.calls,
+        'errors': stats.errors,
+        'error_rate': stats.error_rate,
+        'total_time': stats.total_time,
+        'mean_time': stats.mean_time,
+        'min_time': stats.min_time,
+        'max_time': stats.max_time,
+        'p95_time': percentile(stats, 0.95),
+        'total_rows': stats.total_rows,
+        'first_seen': stats.first_seen.isoformat() if stats.first_seen else None,
+        'last_seen': stats.last_seen.isoformat() if stats.last_seen else None
+    }
+
+def backfill_query_stats(batch_size=1000):
+    """Build the aggregates from existing history once, when the stats table is still empty"""
+    if QueryStats.query.first() is not None or SQLQuery.query.first() is None:
+        return 0
+    columns = ('user_id', 'query_text', 'query_type', 'execution_time', 'result_count', 'error_message', 'created_at')
+    processed = 0
+    last_id = 0
+    try:
+        while True:
+            rows = db.session.query(SQLQuery.id, *[getattr(SQLQuery, c) for c in columns])\
+                             .filter(SQLQuery.id > last_id).order_by(SQLQuery.id).limit(batch_size).all()
+            if not rows:
+                break
+            update_query_stats([dict(zip(columns, row[1:])) for row in rows])
+            db.session.commit()
+            processed += len(rows)
+            last_id = rows[-1][0]
+    except Exception as e:
+        # Another worker starting at the same time may be backfilling already
+        db.session.rollback()
+        print(f"Query stats backfill stopped: {str(e)}")
+    return processed
+
+def init_app(app):
+    from app.services.history_logger_service import history_logger
+    history_logger.register_insert_hook(update_query_stats)
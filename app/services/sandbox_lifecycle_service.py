@@ -0,0 +1,305 @@
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from app.services.metrics_service import metrics
+from app.services.schema_catalog_service import forget_catalog
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process runs its own maintenance pass
+    fcntl = None
+
+SANDBOX_DIR = "user_dbs"
+ARCHIVE_DIR = os.path.join(SANDBOX_DIR, "archive")
+SANDBOX_PATTERN = os.path.join(SANDBOX_DIR, "user_*.db")
+MAINTENANCE_LOCK = os.path.join(SANDBOX_DIR, ".maintenance.lock")
+
+# Activity is recorded as the database file's mtime, at most once per interval
+TOUCH_INTERVAL = 60
+
+def connect_existing(db_path, **kwargs):
+    """Open a sandbox that must already exist; a missing file raises instead of becoming an empty database"""
+    return sqlite3.connect(f"file:{db_path}?mode=rw", uri=True, **kwargs)
+
+metrics.describe('sqlviz_sandbox_maintenance_total',
+                 'Sandbox database maintenance actions (vacuum, incremental_vacuum, analyze, archive, restore)')
+
+class SandboxLifecycle:
+    """Size quotas, idle-time VACUUM/ANALYZE and cold-storage archival for user sandbox databases"""
+
+    def __init__(self):
+        self.enabled = False
+        self.quota_bytes = 0
+        self.interval = 600
+        self.idle_seconds = 600
+        self.archive_seconds = 30 * 86400
+        self.vacuum_ratio = 0.2
+        self.lock = threading.Lock()
+        self.path_locks = {}
+        self.last_touch = {}
+        self.analyzed = {}  # db path -> mtime at the last ANALYZE
+        self.disk_usage = {'live': 0, 'archived': 0}
+        self.thread = None
+        self.pid = None
+        self.stopping = threading.Event()
+
+    def configure(self, enabled, quota_mb, interval, idle_seconds, archive_days, vacuum_ratio):
+        self.enabled = enabled
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.archive_seconds = archive_days * 86400
+        self.vacuum_ratio = vacuum_ratio
+
+        metrics.register_gauge(
+            'sqlviz_sandbox_disk_bytes',
+            'Bytes used by sandbox databases, live and archived, as of the last maintenance pass',
+            lambda: {(('state', state),): size for state, size in self.disk_usage.items()}
+        )
+
+    def path_lock(self, db_path):
+        with self.lock:
+            return self.path_locks.setdefault(db_path, threading.Lock())
+
+    @staticmethod
+    def archive_path(db_path):
+        return os.path.join(ARCHIVE_DIR, f"{os.path.basename(db_path)}.gz")
+
+    def apply_quota(self, conn):
+        """Cap the main database of a connection at the configured size.
+
+        max_page_count is per connection, so every connection sets it.
+        Writes past the cap fail with SQLITE_FULL ("database or disk is full").
+        """
+        if not self.quota_bytes:
+            return
+        page_size = conn.execute("PRAGMA main.page_size").fetchone()[0]
+        conn.execute(f"PRAGMA main.max_page_count = {max(1, self.quota_bytes // page_size)}")
+
+    def touch(self, db_path):
+        """Record activity on a sandbox so it is not maintained or archived while in use"""
+        now = time.time()
+        if now - self.last_touch.get(db_path, 0) >= TOUCH_INTERVAL:
+            self.last_touch[db_path] = now
+            try:
+                os.utime(db_path, None)
+            except OSError:
+                pass
+        if self.enabled:
+            self._ensure_started()
+
+    def restore_if_archived(self, db_path):
+        """Bring an archived database back before it is opened; returns True if one was restored"""
+        if os.path.exists(db_path):
+            return False
+        archive = self.archive_path(db_path)
+        if not os.path.exists(archive):
+            return False
+
+        with self.path_lock(db_path):
+            if os.path.exists(db_path) or not os.path.exists(archive):
+                return False
+            temp_path = f"{db_path}.restore-{os.getpid()}"
+            with gzip.open(archive, 'rb') as source, open(temp_path, 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            os.replace(temp_path, db_path)
+            try:
+                os.remove(archive)
+            except FileNotFoundError:
+                pass  # another worker restored it at the same time
+
+        forget_catalog(db_path)
+        metrics.inc('sqlviz_sandbox_maintenance_total', {'action': 'restore'})
+        return True
+
+    @staticmethod
+    def last_activity(db_path):
+        times = []
+        for path in (db_path, f"{db_path}-wal"):
+            try:
+                times.append(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                pass
+        return max(times) if times else 0
+
+    def run_maintenance(self, now=None):
+        """One pass over every sandbox: archive long-idle ones, vacuum and analyze idle ones"""
+        now = now or time.time()
+        summary = {'maintained': 0, 'archived': 0, 'skipped': 0}
+        with self.host_lock() as acquired:
+            if not acquired:
+                return summary
+
+            for db_path in sorted(glob.glob(SANDBOX_PATTERN)):
+                idle = now - self.last_activity(db_path)
+                try:
+                    if self.archive_seconds and idle >= self.archive_seconds:
+                        if self.archive(db_path):
+                            summary['archived'] += 1
+                        else:
+                            summary['skipped'] += 1
+                    elif idle >= self.idle_seconds:
+                        if self.maintain(db_path):
+                            summary['maintained'] += 1
+                    else:
+                        summary['skipped'] += 1
+                except sqlite3.OperationalError:
+                    # Busy or locked: it is in use after all, try again next pass
+                    summary['skipped'] += 1
+                except Exception as e:
+                    print(f"Error maintaining {db_path}: {str(e)}")
+
+            self.disk_usage = {
+                'live': sum(os.path.getsize(p) for p in glob.glob(SANDBOX_PATTERN)),
+                'archived': sum(os.path.getsize(p) for p in glob.glob(os.path.join(ARCHIVE_DIR, '*.gz')))
+            }
+        return summary
+
+    def maintain(self, db_path):
+        """Reclaim free pages and refresh planner statistics; returns the actions taken"""
+        before = os.stat(db_path)
+        actions = []
+        conn = connect_existing(db_path, timeout=0)  # never wait on a database someone is using
+        try:
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+            if freelist and freelist >= page_count * self.vacuum_ratio:
+                if auto_vacuum == 2:
+                    # executescript steps the pragma to completion; execute() frees a single page
+                    conn.executescript("PRAGMA incremental_vacuum")
+                    actions.append('incremental_vacuum')
+                else:
+                    # A full VACUUM also switches older databases to incremental auto-vacuum
+                    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                    conn.execute("VACUUM")
+                    actions.append('vacuum')
+
+            if self.analyzed.get(db_path) != before.st_mtime_ns:
+                conn.execute("PRAGMA analysis_limit = 1000")
+                conn.execute("ANALYZE")
+                conn.commit()
+                actions.append('analyze')
+        finally:
+            conn.close()
+
+        if actions:
+            # Maintenance is not user activity; keep the idle clock where it was
+            os.utime(db_path, ns=(before.st_atime_ns, before.st_mtime_ns))
+        self.analyzed[db_path] = before.st_mtime_ns
+        for action in actions:
+            metrics.inc('sqlviz_sandbox_maintenance_total', {'action': action})
+        return actions
+
+    def archive(self, db_path):
+        """Compress an inactive database into the archive and remove the live file.
+
+        Returns False, leaving the database in place, if it was used after the
+        idle check. Requests touch the file before connecting and then wait
+        for a read lock, so once the exclusive lock is held a recent mtime means
+        someone is about to use it.
+        """
+        archive = self.archive_path(db_path)
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        with self.path_lock(db_path):
+            conn = connect_existing(db_path, timeout=0)
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                # Hold the write lock so nothing changes between compressing and removing
+                conn.execute("BEGIN EXCLUSIVE")
+                if self.archive_seconds and time.time() - self.last_activity(db_path) < self.archive_seconds:
+                    conn.execute("ROLLBACK")
+                    return False
+                stat = os.stat(db_path)
+                temp_path = f"{archive}.tmp"
+                with open(db_path, 'rb') as source, gzip.open(temp_path, 'wb', compresslevel=6) as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                os.replace(temp_path, archive)
+                os.utime(archive, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                os.remove(db_path)
+            finally:
+                conn.close()
+            for suffix in ('-wal', '-shm', '-journal'):
+                try:
+                    os.remove(f"{db_path}{suffix}")
+                except FileNotFoundError:
+                    pass
+
+        self.analyzed.pop(db_path, None)
+        self.last_touch.pop(db_path, None)
+        forget_catalog(db_path)
+        metrics.inc('sqlviz_sandbox_maintenance_total', {'action': 'archive'})
+        return True
+
+    @contextmanager
+    def host_lock(self):
+        """Only one worker process per host runs a maintenance pass at a time"""
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(SANDBOX_DIR, exist_ok=True)
+        with open(MAINTENANCE_LOCK, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so pre-forking servers start one per worker
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, name='sandbox-maintenance', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                print(f"Sandbox maintenance pass failed: {str(e)}")
+
+    def stop(self):
+        self.stopping.set()
+
+sandbox_lifecycle = SandboxLifecycle()
+
+def usage(db_path):
+    """Size, quota and free space of one sandbox database"""
+    conn = connect_existing(db_path)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        'size_bytes': page_size * page_count,
+        'free_bytes': page_size * freelist,
+        'quota_bytes': sandbox_lifecycle.quota_bytes or None
+    }
+
+def init_app(app):
+    sandbox_lifecycle.configure(
+        enabled=app.config['SANDBOX_MAINTENANCE'],
+        quota_mb=app.config['SANDBOX_QUOTA_MB'],
+        interval=app.config['SANDBOX_MAINTENANCE_INTERVAL'],
+        idle_seconds=app.config['SANDBOX_IDLE_SECONDS'],
+        archive_days=app.config['SANDBOX_ARCHIVE_DAYS'],
+        vacuum_ratio=app.config['SANDBOX_VACUUM_RATIO']
+    )
@@ -0,0 +1,362 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from app.models import SavedQuery
+from app.result_set import ResultSet
+from app.services.metrics_service import metrics
+from app.services.schema_catalog_service import data_version
+from app.services.sql_service import SQLService
+from app.services.table_profile_service import quote_identifier
+from app.services.visualization_service import VisualizationService
+from app import db
+
+VERSIONS_TABLE = '_mv_versions'
+STATE_TABLE = '_mv_state'
+TRIGGER_PREFIX = '_mv_bump_'
+TRIGGER_OPERATIONS = ('insert', 'update', 'delete')
+
+# Rows handed to the visualizer; larger materializations are binned in SQL where possible
+CHART_ROWS = 5000
+
+# What a saved query may do while it is prepared; anything else means it writes
+READ_ONLY_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+metrics.describe('sqlviz_materialization_total', 'Materialized saved query reads by result (fresh, refreshed)')
+
+# (db path, saved query id) -> data_version at which the materialization was last verified fresh
+_fresh_versions = {}
+_fresh_lock = threading.Lock()
+
+def materialization_table(saved_query_id):
+    return f"_mv_{saved_query_id}"
+
+def sql_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def clean_query(query):
+    return (query or '').strip().rstrip(';').strip()
+
+class SavedQueryService:
+    """Saved dashboard queries, with materializations refreshed only when their tables change.
+
+    Every user table a materialized query reads gets AFTER INSERT/UPDATE/DELETE
+    triggers that bump a per-table counter in _mv_versions. A materialization
+    is stale when those counters, or the set of tables the query reads, differ
+    from what was recorded at its last refresh. data_version() skips the check
+    entirely when nothing was committed to the database since it last passed.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.sql_service = SQLService(user_id)
+        self.db_path = self.sql_service.db_path
+
+    def dependencies(self, conn, query):
+        """Sorted [database, table] pairs a query reads; raises ValueError if it would write"""
+        tables = set()
+        unqualified = set()
+
+        def authorizer(action, arg1, arg2, db_name, source):
+            if action not in READ_ONLY_ACTIONS:
+                return sqlite3.SQLITE_DENY
+            if action == sqlite3.SQLITE_READ and not arg1.startswith('sqlite_'):
+                if db_name:
+                    tables.add((db_name, arg1))
+                else:
+                    # Reads of no column (COUNT(*), SELECT 1 FROM t, EXISTS) carry no database name
+                    unqualified.add(arg1)
+            return sqlite3.SQLITE_OK
+
+        conn.set_authorizer(authorizer)
+        try:
+            conn.execute(f"EXPLAIN {query}")
+        except sqlite3.DatabaseError as e:
+            if 'not authorized' in str(e):
+                raise ValueError('Saved queries must be read-only SELECT statements')
+            raise
+        finally:
+            conn.set_authorizer(None)
+
+        for table in unqualified:
+            resolved = self.resolve_table(conn, table)
+            if resolved:
+                tables.add(resolved)
+        return [list(t) for t in sorted(tables)]
+
+    @staticmethod
+    def resolve_table(conn, table):
+        """(database, table) an unqualified name refers to: main first, then the attached templates"""
+        schemas = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] != 'temp']
+        for schema in sorted(schemas, key=lambda name: name != 'main'):
+            row = conn.execute(
+                f"SELECT name FROM {quote_identifier(schema)}.sqlite_master "
+                f"WHERE type = 'table' AND name = ? COLLATE NOCASE",
+                (table,)
+            ).fetchone()
+            if row:
+                return (schema, row[0])
+        return None
+
+    def validate(self, query):
+        conn = self.sql_service.get_connection()
+        try:
+            return self.dependencies(conn, query)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def setup(conn):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS main.{VERSIONS_TABLE} "
+                     f"(table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS main.{STATE_TABLE} "
+                     f"(saved_query_id INTEGER PRIMARY KEY, dependencies TEXT NOT NULL, "
+                     f"refreshed_at TEXT, row_count INTEGER, refresh_time REAL)")
+
+    @staticmethod
+    def trigger_names(conn):
+        return {row[0] for row in conn.execute(
+            "SELECT name FROM main.sqlite_master WHERE type = 'trigger' AND name LIKE '\\_mv\\_bump\\_%' ESCAPE '\\'"
+        )}
+
+    @staticmethod
+    def trigger_name(operation, table):
+        return f"{TRIGGER_PREFIX}{operation}_{table}"
+
+    def ensure_triggers(self, conn, dependencies):
+        existing = self.trigger_names(conn)
+        for db_name, table in dependencies:
+            if db_name != 'main':
+                continue  # shared templates are read-only
+            for operation in TRIGGER_OPERATIONS:
+                name = self.trigger_name(operation, table)
+                if name in existing:
+                    continue
+                conn.execute(
+                    f"CREATE TRIGGER main.{quote_identifier(name)} AFTER {operation.upper()} ON {quote_identifier(table)} "
+                    f"BEGIN INSERT INTO {VERSIONS_TABLE} (table_name, version) VALUES ({sql_literal(table)}, 1) "
+                    f"ON CONFLICT(table_name) DO UPDATE SET version = version + 1; END"
+                )
+
+    def current_token(self, conn, dependencies):
+        """Dependencies plus their change counters, as recorded in _mv_state"""
+        main_tables = [table for db_name, table in dependencies if db_name == 'main']
+        versions = {}
+        if main_tables:
+            placeholders = ', '.join('?' for _ in main_tables)
+            versions = dict(conn.execute(
+                f"SELECT table_name, version FROM main.{VERSIONS_TABLE} WHERE table_name IN ({placeholders})",
+                main_tables
+            ).fetchall())
+        return json.dumps({'tables': dependencies, 'versions': versions}, sort_keys=True)
+
+    def is_stale(self, conn, saved_query):
+        query = clean_query(saved_query.query_text)
+        dependencies = self.dependencies(conn, query)
+        try:
+            state = conn.execute(f"SELECT dependencies FROM main.{STATE_TABLE} WHERE saved_query_id = ?",
+                                 (saved_query.id,)).fetchone()
+            token = self.current_token(conn, dependencies)
+        except sqlite3.OperationalError:
+            return True  # bookkeeping tables not created yet
+        if state is None or state[0] != token:
+            return True
+
+        # A dropped and recreated table loses its triggers without bumping its counter
+        triggers = self.trigger_names(conn)
+        for db_name, table in dependencies:
+            if db_name == 'main' and any(self.trigger_name(op, table) not in triggers for op in TRIGGER_OPERATIONS):
+                return True
+        exists = conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                              (materialization_table(saved_query.id),)).fetchone()
+        return exists is None
+
+    def ensure_fresh(self, saved_query, force=False):
+        """Refresh the materialization if its tables changed; returns 'fresh' or 'refreshed'"""
+        key = (self.db_path, saved_query.id)
+        # Taken before checking, so any commit after the check changes it again
+        version = data_version(self.db_path)
+        if not force:
+            with _fresh_lock:
+                if _fresh_versions.get(key) == version:
+                    metrics.inc('sqlviz_materialization_total', {'result': 'fresh'})
+                    return 'fresh'
+
+        conn = self.sql_service.get_connection()
+        try:
+            stale = force or self.is_stale(conn, saved_query)
+        finally:
+            conn.close()
+
+        if not stale:
+            with _fresh_lock:
+                _fresh_versions[key] = version
+            metrics.inc('sqlviz_materialization_total', {'result': 'fresh'})
+            return 'fresh'
+
+        self.refresh(saved_query, force=force)
+        with _fresh_lock:
+            _fresh_versions.pop(key, None)
+        metrics.inc('sqlviz_materialization_total', {'result': 'refreshed'})
+        return 'refreshed'
+
+    def refresh(self, saved_query, force=False):
+        """Rebuild the materialization in one write transaction"""
+        query = clean_query(saved_query.query_text)
+        table = quote_identifier(materialization_table(saved_query.id))
+        conn = self.sql_service.get_connection()
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Another request may have refreshed it while this one waited for the lock
+            if not force and not self.is_stale(conn, saved_query):
+                conn.execute("ROLLBACK")
+                return
+
+            self.setup(conn)
+            dependencies = self.dependencies(conn, query)
+            self.ensure_triggers(conn, dependencies)
+
+            start = time.perf_counter()
+            conn.execute(f"DROP TABLE IF EXISTS main.{table}")
+            conn.execute(f"CREATE TABLE main.{table} AS {query}")
+            row_count = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+            conn.execute(
+                f"INSERT OR REPLACE INTO main.{STATE_TABLE} "
+                f"(saved_query_id, dependencies, refreshed_at, row_count, refresh_time) VALUES (?, ?, ?, ?, ?)",
+                (saved_query.id, self.current_token(conn, dependencies), datetime.utcnow().isoformat(),
+                 row_count, time.perf_counter() - start)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def drop(self, saved_query):
+        """Remove a materialization and any triggers no other materialization needs"""
+        conn = self.sql_service.get_connection()
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self.setup(conn)
+            conn.execute(f"DROP TABLE IF EXISTS main.{quote_identifier(materialization_table(saved_query.id))}")
+            conn.execute(f"DELETE FROM main.{STATE_TABLE} WHERE saved_query_id = ?", (saved_query.id,))
+
+            needed = set()
+            for (dependencies,) in conn.execute(f"SELECT dependencies FROM main.{STATE_TABLE}").fetchall():
+                needed.update(table for db_name, table in json.loads(dependencies)['tables'] if db_name == 'main')
+            for name in self.trigger_names(conn):
+                if not any(name == self.trigger_name(op, table) for table in needed for op in TRIGGER_OPERATIONS):
+                    conn.execute(f"DROP TRIGGER IF EXISTS main.{quote_identifier(name)}")
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        with _fresh_lock:
+            _fresh_versions.pop((self.db_path, saved_query.id), None)
+
+    def states(self):
+        """Refresh metadata for every materialization, keyed by saved query id"""
+        conn = self.sql_service.get_connection()
+        try:
+            rows = conn.execute(f"SELECT saved_query_id, refreshed_at, row_count, refresh_time "
+                                f"FROM main.{STATE_TABLE}").fetchall()
+        except sqlite3.OperationalError:
+            return {}
+        finally:
+            conn.close()
+        return {r[0]: {'refreshed_at': r[1], 'row_count': r[2], 'refresh_time': r[3]} for r in rows}
+
+    def read(self, saved_query, limit=None):
+        """ResultSet of a saved query: from its materialization when it has one, else by running it.
+
+        Returns (result_set, total_rows, source, status).
+        """
+        if not saved_query.materialized:
+            result = self.sql_service.execute_query(clean_query(saved_query.query_text))
+            if 'error' in result:
+                raise ValueError(result['error'])
+            result_set = result['result_set']
+            return (result_set.head(limit) if limit else result_set), result['result_count'], 'query', None
+
+        status = self.ensure_fresh(saved_query)
+        table = quote_identifier(materialization_table(saved_query.id))
+        conn = self.sql_service.get_connection()
+        try:
+            total = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+            cursor = conn.execute(f"SELECT * FROM main.{table}" + (" LIMIT ?" if limit else ""),
+                                  (limit,) if limit else ())
+            result_set = ResultSet.from_cursor(cursor)
+        finally:
+            conn.close()
+        return result_set, total, 'materialization', status
+
+    def results(self, saved_query, limit=None):
+        result_set, total, source, status = self.read(saved_query, limit=limit)
+        results = result_set.to_json()
+        results.update({'result_count': total, 'source': source, 'status': status})
+        return results
+
+    def visualization(self, saved_query, chart_type=None):
+        result_set, total, source, _ = self.read(saved_query, limit=CHART_ROWS)
+        # Binned charts over a large materialization aggregate the stored table, not the original query
+        source_query = (f"SELECT * FROM main.{quote_identifier(materialization_table(saved_query.id))}"
+                        if saved_query.materialized else clean_query(saved_query.query_text))
+        visualization = VisualizationService(self.sql_service).create_visualization(
+            result_set,
+            'SELECT',
+            source_query,
+            chart_type=chart_type or saved_query.chart_type,
+            total_rows=total
+        )
+        visualization['source'] = source
+        return visualization
+
+    def save(self, name, query, chart_type=None, materialized=False):
+        query = clean_query(query)
+        if not name or not query:
+            raise ValueError('A name and a query are required')
+        if SavedQuery.query.filter_by(user_id=self.user_id, name=name).first():
+            raise ValueError(f'A saved query named {name} already exists')
+        self.validate(query)
+
+        saved_query = SavedQuery(user_id=self.user_id, name=name, query_text=query,
+                                 chart_type=chart_type, materialized=materialized)
+        db.session.add(saved_query)
+        db.session.commit()
+        if materialized:
+            try:
+                self.ensure_fresh(saved_query, force=True)
+            except Exception:
+                db.session.delete(saved_query)
+                db.session.commit()
+                raise
+        return saved_query
+
+    def delete(self, saved_query):
+        if saved_query.materialized:
+            self.drop(saved_query)
+        db.session.delete(saved_query)
+        db.session.commit()
+
+def saved_query_to_dict(saved_query, state=None):
+    state = state or {}
+    return {
+        'id': saved_query.id,
+        'name': saved_query.name,
+        'query_text': saved_query.query_text,
+        'chart_type': saved_query.chart_type,
+        'materialized': bool(saved_query.materialized),
+        'created_at': saved_query.created_at.isoformat() if saved_query.created_at else None,
+        'refreshed_at': state.get('refreshed_at'),
+        'row_count': state.get('row_count'),
+        'refresh_time': state.get('refresh_time')
+    }
@@ -0,0 +1,171 @@
+import sqlite3
+import os
+import threading
+import time
+from app.services.metrics_service import metrics
+from app.services.template_library_service import attached_templates
+
+# mtimes newer than this may hide a second write in the same clock tick
+RACY_WINDOW_NS = 100_000_000
+
+def _describe_columns(conn, table, schema='main'):
+    columns = []
+    for column in conn.execute(f'PRAGMA {schema}.table_info("{table}")').fetchall():
+        constraints = []
+        if column[5]:
+            constraints.append('PRIMARY KEY')
+        if column[3]:
+            constraints.append('NOT NULL')
+        columns.append({
+            'column': column[1],
+            'type': column[2],
+            'not_null': bool(column[3]),
+            'default_value': column[4],
+            'primary_key': bool(column[5]),
+            'constraints': ' '.join(constraints)
+        })
+    return columns
+
+class SchemaCatalog:
+    """In-memory table/column catalog for one user database.
+
+    The catalog is keyed on PRAGMA schema_version. A stat() of the database
+    files decides whether it is worth asking SQLite at all, and when the
+    version has moved only tables whose CREATE statement changed are
+    described again.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.schema_version = None
+        self.file_state = None
+        self.tables = {}  # name -> {'sql': create statement, 'columns': [...]}
+
+    def _file_state(self):
+        state = []
+        now = time.time_ns()
+        for path in (self.db_path, f"{self.db_path}-wal"):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                state.append(None)
+                continue
+            if now - stat.st_mtime_ns < RACY_WINDOW_NS:
+                return None
+            state.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(state)
+
+    def refresh(self):
+        """Bring the catalog up to date; returns the current schema version"""
+        with self.lock:
+            file_state = self._file_state()
+            if file_state is not None and file_state == self.file_state:
+                metrics.inc('sqlviz_schema_catalog_total', {'result': 'hit'})
+                return self.schema_version
+
+            try:
+                # mode=rw so an archived sandbox is not recreated as an empty file
+                conn = sqlite3.connect(f"file:{self.db_path}?mode=rw", uri=True)
+            except sqlite3.OperationalError:
+                if os.path.exists(self.db_path):
+                    raise
+                self.tables = {}
+                self.schema_version = self.file_state = None
+                return None
+            try:
+                schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+                if schema_version == self.schema_version:
+                    # Data changed but the schema did not
+                    self.file_state = file_state
+                    metrics.inc('sqlviz_schema_catalog_total', {'result': 'hit'})
+                    return self.schema_version
+
+                # _mv_* tables hold saved-query materializations, not user data
+                master = conn.execute(
+                    "SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+                    "AND name NOT LIKE '\\_mv\\_%' ESCAPE '\\'"
+                ).fetchall()
+                tables = {}
+                for name, sql in master:
+                    cached = self.tables.get(name)
+                    if cached is not None and cached['sql'] == sql:
+                        tables[name] = cached
+                    else:
+                        tables[name] = {'sql': sql, 'columns': _describe_columns(conn, name)}
+            finally:
+                conn.close()
+
+            self.tables = tables
+            self.schema_version = schema_version
+            self.file_state = file_state
+            metrics.inc('sqlviz_schema_catalog_total', {'result': 'refresh'})
+            return schema_version
+
+    def table_names(self):
+        self.refresh()
+        return list(self.tables)
+
+    def columns(self, table_name):
+        """Columns of a table (matched case-insensitively), or None if it does not exist"""
+        self.refresh()
+        table = self.tables.get(table_name)
+        if table is None:
+            table = next((t for name, t in self.tables.items() if name.lower() == table_name.lower()), None)
+        return table['columns'] if table else None
+
+    def snapshot(self):
+        """Return (version, {table: [column names]}) for the user's own tables"""
+        version = self.refresh()
+        return version, {name: [c['column'] for c in t['columns']] for name, t in self.tables.items()}
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+_shared_columns = None
+
+metrics.describe('sqlviz_schema_catalog_total', 'Schema catalog lookups by result (hit or refresh)')
+
+def get_catalog(db_path):
+    """Return the process-wide catalog for a database file"""
+    with _catalogs_lock:
+        catalog = _catalogs.get(db_path)
+        if catalog is None:
+            catalog = _catalogs[db_path] = SchemaCatalog(db_path)
+        return catalog
+
+def forget_catalog(db_path):
+    """Drop a cached catalog, e.g. when the database file is archived or replaced"""
+    with _catalogs_lock:
+        _catalogs.pop(db_path, None)
+
+def data_version(db_path):
+    """Cheap token that changes whenever any transaction commits to the database.
+
+    Rollback-journal databases bump the file change counter in the header on
+    every commit; in WAL mode commits land in the -wal file first.
+    """
+    with open(db_path, 'rb') as f:
+        header = f.read(28)
+    change_counter = int.from_bytes(header[24:28], 'big') if len(header) == 28 else 0
+    try:
+        stat = os.stat(f"{db_path}-wal")
+        wal = f"{stat.st_mtime_ns}-{stat.st_size}"
+    except FileNotFoundError:
+        wal = '0'
+    return f"{change_counter}-{wal}"
+
+def shared_table_columns():
+    """Column names of the shared template tables; they are immutable, so this is built once"""
+    global _shared_columns
+    if _shared_columns is None:
+        shared = {}
+        for schema, uri in attached_templates():
+            conn = sqlite3.connect(uri, uri=True)
+            try:
+                for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"):
+                    if not table.startswith('sqlite_'):
+                        shared.setdefault(table, [c['column'] for c in _describe_columns(conn, table)])
+            finally:
+                conn.close()
+        _shared_columns = shared
+    return _shared_columns
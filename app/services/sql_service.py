@@ -3,6 +3,12 @@ import re
 import time
 import os
 from app.models import GeneratedTable
+from app.result_set import ResultSet
+from app.services.metrics_service import span
+from app.services.sandbox_lifecycle_service import sandbox_lifecycle, connect_existing
+from app.services.schema_catalog_service import get_catalog
+from app.services.snapshot_service import SnapshotService, SEED_SNAPSHOT
+from app.services.template_library_service import attach_templates, write_targets, copy_up, template_tables
 from app import db
 
 class SQLService:
@@ -12,13 +18,87 @@ class SQLService:
         self.ensure_user_db_exists()
     
     def ensure_user_db_exists(self):
-        """Create user-specific database directory and file"""
+        """Create user-specific database directory and file, restoring an archived one first"""
         os.makedirs("user_dbs", exist_ok=True)
+        sandbox_lifecycle.restore_if_archived(self.db_path)
         
         # Create database if it doesn't exist
         if not os.path.exists(self.db_path):
             conn = sqlite3.connect(self.db_path)
+            # Incremental auto-vacuum lets maintenance give freed pages back cheaply
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
             conn.close()
+        
+        sandbox_lifecycle.touch(self.db_path)
+    
+    def get_connection(self):
+        """Open a connection to the user's database with shared templates attached"""
+        with span('sql_connect'):
+            conn = self.open_existing()
+            if conn is None:
+                # Archived since ensure_user_db_exists: restore it and try once more
+                self.ensure_user_db_exists()
+                conn = self.open_existing()
+                if conn is None:
+                    raise sqlite3.OperationalError(f"Sandbox database {self.db_path} is unavailable")
+            sandbox_lifecycle.apply_quota(conn)
+            attach_templates(conn)
+            return conn
+    
+    def open_existing(self):
+        """Connect without ever creating the file; None if it is gone.
+
+        The first read waits for the shared lock, so an archive in progress
+        finishes first and its removal of the file is seen here.
+        """
+        try:
+            conn = connect_existing(self.db_path)
+        except sqlite3.OperationalError:
+            return None
+        try:
+            conn.execute("SELECT 1 FROM main.sqlite_master LIMIT 1").fetchall()
+        except sqlite3.OperationalError:
+            if os.path.exists(self.db_path):
+                conn.close()
+                raise
+        if not os.path.exists(self.db_path):
+            conn.close()
+            return None
+        return conn
+    
+    def copy_up_template_table(self, conn, query):
+        """Give the user a private copy of a shared table before the first write to it.
+
+        Raises ValueError for a DROP or RENAME of a shared table name: it would
+        only remove the private copy and leave the shared table showing through.
+        """
+        targets = write_targets(conn, query)
+        for table, kind in targets.items():
+            if kind in ('drop', 'rename') and table.lower() in template_tables():
+                action = 'dropped' if kind == 'drop' else 'renamed'
+                raise ValueError(f"{table} is a shared template table and cannot be {action}; "
+                                 f"use DELETE FROM {table} to empty your copy of it")
+        
+        for table in targets:
+            copied_rows = copy_up(conn, table)
+            if copied_rows is None:
+                continue
+            conn.commit()
+            
+            try:
+                schema = [{'column': c[1], 'type': c[2], 'constraints': 'PRIMARY KEY' if c[5] else ''}
+                          for c in conn.execute(f'PRAGMA main.table_info("{table}")').fetchall()]
+                db.session.add(GeneratedTable(
+                    user_id=self.user_id,
+                    table_name=table,
+                    table_schema=schema,
+                    sample_data_count=copied_rows,
+                    created_by_ai=False
+                ))
+                db.session.commit()
+            except Exception as e:
+                print(f"Error recording copied table {table}: {str(e)}")
     
     def execute_query_with_ai_assistance(self, query, gemini_service):
         """Execute SQL query with AI assistance for table creation"""
@@ -27,21 +107,22 @@ class SQLService:
         try:
             # First, try to execute the query directly
             result = self.execute_query(query)
-            if result.get('success'):
+            if result.get('success') or result.get('quota_exceeded') or result.get('rejected'):
                 return result
             
-            # If query failed, analyze with AI to create necessary tables
-            ai_analysis = gemini_service.analyze_query_and_create_tables(query)
-            
-            if 'error' in ai_analysis:
-                return {'error': ai_analysis['error']}
-            
-            # Create tables based on AI analysis
+            # If query failed, analyze with AI to create necessary tables.
+            # Each table is created as soon as the model finishes streaming it.
             tables_created = []
-            for table_info in ai_analysis.get('tables', []):
-                created = self.create_table_from_ai_analysis(table_info)
-                if created:
-                    tables_created.append(table_info['name'])
+            explanation = ''
+            for event, payload in gemini_service.analyze_query_and_create_tables_stream(query):
+                if event == 'table':
+                    if self.create_table_from_ai_analysis(payload):
+                        tables_created.append(payload['name'])
+                elif event == 'error':
+                    if not tables_created:
+                        return {'error': payload}
+                elif event == 'done':
+                    explanation = payload.get('explanation', '')
             
             # Try executing the original query again
             result = self.execute_query(query)
@@ -49,7 +130,7 @@ class SQLService:
             if result.get('success'):
                 result['ai_assisted'] = True
                 result['tables_created'] = tables_created
-                result['ai_explanation'] = ai_analysis.get('explanation', '')
+                result['ai_explanation'] = explanation
             
             return result
             
@@ -64,12 +145,24 @@ class SQLService:
         start_time = time.time()
         
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # Enable column access by name
+            conn = self.get_connection()
             cursor = conn.cursor()
             
+            # Shared template tables are read-only; copy them up before writing
+            try:
+                self.copy_up_template_table(conn, query)
+            except ValueError as e:
+                conn.close()
+                # Not a missing table, so there is nothing for AI assistance to create
+                return {
+                    'error': str(e),
+                    'rejected': True,
+                    'execution_time': time.time() - start_time
+                }
+            
             # Execute the query
-            cursor.execute(query)
+            with span('sql_execute'):
+                cursor.execute(query)
             
             # Determine query type
             query_type = self.get_query_type(query)
@@ -81,23 +174,20 @@ class SQLService:
             }
             
             if query_type in ['SELECT']:
-                # Fetch results for SELECT queries
-                rows = cursor.fetchall()
-                columns = [description[0] for description in cursor.description]
-                
-                data = []
-                for row in rows:
-                    data.append(dict(row))
+                # Fetch results for SELECT queries straight into columns
+                with span('sql_fetch'):
+                    result_set = ResultSet.from_cursor(cursor)
                 
                 result.update({
-                    'data': data,
-                    'columns': columns,
-                    'result_count': len(data)
+                    'result_set': result_set,
+                    'columns': result_set.columns,
+                    'result_count': len(result_set)
                 })
                 
             elif query_type in ['INSERT', 'UPDATE', 'DELETE']:
                 # For modification queries
-                conn.commit()
+                with span('sql_commit'):
+                    conn.commit()
                 result.update({
                     'affected_rows': cursor.rowcount,
                     'result_count': cursor.rowcount
@@ -105,7 +195,8 @@ class SQLService:
                 
             elif query_type in ['CREATE', 'DROP', 'ALTER']:
                 # For schema modification queries
-                conn.commit()
+                with span('sql_commit'):
+                    conn.commit()
                 result.update({
                     'message': f'{query_type} operation completed successfully',
                     'result_count': 1
@@ -115,6 +206,13 @@ class SQLService:
             return result
             
         except sqlite3.Error as e:
+            if getattr(e, 'sqlite_errorname', None) == 'SQLITE_FULL' and sandbox_lifecycle.quota_bytes:
+                return {
+                    'error': f"Your sandbox database reached its {sandbox_lifecycle.quota_bytes // (1024 * 1024)} MB "
+                             f"limit. Drop tables or delete rows to free space.",
+                    'quota_exceeded': True,
+                    'execution_time': time.time() - start_time
+                }
             return {
                 'error': str(e),
                 'execution_time': time.time() - start_time
@@ -123,7 +221,7 @@ class SQLService:
     def create_table_from_ai_analysis(self, table_info):
         """Create table based on AI analysis"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self.get_connection()
             cursor = conn.cursor()
             
             # Execute CREATE TABLE statement
@@ -148,12 +246,46 @@ class SQLService:
             db.session.add(generated_table)
             db.session.commit()
             
+            # Add the freshly seeded table to the seed checkpoint so it can be reset
+            # without another AI call; other tables keep their originally generated data
+            try:
+                SnapshotService(self.user_id).add_table(SEED_SNAPSHOT, table_info['name'])
+            except Exception as e:
+                print(f"Error creating seed snapshot: {str(e)}")
+            
             return True
             
         except Exception as e:
             print(f"Error creating table {table_info['name']}: {str(e)}")
             return False
     
+    def reconcile_generated_tables(self):
+        """Make GeneratedTable records match the tables in the database, e.g. after a snapshot restore"""
+        try:
+            tables = {name.lower(): name for name in self.get_table_list()}
+            records = GeneratedTable.query.filter_by(user_id=self.user_id).all()
+            recorded = set()
+            for record in records:
+                if record.table_name.lower() in tables:
+                    recorded.add(record.table_name.lower())
+                else:
+                    db.session.delete(record)
+            for key, table in tables.items():
+                if key not in recorded:
+                    schema = [{'column': c['column'], 'type': c['type'], 'constraints': c['constraints']}
+                              for c in self.get_table_schema(table)]
+                    db.session.add(GeneratedTable(
+                        user_id=self.user_id,
+                        table_name=table,
+                        table_schema=schema,
+                        sample_data_count=0,
+                        created_by_ai=False
+                    ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error reconciling generated tables: {str(e)}")
+    
     def get_query_type(self, query):
         """Determine the type of SQL query"""
         query = query.strip().upper()
@@ -178,48 +310,21 @@ class SQLService:
     def get_table_list(self):
         """Get list of tables in user's database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-            
-            conn.close()
-            return [table[0] for table in tables]
-            
+            return get_catalog(self.db_path).table_names()
         except Exception as e:
             return []
     
     def get_table_schema(self, table_name):
         """Get schema information for a specific table"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            schema_info = cursor.fetchall()
-            
-            conn.close()
-            
-            schema = []
-            for column in schema_info:
-                schema.append({
-                    'column': column[1],
-                    'type': column[2],
-                    'not_null': bool(column[3]),
-                    'default_value': column[4],
-                    'primary_key': bool(column[5])
-                })
-            
-            return schema
-            
+            return get_catalog(self.db_path).columns(table_name) or []
         except Exception as e:
             return []
     
     def get_table_sample_data(self, table_name, limit=5):
         """Get sample data from a table"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self.get_connection()
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
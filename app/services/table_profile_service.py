@@ -0,0 +1,195 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from app.services.metrics_service import metrics, span
+from app.services.schema_catalog_service import get_catalog, data_version
+from app.services.sql_service import SQLService
+from app.services.template_library_service import template_tables
+
+CACHE_SIZE = 256
+# SQLite allows 2000 result columns; each profiled column takes 8 aggregates
+COLUMNS_PER_PASS = 200
+# Each histogram scans the rows once, so wide tables only get the first ones
+MAX_HISTOGRAM_COLUMNS = 50
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+metrics.describe('sqlviz_table_profile_total', 'Table profile requests by result (hit or computed)')
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+class TableProfileService:
+    """Per-column summary statistics computed with aggregate SQL inside SQLite"""
+
+    def __init__(self, user_id, sample_rows=100000, sample_ranges=10, bins=20):
+        self.user_id = user_id
+        self.db_path = f"user_dbs/user_{user_id}.db"
+        self.sample_rows = sample_rows
+        self.sample_ranges = sample_ranges
+        self.bins = bins
+
+    def profile(self, table_name):
+        """Return the profile for a table, reusing the cached one while the data is unchanged"""
+        source = self.resolve_table(table_name)
+        if source is None:
+            return {'error': f'Table {table_name} not found'}
+
+        version = data_version(self.db_path)
+        key = (self.db_path, source, self.bins, self.sample_rows)
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None and cached['data_version'] == version:
+                _cache.move_to_end(key)
+                metrics.inc('sqlviz_table_profile_total', {'result': 'hit'})
+                return cached
+
+        conn = SQLService(self.user_id).get_connection()
+        try:
+            with span('table_profile'):
+                result = self.compute_profile(conn, *source)
+        finally:
+            conn.close()
+        result['data_version'] = version
+
+        with _cache_lock:
+            _cache[key] = result
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+        metrics.inc('sqlviz_table_profile_total', {'result': 'computed'})
+        return result
+
+    def resolve_table(self, table_name):
+        """Return (schema, table, columns) for a user table or a shared template table"""
+        catalog = get_catalog(self.db_path)
+        columns = catalog.columns(table_name)
+        if columns is not None:
+            name = next(n for n in catalog.table_names() if n.lower() == table_name.lower())
+            return ('main', name, tuple(c['column'] for c in columns))
+
+        shared = template_tables().get(table_name.lower())
+        if shared is None:
+            return None
+        schema, name = shared
+        return (schema, name, None)
+
+    def compute_profile(self, conn, schema, table, columns):
+        source = f"{schema}.{quote_identifier(table)}"
+        if columns is None:
+            columns = tuple(row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({quote_identifier(table)})"))
+
+        row_count = conn.execute(f"SELECT COUNT(*) FROM {source}").fetchone()[0]
+        where, sampled = self.sample_clause(conn, source, row_count)
+        relation = f"(SELECT * FROM {source}{where})"
+
+        # One pass over the (sampled) rows per chunk of columns for their aggregates
+        stats = []
+        for offset in range(0, max(len(columns), 1), COLUMNS_PER_PASS):
+            select_list = ["COUNT(*)"]
+            for column in columns[offset:offset + COLUMNS_PER_PASS]:
+                col = quote_identifier(column)
+                numeric = f"CASE WHEN typeof({col}) IN ('integer', 'real') THEN {col} END"
+                select_list += [
+                    f"COUNT({col})",
+                    f"COUNT(DISTINCT {col})",
+                    f"MIN({col})",
+                    f"MAX({col})",
+                    f"AVG({numeric})",
+                    f"MIN({numeric})",
+                    f"MAX({numeric})",
+                    f"COUNT({numeric})"
+                ]
+            row = conn.execute(f"SELECT {', '.join(select_list)} FROM {relation}").fetchone()
+            scanned = row[0]
+            stats += row[1:]
+        scale = row_count / scanned if sampled and scanned else 1
+
+        profiles = []
+        for i, column in enumerate(columns):
+            non_null, distinct, min_value, max_value, mean, num_min, num_max, num_count = \
+                stats[i * 8:(i + 1) * 8]
+            # A column that is (nearly) unique in the sample is assumed unique overall
+            distinct_estimate = distinct
+            if sampled and non_null and distinct >= 0.95 * non_null:
+                distinct_estimate = int(round(distinct * scale))
+            profiles.append({
+                'column': column,
+                'count': int(round(non_null * scale)),
+                'null_count': int(round((scanned - non_null) * scale)),
+                'distinct_estimate': distinct_estimate,
+                'min': min_value,
+                'max': max_value,
+                'mean': mean,
+                'numeric': num_count > 0 and num_count == non_null,
+                'histogram': None,
+                '_range': (num_min, num_max)
+            })
+
+        histograms_truncated = self.add_histograms(conn, relation, profiles, scale)
+        for p in profiles:
+            del p['_range']
+
+        return {
+            'table': table,
+            'schema': schema,
+            'row_count': row_count,
+            'sampled': sampled,
+            'rows_scanned': scanned,
+            'histograms_truncated': histograms_truncated,
+            'columns': profiles
+        }
+
+    def sample_clause(self, conn, source, row_count):
+        """Restrict big tables to a few evenly spaced rowid ranges"""
+        if row_count <= self.sample_rows:
+            return '', False
+        try:
+            low, high = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {source}").fetchone()
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID table
+            return f" LIMIT {int(self.sample_rows)}", True
+
+        span_width = high - low + 1
+        range_width = max(1, self.sample_rows // self.sample_ranges)
+        # Spread the ranges so the first starts at the lowest rowid and the last ends at the highest
+        step = (span_width - range_width) // max(1, self.sample_ranges - 1)
+        ranges = []
+        for i in range(self.sample_ranges):
+            start = low + i * step
+            ranges.append(f"rowid BETWEEN {start} AND {start + range_width - 1}")
+        return ' WHERE ' + ' OR '.join(ranges), True
+
+    def add_histograms(self, conn, relation, profiles, scale):
+        """Bucket numeric columns with one GROUP BY query; True if some were left out"""
+        parts = []
+        candidates = [(i, p) for i, p in enumerate(profiles) if p['numeric'] and p['_range'][0] is not None]
+        for i, p in candidates[:MAX_HISTOGRAM_COLUMNS]:
+            low, high = p['_range']
+            col = quote_identifier(p['column'])
+            if high == low:
+                bucket = '0'
+            else:
+                width = (high - low) / self.bins
+                bucket = f"MIN(CAST(({col} - {low!r}) / {width!r} AS INTEGER), {self.bins - 1})"
+            parts.append(f"SELECT {i} AS col, {bucket} AS bucket, COUNT(*) AS n FROM {relation} "
+                         f"WHERE {col} IS NOT NULL GROUP BY bucket")
+        if not parts:
+            return False
+
+        counts = {}
+        for col_index, bucket, n in conn.execute(' UNION ALL '.join(parts)).fetchall():
+            counts.setdefault(col_index, {})[bucket] = n
+
+        for i, buckets in counts.items():
+            p = profiles[i]
+            low, high = p['_range']
+            bins = self.bins if high != low else 1
+            width = (high - low) / bins if high != low else 0
+            p['histogram'] = [{
+                'start': low + b * width,
+                'end': low + (b + 1) * width if high != low else high,
+                'count': int(round(buckets.get(b, 0) * scale))
+            } for b in range(bins)]
+        return len(candidates) > MAX_HISTOGRAM_COLUMNS
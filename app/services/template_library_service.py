@@ -0,0 +1,265 @@
+import sqlite3
+import os
+import random
+import re
+from datetime import date, timedelta
+from urllib.parse import quote
+
+TEMPLATE_DIR = "shared_dbs"
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David',
+               'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas',
+               'Sarah', 'Priya', 'Wei', 'Carlos', 'Fatima', 'Kenji', 'Olga', 'Ahmed', 'Sofia']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Patel', 'Chen', 'Kim', 'Nguyen', 'Silva', 'Müller', 'Rossi', 'Khan']
+CITIES = ['New York', 'San Francisco', 'Chicago', 'Austin', 'Seattle', 'Boston', 'Denver', 'Atlanta']
+
+def _person(rng):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return f"{first} {last}", f"{first}.{last}".lower()
+
+def _build_hr(conn, rng):
+    departments = [
+        (1, 'Engineering', 'San Francisco', 2500000), (2, 'Sales', 'New York', 1200000),
+        (3, 'Marketing', 'New York', 800000), (4, 'Human Resources', 'Chicago', 400000),
+        (5, 'Finance', 'Chicago', 600000), (6, 'Customer Support', 'Austin', 500000),
+        (7, 'Product', 'Seattle', 900000), (8, 'Operations', 'Denver', 700000)
+    ]
+    conn.execute("""CREATE TABLE departments (
+        department_id INTEGER PRIMARY KEY,
+        department_name VARCHAR(100) NOT NULL,
+        location VARCHAR(100),
+        budget DECIMAL(12, 2)
+    )""")
+    conn.executemany("INSERT INTO departments VALUES (?, ?, ?, ?)", departments)
+
+    conn.execute("""CREATE TABLE employees (
+        employee_id INTEGER PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        email VARCHAR(120) NOT NULL,
+        department VARCHAR(100),
+        department_id INTEGER REFERENCES departments(department_id),
+        job_title VARCHAR(100),
+        salary DECIMAL(10, 2),
+        hire_date DATE,
+        manager_id INTEGER REFERENCES employees(employee_id)
+    )""")
+    titles = ['Associate', 'Specialist', 'Senior Specialist', 'Lead', 'Manager']
+    rows = []
+    for employee_id in range(1, 201):
+        name, handle = _person(rng)
+        department_id, department_name = departments[rng.randrange(len(departments))][:2]
+        level = rng.randrange(len(titles))
+        hire_date = date(2012, 1, 1) + timedelta(days=rng.randrange(4500))
+        manager_id = rng.randint(1, employee_id - 1) if employee_id > 8 else None
+        salary = round(45000 + level * 18000 + rng.uniform(-5000, 15000), 2)
+        rows.append((employee_id, name, f"{handle}{employee_id}@example.com", department_name, department_id,
+                     f"{department_name} {titles[level]}", salary, hire_date.isoformat(), manager_id))
+    conn.executemany("INSERT INTO employees VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.execute("CREATE INDEX idx_employees_department_id ON employees (department_id)")
+
+def _build_sales(conn, rng):
+    conn.execute("""CREATE TABLE customers (
+        customer_id INTEGER PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        email VARCHAR(120) NOT NULL,
+        city VARCHAR(100),
+        signup_date DATE
+    )""")
+    customers = []
+    for customer_id in range(1, 201):
+        name, handle = _person(rng)
+        signup = date(2019, 1, 1) + timedelta(days=rng.randrange(1800))
+        customers.append((customer_id, name, f"{handle}{customer_id}@example.com", rng.choice(CITIES),
+                          signup.isoformat()))
+    conn.executemany("INSERT INTO customers VALUES (?, ?, ?, ?, ?)", customers)
+
+    conn.execute("""CREATE TABLE products (
+        product_id INTEGER PRIMARY KEY,
+        product_name VARCHAR(100) NOT NULL,
+        category VARCHAR(50),
+        price DECIMAL(10, 2),
+        stock_quantity INTEGER
+    )""")
+    catalogue = {
+        'Electronics': ['Laptop', 'Headphones', 'Monitor', 'Keyboard', 'Webcam', 'Tablet'],
+        'Books': ['SQL Handbook', 'Data Science Primer', 'Mystery Novel', 'Cookbook', 'Travel Guide'],
+        'Home': ['Desk Lamp', 'Coffee Maker', 'Office Chair', 'Bookshelf', 'Blender'],
+        'Clothing': ['T-Shirt', 'Jacket', 'Sneakers', 'Backpack', 'Hoodie'],
+        'Sports': ['Yoga Mat', 'Dumbbells', 'Water Bottle', 'Running Shoes', 'Bicycle Helmet']
+    }
+    products = []
+    for category, names in catalogue.items():
+        for product_name in names:
+            products.append((len(products) + 1, product_name, category, round(rng.uniform(5, 1500), 2),
+                             rng.randint(0, 500)))
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?)", products)
+
+    conn.execute("""CREATE TABLE orders (
+        order_id INTEGER PRIMARY KEY,
+        customer_id INTEGER REFERENCES customers(customer_id),
+        product_id INTEGER REFERENCES products(product_id),
+        quantity INTEGER NOT NULL,
+        total_amount DECIMAL(10, 2),
+        order_date DATE,
+        status VARCHAR(20)
+    )""")
+    statuses = ['delivered', 'delivered', 'delivered', 'shipped', 'processing', 'cancelled']
+    orders = []
+    for order_id in range(1, 1001):
+        product = rng.choice(products)
+        quantity = rng.randint(1, 5)
+        order_date = date(2023, 1, 1) + timedelta(days=rng.randrange(730))
+        orders.append((order_id, rng.randint(1, len(customers)), product[0], quantity,
+                       round(product[3] * quantity, 2), order_date.isoformat(), rng.choice(statuses)))
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?, ?)", orders)
+    conn.execute("CREATE INDEX idx_orders_customer_id ON orders (customer_id)")
+    conn.execute("CREATE INDEX idx_orders_product_id ON orders (product_id)")
+
+# Template dataset name -> builder. Each dataset is ATTACHed as schema "tpl_<name>".
+TEMPLATE_DATASETS = {
+    'hr': _build_hr,
+    'sales': _build_sales
+}
+
+_template_tables = None
+_enabled = False
+
+def init_app(app):
+    """Build the template library and enable mounting it into user connections"""
+    global _enabled
+    _enabled = app.config.get('SHARED_TEMPLATES', True)
+    if _enabled:
+        build_template_library()
+
+def template_path(name):
+    return os.path.join(TEMPLATE_DIR, f"{name}.db")
+
+def build_template_library(force=False):
+    """Create any missing template databases; existing files are never modified in place"""
+    global _template_tables
+    os.makedirs(TEMPLATE_DIR, exist_ok=True)
+    for name, builder in TEMPLATE_DATASETS.items():
+        path = template_path(name)
+        if os.path.exists(path) and not force:
+            continue
+        temp_path = f"{path}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        conn = sqlite3.connect(temp_path)
+        try:
+            builder(conn, random.Random(f"template-{name}"))
+            conn.commit()
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(temp_path, path)
+    _template_tables = None
+
+def attached_templates():
+    """Return (schema, uri) pairs for every available template database"""
+    templates = []
+    if not _enabled:
+        return templates
+    for name in TEMPLATE_DATASETS:
+        path = template_path(name)
+        if os.path.exists(path):
+            uri = f"file:{quote(os.path.abspath(path))}?mode=ro&immutable=1"
+            templates.append((f"tpl_{name}", uri))
+    return templates
+
+def attach_templates(conn):
+    """ATTACH the shared templates read-only; unqualified names resolve to main first"""
+    for schema, uri in attached_templates():
+        conn.execute("ATTACH DATABASE ? AS " + schema, (uri,))
+
+def template_tables():
+    """Map each shared table name (lower-cased) to the schema that provides it"""
+    global _template_tables
+    if _template_tables is None:
+        tables = {}
+        for schema, uri in attached_templates():
+            conn = sqlite3.connect(uri, uri=True)
+            try:
+                for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"):
+                    if not table.startswith('sqlite_'):
+                        tables.setdefault(table.lower(), (schema, table))
+            finally:
+                conn.close()
+        _template_tables = tables
+    return _template_tables
+
+# CREATE INDEX/TRIGGER on a table in another database does not prepare, so
+# these are matched on the statement text instead
+CREATE_ON_PATTERNS = [
+    r'^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?\w+\s+ON\s+["`\[]?(\w+)',
+    r'^\s*CREATE\s+(?:TEMP\w*\s+)?TRIGGER\s+.*?\bON\s+["`\[]?(\w+)'
+]
+
+def write_targets(conn, query):
+    """Return {table: 'write' | 'drop' | 'rename'} for the tables a statement modifies.
+
+    The statement is prepared under an authorizer rather than matched with
+    patterns, so CTEs (WITH ... INSERT), quoting and comments are resolved
+    by SQLite itself. Nothing is executed.
+    """
+    targets = {}
+    altered = []
+    renamed = []
+
+    def authorizer(action, arg1, arg2, db_name, source):
+        if action == sqlite3.SQLITE_DROP_TABLE:
+            targets[arg1] = 'drop'
+        elif action == sqlite3.SQLITE_ALTER_TABLE:
+            altered.append(arg2)
+        elif action == sqlite3.SQLITE_FUNCTION and arg2 == 'sqlite_rename_table':
+            renamed.append(arg2)
+        elif action in (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE) \
+                and not arg1.startswith('sqlite_'):
+            targets.setdefault(arg1, 'write')
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        conn.execute(f"EXPLAIN {query}")
+    except sqlite3.Error:
+        # Invalid statements are left for the real execution to report
+        for pattern in CREATE_ON_PATTERNS:
+            match = re.match(pattern, query, re.IGNORECASE | re.DOTALL)
+            if match:
+                return {match.group(1): 'write'}
+        return {}
+    finally:
+        conn.set_authorizer(None)
+
+    for table in altered:
+        targets[table] = 'rename' if renamed else 'write'
+    return targets
+
+def copy_up(conn, table):
+    """Copy a shared template table into the user's private main database.
+
+    Returns the number of rows copied, or None if no copy was needed.
+    """
+    source = template_tables().get(table.lower())
+    if source is None:
+        return None
+
+    exists = conn.execute("SELECT 1 FROM main.sqlite_master WHERE type='table' AND name = ? COLLATE NOCASE",
+                          (table,)).fetchone()
+    if exists:
+        return None
+
+    schema, name = source
+    objects = conn.execute(
+        f"SELECT type, sql FROM {schema}.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL "
+        f"ORDER BY type = 'table' DESC",
+        (name,)
+    ).fetchall()
+
+    # Unqualified CREATE statements are created in main
+    for _, sql in objects:
+        conn.execute(sql)
+    cursor = conn.execute(f'INSERT INTO main."{name}" SELECT * FROM {schema}."{name}"')
+    return cursor.rowcount
@@ -1,26 +1,61 @@
 import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
+import numpy as np
 import json
+from plotly.io.json import to_json_plotly
+from app.result_set import ResultSet
+from app.services.metrics_service import span
+
+CHART_TYPES = ('table', 'bar', 'line', 'pie', 'scatter', 'histogram', 'heatmap', 'box')
+
+# Point charts sent in pages; later pages carry trace arrays only, for Plotly.extendTraces
+PAGED_CHART_TYPES = ('scatter', 'line')
+PAGE_ARRAY_KEYS = ('x', 'y', 'customdata', 'marker.color', 'marker.size')
 
 class VisualizationService:
-    def __init__(self):
-        pass
+    HISTOGRAM_BINS = 30
+    HEATMAP_BINS = 40
+    HEATMAP_MIN_ROWS = 20000  # below this a scatter plot is still readable
+    BOX_MIN_ROWS = 100
+    HISTOGRAM_MIN_ROWS = 1000  # numeric results too long to read as a table
+    WEBGL_MIN_POINTS = 1000  # scatter/line charts this large render with WebGL (scattergl)
+    PAGE_POINTS = 10000  # points per page of a scatter or line chart
     
-    def create_visualization(self, data, query_type, query_text):
-        """Create appropriate visualization based on query results"""
-        if not data or not isinstance(data, list):
+    def __init__(self, sql_service=None):
+        # With a SQLService, binning for SELECT queries is pushed down into SQLite
+        self.sql_service = sql_service
+    
+    def create_visualization(self, data, query_type, query_text, chart_type=None, total_rows=None, offset=0):
+        """Create appropriate visualization based on a query's ResultSet; offset > 0 returns a later page"""
+        if isinstance(data, list):
+            data = ResultSet.from_records(data)
+        if not data:
             return {'error': 'No data to visualize'}
         
         try:
-            # Convert data to DataFrame for easier manipulation
-            df = pd.DataFrame(data)
+            # Numeric columns become views of the ResultSet arrays, not copies
+            with span('viz_dataframe'):
+                df = data.to_dataframe()
             
             if df.empty:
                 return {'error': 'Empty dataset'}
             
             # Determine best visualization based on data characteristics
             viz_config = self.determine_visualization_type(df, query_type)
+            if chart_type and chart_type != viz_config['type']:
+                viz_config = self.configure_chart_type(df, chart_type)
+            viz_config.update({
+                'query_type': query_type,
+                'query_text': query_text,
+                'total_rows': total_rows,
+                'rows_in_memory': len(df)
+            })
+            
+            if offset:
+                if viz_config['type'] not in PAGED_CHART_TYPES:
+                    return {'error': f"{viz_config['type']} charts are not paged"}
+                return self.create_page(df, viz_config, offset)
             
             if viz_config['type'] == 'table':
                 return self.create_table_visualization(df)
@@ -32,12 +67,23 @@ class VisualizationService:
                 return self.create_pie_chart(df, viz_config)
             elif viz_config['type'] == 'scatter':
                 return self.create_scatter_plot(df, viz_config)
+            elif viz_config['type'] == 'histogram':
+                return self.create_histogram(df, viz_config)
+            elif viz_config['type'] == 'heatmap':
+                return self.create_heatmap(df, viz_config)
+            elif viz_config['type'] == 'box':
+                return self.create_box_plot(df, viz_config)
             else:
                 return self.create_table_visualization(df)
                 
         except Exception as e:
             return {'error': f'Visualization error: {str(e)}'}
     
+    def serialize_figure(self, fig):
+        """Serialize a Plotly figure to JSON for the front end"""
+        with span('viz_serialize'):
+            return fig.to_json()
+    
     def determine_visualization_type(self, df, query_type):
         """Determine the best visualization type based on data characteristics"""
         num_columns = len(df.columns)
@@ -56,7 +102,29 @@ class VisualizationService:
         }
         
         # Simple heuristics for visualization selection
-        if num_columns == 2 and len(numeric_columns) == 1 and len(categorical_columns) == 1:
+        if num_columns == 1 and len(numeric_columns) == 1 and num_rows >= self.HISTOGRAM_MIN_ROWS:
+            # A long single numeric column - distribution of its values
+            config.update({
+                'type': 'histogram',
+                'x_column': numeric_columns[0]
+            })
+        elif (num_columns == 2 and len(numeric_columns) == 1 and len(categorical_columns) == 1
+                and num_rows >= self.BOX_MIN_ROWS
+                and df[categorical_columns[0]].nunique() <= num_rows / 2):
+            # Many values per category - distribution per category
+            config.update({
+                'type': 'box',
+                'x_column': categorical_columns[0],
+                'y_column': numeric_columns[0]
+            })
+        elif num_columns == 2 and len(numeric_columns) == 2 and num_rows >= self.HEATMAP_MIN_ROWS:
+            # Too many points for a scatter plot - 2D density
+            config.update({
+                'type': 'heatmap',
+                'x_column': numeric_columns[0],
+                'y_column': numeric_columns[1]
+            })
+        elif num_columns == 2 and len(numeric_columns) == 1 and len(categorical_columns) == 1:
             # One categorical, one numeric - bar chart
             config.update({
                 'type': 'bar',
@@ -87,6 +155,46 @@ class VisualizationService:
                     'y_column': numeric_columns[0]
                 })
         
+        if config['type'] == 'table' and num_rows >= self.HISTOGRAM_MIN_ROWS and len(numeric_columns) == num_columns:
+            # Long all-numeric results are unreadable as a table; keys say nothing as a distribution
+            measures = [col for col in numeric_columns if not self.is_id_column(df, col)]
+            if measures:
+                config.update({
+                    'type': 'histogram',
+                    'x_column': measures[0]
+                })
+        
+        return config
+    
+    @staticmethod
+    def is_id_column(df, column):
+        """Key-like column: named id / *_id, or unique integers in increasing order"""
+        name = str(column).lower()
+        if name == 'id' or name.endswith('_id'):
+            return True
+        values = df[column]
+        return (pd.api.types.is_integer_dtype(values) and values.is_monotonic_increasing
+                and values.is_unique)
+    
+    def configure_chart_type(self, df, chart_type):
+        """Build the configuration for an explicitly requested chart type"""
+        numeric_columns = df.select_dtypes(include=['number']).columns.tolist()
+        categorical_columns = df.select_dtypes(include=['object']).columns.tolist()
+        config = {'type': chart_type, 'x_column': None, 'y_column': None, 'color_column': None}
+        
+        if chart_type == 'histogram' and numeric_columns:
+            config['x_column'] = numeric_columns[0]
+        elif chart_type in ('heatmap', 'scatter') and len(numeric_columns) >= 2:
+            config.update({'x_column': numeric_columns[0], 'y_column': numeric_columns[1]})
+        elif chart_type in ('box', 'bar') and numeric_columns and categorical_columns:
+            config.update({'x_column': categorical_columns[0], 'y_column': numeric_columns[0]})
+        elif chart_type == 'line' and numeric_columns:
+            config.update({'x_column': df.columns[0], 'y_column': numeric_columns[0]})
+        elif chart_type == 'pie' and numeric_columns and categorical_columns:
+            config.update({'labels_column': categorical_columns[0], 'values_column': numeric_columns[0]})
+        else:
+            config['type'] = 'table'
+        
         return config
     
     def create_table_visualization(self, df):
@@ -114,7 +222,7 @@ class VisualizationService:
             
             return {
                 'type': 'table',
-                'chart': fig.to_json(),
+                'chart': self.serialize_figure(fig),
                 'description': f'Table view of {len(df)} rows and {len(df.columns)} columns'
             }
             
@@ -144,7 +252,7 @@ class VisualizationService:
             
             return {
                 'type': 'bar',
-                'chart': fig.to_json(),
+                'chart': self.serialize_figure(fig),
                 'description': f'Bar chart showing {y_col} distribution across {x_col}'
             }
             
@@ -152,33 +260,42 @@ class VisualizationService:
             return {'error': f'Bar chart error: {str(e)}'}
     
     def create_line_chart(self, df, config):
-        """Create a line chart visualization"""
+        """Create a line chart visualization from the first page of points"""
         try:
             x_col = config['x_column']
             y_col = config['y_column']
             
-            fig = px.line(
-                df, 
-                x=x_col, 
-                y=y_col,
-                title=f'{y_col} over {x_col}',
-                markers=True
-            )
-            
-            fig.update_layout(
-                xaxis_title=x_col,
-                yaxis_title=y_col
-            )
+            fig = self.line_figure(df.iloc[:self.PAGE_POINTS], config, self.use_webgl(len(df)))
             
             return {
                 'type': 'line',
-                'chart': fig.to_json(),
-                'description': f'Line chart showing {y_col} trend over {x_col}'
+                'chart': self.serialize_figure(fig),
+                'description': f'Line chart showing {y_col} trend over {x_col}',
+                **self.paging(len(df), 0)
             }
             
         except Exception as e:
             return {'error': f'Line chart error: {str(e)}'}
     
+    def line_figure(self, df, config, webgl):
+        x_col = config['x_column']
+        y_col = config['y_column']
+        
+        fig = px.line(
+            df, 
+            x=x_col, 
+            y=y_col,
+            title=f'{y_col} over {x_col}',
+            markers=True,
+            render_mode='webgl' if webgl else 'svg'
+        )
+        
+        fig.update_layout(
+            xaxis_title=x_col,
+            yaxis_title=y_col
+        )
+        return fig
+    
     def create_pie_chart(self, df, config):
         """Create a pie chart visualization"""
         try:
@@ -194,7 +311,7 @@ class VisualizationService:
             
             return {
                 'type': 'pie',
-                'chart': fig.to_json(),
+                'chart': self.serialize_figure(fig),
                 'description': f'Pie chart showing distribution of {values_col} across {labels_col}'
             }
             
@@ -202,34 +319,290 @@ class VisualizationService:
             return {'error': f'Pie chart error: {str(e)}'}
     
     def create_scatter_plot(self, df, config):
-        """Create a scatter plot visualization"""
+        """Create a scatter plot visualization from the first page of points"""
         try:
             x_col = config['x_column']
             y_col = config['y_column']
             
-            fig = px.scatter(
-                df,
-                x=x_col,
-                y=y_col,
-                title=f'{y_col} vs {x_col}',
-                color=y_col,
-                size=y_col,
-                hover_data=df.columns.tolist()
+            fig = self.scatter_figure(df.iloc[:self.PAGE_POINTS], config, self.use_webgl(len(df)))
+            
+            return {
+                'type': 'scatter',
+                'chart': self.serialize_figure(fig),
+                'description': f'Scatter plot showing relationship between {x_col} and {y_col}',
+                **self.paging(len(df), 0)
+            }
+            
+        except Exception as e:
+            return {'error': f'Scatter plot error: {str(e)}'}
+    
+    def scatter_figure(self, df, config, webgl):
+        x_col = config['x_column']
+        y_col = config['y_column']
+        
+        fig = px.scatter(
+            df,
+            x=x_col,
+            y=y_col,
+            title=f'{y_col} vs {x_col}',
+            color=y_col,
+            size=y_col,
+            hover_data=df.columns.tolist(),
+            render_mode='webgl' if webgl else 'svg'
+        )
+        
+        fig.update_layout(
+            xaxis_title=x_col,
+            yaxis_title=y_col
+        )
+        return fig
+    
+    def use_webgl(self, points):
+        # SVG keeps one DOM node per point; WebGL stays interactive far past that
+        return points >= self.WEBGL_MIN_POINTS
+    
+    def paging(self, points, offset):
+        end = min(offset + self.PAGE_POINTS, points)
+        return {
+            'webgl': self.use_webgl(points),
+            'total_points': points,
+            'next_offset': end if end < points else None
+        }
+    
+    def create_page(self, df, config, offset):
+        """Trace arrays for points [offset, offset + PAGE_POINTS) of a scatter or line chart.
+        
+        The page is built with the same figure code as the first one, so its
+        arrays line up with the traces already on screen.
+        """
+        try:
+            page = df.iloc[offset:offset + self.PAGE_POINTS]
+            update = None
+            traces = []
+            if len(page):
+                figure = self.scatter_figure if config['type'] == 'scatter' else self.line_figure
+                fig = figure(page, config, self.use_webgl(len(df)))
+                update, traces = self.trace_arrays(fig)
+            
+            return {
+                'type': config['type'],
+                'offset': offset,
+                'update': update,
+                'traces': traces,
+                **self.paging(len(df), offset)
+            }
+            
+        except Exception as e:
+            return {'error': f'Chart page error: {str(e)}'}
+    
+    def trace_arrays(self, fig):
+        """JSON {key: [array per trace]} of the per-point arrays of every trace"""
+        update = {}
+        for key in PAGE_ARRAY_KEYS:
+            values = [trace[key] for trace in fig.data]
+            # extendTraces needs the key on every trace; scalars (one colour for all) stay as they are
+            if values and all(v is not None and not isinstance(v, (str, int, float)) for v in values):
+                update[key] = [v.tolist() if hasattr(v, 'tolist') else list(v) for v in values]
+        with span('viz_serialize'):
+            # Plain lists rather than binary arrays, which extendTraces does not decode
+            return to_json_plotly(update), list(range(len(fig.data)))
+    
+    def can_push_down(self, config):
+        # Re-running the query costs more than binning rows already in memory,
+        # so SQLite only does the binning when we hold a truncated result
+        total_rows = config.get('total_rows')
+        return (self.sql_service is not None and config.get('query_type') == 'SELECT'
+                and total_rows is not None and total_rows > config.get('rows_in_memory', 0))
+    
+    def run_pushdown(self, sql, params=()):
+        """Run an aggregate over the user's query inside SQLite, read-only"""
+        conn = self.sql_service.get_connection()
+        try:
+            conn.execute("PRAGMA query_only = ON")
+            with span('viz_pushdown'):
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def subquery(query_text):
+        return query_text.strip().rstrip(';')
+    
+    @staticmethod
+    def quote(column):
+        return '"' + str(column).replace('"', '""') + '"'
+    
+    @staticmethod
+    def bucket_expression(column, low, high, bins):
+        """SQL for the 0-based bin of a value; the last bin is closed like numpy's"""
+        return (f"CASE WHEN {high} = {low} THEN 0 "
+                f"ELSE MIN(CAST(({column} - {low}) * {bins} * 1.0 / ({high} - {low}) AS INTEGER), {bins} - 1) END")
+    
+    def bin_1d(self, df, config, bins):
+        """Return (edges, counts) for the x column, computed in SQLite when possible"""
+        column = config['x_column']
+        if self.can_push_down(config):
+            try:
+                x = self.quote(column)
+                # One statement: the CTE is scanned for the range and again for the buckets
+                rows = self.run_pushdown(
+                    f"WITH src AS (SELECT {x} AS x FROM ({self.subquery(config['query_text'])}) WHERE {x} IS NOT NULL), "
+                    f"r AS (SELECT MIN(x) AS lo, MAX(x) AS hi FROM src) "
+                    f"SELECT {self.bucket_expression('x', 'r.lo', 'r.hi', bins)} AS b, COUNT(*), r.lo, r.hi "
+                    f"FROM src, r GROUP BY b"
+                )
+                if rows:
+                    low, high = rows[0][2], rows[0][3]
+                    counts = np.zeros(bins, dtype=int)
+                    for b, n, _, _ in rows:
+                        counts[b] = n
+                    if high == low:
+                        return np.array([low - 0.5, low + 0.5]), counts[:1]
+                    return np.linspace(low, high, bins + 1), counts
+            except Exception as e:
+                print(f"Histogram pushdown failed, binning in Python: {str(e)}")
+        
+        with span('viz_binning'):
+            values = pd.to_numeric(df[column], errors='coerce').dropna().to_numpy()
+            if len(values) and values.min() == values.max():
+                bins = 1  # a single value gets a single bar, as in SQLite
+            counts, edges = np.histogram(values, bins=bins)
+        return edges, counts
+    
+    def bin_2d(self, df, config, bins):
+        """Return (x_edges, y_edges, counts[y][x]) for the x/y columns"""
+        x_name, y_name = config['x_column'], config['y_column']
+        if self.can_push_down(config):
+            try:
+                x, y = self.quote(x_name), self.quote(y_name)
+                rows = self.run_pushdown(
+                    f"WITH src AS (SELECT {x} AS x, {y} AS y FROM ({self.subquery(config['query_text'])}) "
+                    f"WHERE {x} IS NOT NULL AND {y} IS NOT NULL), "
+                    f"r AS (SELECT MIN(x) AS xlo, MAX(x) AS xhi, MIN(y) AS ylo, MAX(y) AS yhi FROM src) "
+                    f"SELECT {self.bucket_expression('x', 'r.xlo', 'r.xhi', bins)} AS bx, "
+                    f"{self.bucket_expression('y', 'r.ylo', 'r.yhi', bins)} AS by, COUNT(*), "
+                    f"r.xlo, r.xhi, r.ylo, r.yhi FROM src, r GROUP BY bx, by"
+                )
+                if rows:
+                    x_low, x_high, y_low, y_high = rows[0][3:]
+                    counts = np.zeros((bins, bins), dtype=int)
+                    for bx, by, n, *_ in rows:
+                        counts[by][bx] = n
+                    x_edges = np.linspace(x_low, x_high, bins + 1) if x_high != x_low else np.array([x_low - 0.5, x_low + 0.5])
+                    y_edges = np.linspace(y_low, y_high, bins + 1) if y_high != y_low else np.array([y_low - 0.5, y_low + 0.5])
+                    return x_edges, y_edges, counts[:len(y_edges) - 1, :len(x_edges) - 1]
+            except Exception as e:
+                print(f"Heatmap pushdown failed, binning in Python: {str(e)}")
+        
+        with span('viz_binning'):
+            values = df[[x_name, y_name]].apply(pd.to_numeric, errors='coerce').dropna()
+            counts, x_edges, y_edges = np.histogram2d(values[x_name].to_numpy(), values[y_name].to_numpy(), bins=bins)
+        return x_edges, y_edges, counts.T.astype(int)
+    
+    def create_histogram(self, df, config):
+        """Create a histogram from server-side bin counts"""
+        try:
+            x_col = config['x_column']
+            edges, counts = self.bin_1d(df, config, self.HISTOGRAM_BINS)
+            
+            fig = go.Figure(data=[go.Bar(
+                x=((edges[:-1] + edges[1:]) / 2).tolist(),
+                y=counts.tolist(),
+                width=np.diff(edges).tolist() if edges[-1] != edges[0] else None,
+                marker_color='#636efa'
+            )])
+            fig.update_layout(
+                title=f'Distribution of {x_col}',
+                xaxis_title=x_col,
+                yaxis_title='count',
+                bargap=0.02
             )
             
+            return {
+                'type': 'histogram',
+                'chart': self.serialize_figure(fig),
+                'description': f'Histogram of {x_col} across {int(counts.sum())} values in {len(counts)} bins'
+            }
+            
+        except Exception as e:
+            return {'error': f'Histogram error: {str(e)}'}
+    
+    def create_heatmap(self, df, config):
+        """Create a 2D density heatmap from server-side bin counts"""
+        try:
+            x_col = config['x_column']
+            y_col = config['y_column']
+            x_edges, y_edges, counts = self.bin_2d(df, config, self.HEATMAP_BINS)
+            
+            fig = go.Figure(data=[go.Heatmap(
+                x=((x_edges[:-1] + x_edges[1:]) / 2).tolist(),
+                y=((y_edges[:-1] + y_edges[1:]) / 2).tolist(),
+                z=counts.tolist(),
+                colorscale='Viridis',
+                colorbar=dict(title='count')
+            )])
             fig.update_layout(
+                title=f'Density of {y_col} vs {x_col}',
                 xaxis_title=x_col,
                 yaxis_title=y_col
             )
             
             return {
-                'type': 'scatter',
-                'chart': fig.to_json(),
-                'description': f'Scatter plot showing relationship between {x_col} and {y_col}'
+                'type': 'heatmap',
+                'chart': self.serialize_figure(fig),
+                'description': f'Heatmap of {int(counts.sum())} points of {y_col} vs {x_col}'
             }
             
         except Exception as e:
-            return {'error': f'Scatter plot error: {str(e)}'}
+            return {'error': f'Heatmap error: {str(e)}'}
+    
+    def create_box_plot(self, df, config):
+        """Create a box plot from per-category quartiles computed on the server"""
+        try:
+            x_col = config['x_column']
+            y_col = config['y_column']
+            
+            with span('viz_binning'):
+                values = pd.to_numeric(df[y_col], errors='coerce')
+                grouped = values.groupby(df[x_col].astype(str))
+                stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+                stats.columns = ['q1', 'median', 'q3']
+                stats['mean'] = grouped.mean()
+                stats['min'] = grouped.min()
+                stats['max'] = grouped.max()
+                stats = stats.dropna(subset=['median'])
+            
+            # Whiskers stop at 1.5 IQR like Plotly's own box plots
+            iqr = stats['q3'] - stats['q1']
+            lower = np.maximum(stats['min'], stats['q1'] - 1.5 * iqr)
+            upper = np.minimum(stats['max'], stats['q3'] + 1.5 * iqr)
+            
+            fig = go.Figure(data=[go.Box(
+                x=stats.index.tolist(),
+                q1=stats['q1'].tolist(),
+                median=stats['median'].tolist(),
+                q3=stats['q3'].tolist(),
+                mean=stats['mean'].tolist(),
+                lowerfence=lower.tolist(),
+                upperfence=upper.tolist(),
+                boxpoints=False,
+                marker_color='#636efa'
+            )])
+            fig.update_layout(
+                title=f'{y_col} by {x_col}',
+                xaxis_title=x_col,
+                yaxis_title=y_col,
+                showlegend=False
+            )
+            
+            return {
+                'type': 'box',
+                'chart': self.serialize_figure(fig),
+                'description': f'Box plot of {y_col} for {len(stats)} values of {x_col}'
+            }
+            
+        except Exception as e:
+            return {'error': f'Box plot error: {str(e)}'}
     
     def create_query_flow_diagram(self, query_text, query_type):
         """Create a visual representation of SQL query execution flow"""
@@ -281,7 +654,7 @@ class VisualizationService:
             
             return {
                 'type': 'flow',
-                'chart': fig.to_json(),
+                'chart': self.serialize_figure(fig),
                 'description': f'Execution flow for {query_type} query'
             }
             
@@ -322,3 +695,7 @@ class VisualizationService:
     def parse_delete_query(self, query):
         """Parse DELETE query to identify execution steps"""
         return ['Find Records', 'Apply WHERE Filter', 'DELETE Records']
+
+def init_app(app):
+    VisualizationService.WEBGL_MIN_POINTS = app.config['WEBGL_MIN_POINTS']
+    VisualizationService.PAGE_POINTS = app.config['CHART_PAGE_POINTS']
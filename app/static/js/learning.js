@@ -8,13 +8,7 @@ async function loadLearningTopic(topic) {
         // Show loading state
         topicBtn.innerHTML = '<div class="d-flex justify-content-between align-items-center"><div><strong>Loading...</strong></div><i class="fas fa-spinner fa-spin"></i></div>';
         
-        const response = await fetch('/api/generate-learning-content', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ topic: topic })
-        });
+        const response = await fetch(`/api/learning-content/${encodeURIComponent(topic)}`);
         
         const result = await response.json();
         
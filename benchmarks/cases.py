@@ -0,0 +1,134 @@
+import random
+import sqlite3
+from datetime import date, timedelta
+
+BENCH_TABLE = 'bench_events'
+
+# Queries shaped so VisualizationService picks each chart type
+VISUALIZATION_QUERIES = {
+    'table': f'SELECT id, category, amount, quantity FROM {BENCH_TABLE}',
+    'bar': f'SELECT category, amount FROM {BENCH_TABLE}',
+    'scatter': f'SELECT amount, quantity FROM {BENCH_TABLE}',
+    'line': f'SELECT event_date, amount, quantity FROM {BENCH_TABLE}',
+    'pie': f'SELECT category, quantity AS count, amount FROM {BENCH_TABLE}',
+    'histogram': f'SELECT amount FROM {BENCH_TABLE}',
+    'heatmap': f'SELECT amount, quantity FROM {BENCH_TABLE}',
+    'box': f'SELECT category, amount FROM {BENCH_TABLE}'
+}
+
+# Queries charted without a chart type, with the type auto-selection should pick
+# (None: histogram for results of HISTOGRAM_MIN_ROWS or more, otherwise table)
+AUTO_VISUALIZATION_QUERIES = {
+    'count': (f'SELECT COUNT(*) FROM {BENCH_TABLE}', 'table'),
+    'rows': (f'SELECT id, category, amount, quantity FROM {BENCH_TABLE}', 'table'),
+    'keyed_numbers': (f"SELECT id, amount, quantity FROM {BENCH_TABLE} WHERE category = 'Books'", None),
+    'by_category': (f'SELECT category, SUM(amount) AS total FROM {BENCH_TABLE} GROUP BY category', 'bar'),
+    'amounts': (f'SELECT amount FROM {BENCH_TABLE}', None)
+}
+
+def seed_user_database(db_path, size, seed=42):
+    """Create the benchmark table with `size` deterministic rows"""
+    rng = random.Random(seed)
+    categories = ['Electronics', 'Books', 'Clothing', 'Garden', 'Toys', 'Sports', 'Food', 'Music']
+    start = date(2020, 1, 1)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(f'DROP TABLE IF EXISTS {BENCH_TABLE}')
+        conn.execute(f'''CREATE TABLE {BENCH_TABLE} (
+            id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            event_date TEXT NOT NULL
+        )''')
+        rows = (
+            (i, rng.choice(categories), round(rng.uniform(1, 1000), 2), rng.randint(1, 50),
+             (start + timedelta(days=i % 1500)).isoformat())
+            for i in range(1, size + 1)
+        )
+        conn.executemany(f'INSERT INTO {BENCH_TABLE} VALUES (?, ?, ?, ?, ?)', rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+def build_cases(app, client, user_id, size):
+    """Return (name, callable) pairs for one data size"""
+    from app.services.history_logger_service import history_logger
+    from app.services.sql_service import SQLService
+    from app.services.visualization_service import VisualizationService
+
+    sql_service = SQLService(user_id)
+    viz_service = VisualizationService()
+    pushdown_viz_service = VisualizationService(sql_service)
+    select_all = f'SELECT * FROM {BENCH_TABLE}'
+
+    cases = []
+
+    def execute_query():
+        result = sql_service.execute_query(select_all)
+        assert result.get('success'), result.get('error')
+
+    cases.append(('sql_service.execute_query', execute_query))
+
+    for chart_type, query in VISUALIZATION_QUERIES.items():
+        data = sql_service.execute_query(query)['result_set']
+
+        def create_visualization(data=data, query=query, chart_type=chart_type):
+            viz = viz_service.create_visualization(data, 'SELECT', query, chart_type=chart_type)
+            assert viz.get('type') == chart_type, viz.get('error') or viz.get('type')
+
+        cases.append((f'visualization.{chart_type}', create_visualization))
+
+    for name, (query, expected) in AUTO_VISUALIZATION_QUERIES.items():
+        data = sql_service.execute_query(query)['result_set']
+        if expected is None:
+            expected = 'histogram' if len(data) >= VisualizationService.HISTOGRAM_MIN_ROWS else 'table'
+
+        def create_auto_visualization(data=data, query=query, expected=expected):
+            viz = viz_service.create_visualization(data, 'SELECT', query)
+            assert viz.get('type') == expected, viz.get('error') or viz.get('type')
+
+        cases.append((f'visualization.auto.{name}', create_auto_visualization))
+
+    # Binned charts again with the aggregation pushed down into SQLite
+    for chart_type in ('histogram', 'heatmap'):
+        query = VISUALIZATION_QUERIES[chart_type]
+        data = sql_service.execute_query(query)['result_set']
+
+        def create_pushdown_visualization(data=data, query=query, chart_type=chart_type):
+            # Only the first rows are in memory, as with a truncated result
+            viz = pushdown_viz_service.create_visualization(data.head(100), 'SELECT', query, chart_type=chart_type,
+                                                            total_rows=len(data))
+            assert viz.get('type') == chart_type, viz.get('error') or viz.get('type')
+
+        cases.append((f'visualization.{chart_type}.pushdown', create_pushdown_visualization))
+
+    history_rows = sql_service.execute_query(select_all)['result_set']
+
+    def log_history():
+        with app.test_request_context():
+            history_logger.log(
+                user_id=user_id,
+                query_text=select_all,
+                query_type='SELECT',
+                execution_time=0.0,
+                result_count=len(history_rows),
+                result_data=history_rows
+            )
+
+    def persist_history():
+        # Time until the record is in the database, not just queued
+        log_history()
+        history_logger.flush()
+
+    cases.append(('sql_query.enqueue', log_history))
+    cases.append(('sql_query.persist', persist_history))
+
+    def execute_sql_route():
+        response = client.post('/execute-sql', json={'query': select_all})
+        assert response.status_code == 200, response.get_data(as_text=True)[:200]
+
+    cases.append(('route.execute_sql', execute_sql_route))
+
+    return cases
@@ -0,0 +1,46 @@
+import re
+
+class FakeGeminiService:
+    """Local stand-in for GeminiService so benchmarks never hit the network"""
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+
+    def test_connection(self):
+        return {'success': True, 'message': 'API key is valid'}
+
+    def analyze_query_and_create_tables(self, query):
+        tables = []
+        for name in dict.fromkeys(re.findall(r'\b(?:FROM|JOIN)\s+(\w+)', query, re.IGNORECASE)):
+            tables.append({
+                'name': name,
+                'create_statement': f'CREATE TABLE {name} (id INTEGER PRIMARY KEY, name TEXT, value REAL)',
+                'schema': [
+                    {'column': 'id', 'type': 'INTEGER', 'constraints': 'PRIMARY KEY'},
+                    {'column': 'name', 'type': 'TEXT', 'constraints': ''},
+                    {'column': 'value', 'type': 'REAL', 'constraints': ''}
+                ],
+                'insert_statements': [
+                    f"INSERT INTO {name} (id, name, value) VALUES ({i}, 'row {i}', {i * 1.5})"
+                    for i in range(1, 11)
+                ]
+            })
+        return {'tables': tables, 'explanation': 'Tables generated by the benchmark fake'}
+
+    def analyze_query_and_create_tables_stream(self, query):
+        analysis = self.analyze_query_and_create_tables(query)
+        for table_info in analysis['tables']:
+            yield 'table', table_info
+        yield 'done', {'explanation': analysis['explanation']}
+
+    def explain_sql_query(self, query):
+        return {'explanation': f'## Explanation\n\n`{query}`', 'format': 'markdown'}
+
+    def suggest_query_improvements(self, query):
+        return {'suggestions': f'## Suggestions\n\n`{query}`', 'format': 'markdown'}
+
+    def generate_sample_data(self, table_schema, row_count=10):
+        return {'insert_statements': ''}
+
+    def generate_learning_content(self, topic):
+        return {'content': f'# {topic}', 'format': 'markdown'}
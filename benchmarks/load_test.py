@@ -0,0 +1,146 @@
+"""Concurrent /execute-sql load test for the app metadata database.
+
+Runs several worker processes (like gunicorn workers) that share one
+metadata database and hammer /execute-sql, once with the SQLite tuning
+disabled and once with it enabled, and reports throughput and errors:
+
+    python -m benchmarks.load_test --workers 4 --requests 200
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+QUERY = 'SELECT id, category, amount FROM bench_events LIMIT 50'
+
+def _configure_environment(work_dir, tuning, encryption_key):
+    os.chdir(work_dir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'load_meta.db')}"
+    os.environ['ENCRYPTION_KEY'] = encryption_key
+    os.environ['SQLITE_TUNING'] = 'true' if tuning else 'false'
+    os.environ['SHARED_TEMPLATES'] = 'false'
+
+def _create_app():
+    from app import create_app
+    import app.routes.main as main_routes
+    from benchmarks.fakes import FakeGeminiService
+
+    main_routes.GeminiService = FakeGeminiService
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+def worker(work_dir, tuning, encryption_key, user_id, request_count, start_event, results):
+    _configure_environment(work_dir, tuning, encryption_key)
+    app = _create_app()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    start_event.wait()
+    ok = errors = locked = 0
+    latencies = []
+    for _ in range(request_count):
+        start = time.perf_counter()
+        response = client.post('/execute-sql', json={'query': QUERY})
+        latencies.append(time.perf_counter() - start)
+        body = response.get_json(silent=True) or {}
+        if response.status_code == 200 and not body.get('error'):
+            ok += 1
+        else:
+            errors += 1
+            if 'locked' in str(body.get('error', '')):
+                locked += 1
+    # Spawned workers exit without running atexit hooks
+    from app.services.history_logger_service import history_logger
+    history_logger.flush(timeout=30)
+    results.put({'ok': ok, 'errors': errors, 'locked': locked, 'latencies': latencies})
+
+def run_scenario(tuning, workers, request_count):
+    """Run one load scenario in a fresh working directory"""
+    from cryptography.fernet import Fernet
+    from benchmarks.cases import seed_user_database
+
+    work_dir = tempfile.mkdtemp(prefix='sqlviz-load-')
+    encryption_key = Fernet.generate_key().decode()
+    cwd = os.getcwd()
+    _configure_environment(work_dir, tuning, encryption_key)
+
+    from app import db
+    from app.models import User
+    app = _create_app()
+    with app.app_context():
+        user = User(username='load', email='load@example.com')
+        user.set_password('load-test')
+        db.session.add(user)
+        db.session.commit()
+        user.set_gemini_api_key('AIzaLoadTestFakeKey')
+        user_id = user.id
+        db.engine.dispose()
+
+    os.makedirs('user_dbs', exist_ok=True)
+    seed_user_database(f'user_dbs/user_{user_id}.db', 1000)
+    os.chdir(cwd)
+
+    ctx = multiprocessing.get_context('spawn')
+    start_event = ctx.Event()
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker, args=(work_dir, tuning, encryption_key, user_id, request_count,
+                                         start_event, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # Give every worker time to import and build its app before the clock starts
+    time.sleep(3)
+    started = time.perf_counter()
+    start_event.set()
+    outcomes = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    latencies = sorted(l for o in outcomes for l in o['latencies'])
+    total_ok = sum(o['ok'] for o in outcomes)
+    return {
+        'sqlite_tuning': tuning,
+        'workers': workers,
+        'requests': workers * request_count,
+        'ok': total_ok,
+        'errors': sum(o['errors'] for o in outcomes),
+        'database_locked': sum(o['locked'] for o in outcomes),
+        'elapsed': elapsed,
+        'throughput_rps': total_ok / elapsed if elapsed else 0.0,
+        'p50_latency': latencies[len(latencies) // 2] if latencies else None,
+        'p95_latency': latencies[int(len(latencies) * 0.95)] if latencies else None
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent /execute-sql load test')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per worker')
+    parser.add_argument('--output', default=None, help='Write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    scenarios = [run_scenario(tuning, args.workers, args.requests) for tuning in (False, True)]
+    for s in scenarios:
+        print(f"tuning={'on ' if s['sqlite_tuning'] else 'off'}  {s['throughput_rps']:8.1f} req/s  "
+              f"errors={s['errors']} locked={s['database_locked']}  p95={s['p95_latency'] * 1000:.1f} ms",
+              file=sys.stderr)
+
+    text = json.dumps({'scenarios': scenarios}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
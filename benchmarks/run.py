@@ -0,0 +1,195 @@
+"""Benchmark runner for the query -> visualize pipeline.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run --sizes 1000,10000,100000 --output bench.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+    python -m benchmarks.run --sizes 1000,1000000 --save-baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SQL Visualizer query pipeline')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='Comma separated row counts (e.g. 1000,10000,100000,1000000)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed warm-up runs per case')
+    parser.add_argument('--filter', default=None, help='Only run cases whose name contains this text')
+    parser.add_argument('--output', default=None, help='Write JSON results to this file (default: stdout)')
+    parser.add_argument('--compare', default=None, help='Baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.20,
+                        help='Relative slowdown of the median that counts as a regression')
+    parser.add_argument('--save-baseline', default=None, help='Also write results to this baseline file')
+    parser.add_argument('--memory', action='store_true',
+                        help='Also record peak traced memory of one extra run per case (tracemalloc)')
+    return parser.parse_args(argv)
+
+def prepare_environment():
+    """Point the app at a throwaway working directory and metadata database"""
+    work_dir = tempfile.mkdtemp(prefix='sqlviz-bench-')
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo_root)
+    os.chdir(work_dir)
+
+    from cryptography.fernet import Fernet
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench_meta.db')}"
+    os.environ['ENCRYPTION_KEY'] = Fernet.generate_key().decode()
+    return work_dir
+
+def bootstrap_app():
+    """Create the app, a benchmark user and a logged-in test client"""
+    from app import create_app, db
+    from app.models import User
+    import app.routes.main as main_routes
+    from benchmarks.fakes import FakeGeminiService
+
+    # Gemini is replaced with a local fake for the whole run
+    main_routes.GeminiService = FakeGeminiService
+
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        user.set_gemini_api_key('AIzaBenchmarkFakeKey')
+        user_id = user.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    return app, client, user_id
+
+def time_case(func, repeat, warmup):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'runs': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0
+    }
+
+def measure_peak_memory(func):
+    """Peak bytes allocated by Python during one call, across all threads"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run(args):
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    prepare_environment()
+
+    from benchmarks.cases import build_cases, seed_user_database
+
+    app, client, user_id = bootstrap_app()
+    os.makedirs('user_dbs', exist_ok=True)
+    db_path = f'user_dbs/user_{user_id}.db'
+
+    results = []
+    for size in sizes:
+        seed_user_database(db_path, size)
+        for name, func in build_cases(app, client, user_id, size):
+            if args.filter and args.filter not in name:
+                continue
+            stats = time_case(func, args.repeat, args.warmup)
+            stats.update({'name': name, 'size': size})
+            memory = ''
+            if args.memory:
+                stats['peak_bytes'] = measure_peak_memory(func)
+                memory = f"  peak {stats['peak_bytes'] / 1e6:8.1f} MB"
+            results.append(stats)
+            print(f"{name:<32} {size:>9,} rows  median {stats['median'] * 1000:10.2f} ms{memory}",
+                  file=sys.stderr)
+
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'repeat': args.repeat,
+            'sizes': sizes
+        },
+        'results': results
+    }
+
+def compare(current, baseline, threshold):
+    """Return per-case median ratios and the subset that regressed"""
+    baseline_index = {(r['name'], r['size']): r for r in baseline.get('results', [])}
+    comparisons = []
+    for result in current['results']:
+        base = baseline_index.get((result['name'], result['size']))
+        if not base or not base.get('median'):
+            continue
+        ratio = result['median'] / base['median']
+        comparisons.append({
+            'name': result['name'],
+            'size': result['size'],
+            'baseline_median': base['median'],
+            'median': result['median'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold
+        })
+    return comparisons
+
+def main(argv=None):
+    args = parse_args(argv)
+    cwd = os.getcwd()
+    output = run(args)
+    os.chdir(cwd)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparisons = compare(output, baseline, args.threshold)
+        output['comparison'] = {'baseline': args.compare, 'threshold': args.threshold, 'cases': comparisons}
+        regressions = [c for c in comparisons if c['regression']]
+        for c in regressions:
+            print(f"REGRESSION {c['name']} @ {c['size']:,} rows: {c['ratio']:.2f}x baseline median",
+                  file=sys.stderr)
+        if regressions:
+            exit_code = 1
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text)
+
+    return exit_code
+
+if __name__ == '__main__':
+    sys.exit(main())
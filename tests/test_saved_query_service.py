@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Sandboxes live under the relative user_dbs/ directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('ENCRYPTION_KEY', Fernet.generate_key().decode())
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.setenv('SANDBOX_MAINTENANCE', 'false')
+    monkeypatch.setenv('HISTORY_WRITE_BEHIND', 'false')
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        yield app
+
+@pytest.fixture
+def user_id(app):
+    from app import db
+    from app.models import User
+    user = User(username='tester', email='tester@example.com')
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def test_count_star_materialization_goes_stale_after_insert(user_id):
+    from app.services.saved_query_service import SavedQueryService
+    from app.services.sql_service import SQLService
+
+    sql_service = SQLService(user_id)
+    assert sql_service.execute_query("CREATE TABLE people (id INTEGER PRIMARY KEY, name TEXT)")['success']
+    for i in range(10):
+        assert sql_service.execute_query(f"INSERT INTO people (name) VALUES ('p{i}')")['success']
+
+    service = SavedQueryService(user_id)
+    saved_query = service.save('People', 'SELECT COUNT(*) AS n FROM people', materialized=True)
+
+    conn = sql_service.get_connection()
+    try:
+        assert service.dependencies(conn, 'SELECT COUNT(*) AS n FROM people') == [['main', 'people']]
+    finally:
+        conn.close()
+
+    result = service.results(saved_query)
+    assert result['status'] == 'fresh'
+    assert result['values'] == [[10]]
+
+    assert sql_service.execute_query("INSERT INTO people (name) VALUES ('p10')")['success']
+
+    result = service.results(saved_query)
+    assert result['status'] == 'refreshed'
+    assert result['values'] == [[11]]